@@ -13,14 +13,16 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 
 import os
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables from .env file; deployments that inject the environment can set LOAD_DOTENV=False
+if os.getenv('LOAD_DOTENV', 'True').lower() == 'true':
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -48,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'quickbooks.instrumentation.QueryCountMiddleware',
+    'quickbooks.db_router.PrimaryPinningMiddleware',
+    'quickbooks.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,6 +62,37 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# API callers authenticate with a service token (Authorization: Bearer <token>) instead of a session,
+# so requests never read the session table. SERVICE_API_TOKENS="dashboard:<token>,jobs:<token>";
+# while it is empty the API stays open
+SERVICE_API_TOKENS = dict(
+    entry.split(':', 1) for entry in os.getenv('SERVICE_API_TOKENS', '').split(',') if ':' in entry
+)
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['quickbooks.authentication.ServiceTokenAuthentication'],
+    'DEFAULT_PERMISSION_CLASSES': ['quickbooks.authentication.HasServiceToken'],
+}
+
+# API-only workers (API_ONLY=True) drop the admin, sessions, messages and static files
+# apps and their middleware, and render JSON only, for less work per request
+API_ONLY = os.getenv('API_ONLY', 'False').lower() == 'true'
+if API_ONLY:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+    )]
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in (
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    )]
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = ['rest_framework.renderers.JSONRenderer']
+    REST_FRAMEWORK['UNAUTHENTICATED_USER'] = None
+
 ROOT_URLCONF = 'predicta_backend.urls'
 
 TEMPLATES = [
@@ -81,29 +117,67 @@ WSGI_APPLICATION = 'predicta_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.sqlite3',
-#         'NAME': BASE_DIR / 'db.sqlite3',
-#     }
-# }
+# The storage profile is picked with DB_PROFILE:
+#   mssql    - Azure SQL (production, default)
+#   postgres - local or hosted PostgreSQL
+#   sqlite   - local file in WAL mode, used for tests and benchmarks
+DB_PROFILE = os.getenv('DB_PROFILE', 'mssql')
 
-
-DATABASES = {
-    'default': {
-        # 'ENGINE': 'django_mssql_backend',
+DATABASE_PROFILES = {
+    'mssql': {
         'ENGINE': 'mssql',
-        'NAME': 'Predicta_Portal_DB',
-        'USER': 'qb_dev',
-        'PASSWORD': 'FsBTB8zXz0s6kPXM',
-        'HOST': 'predicta.database.windows.net',  # or IP address
-        'PORT': '1433',  # Default SQL Server port
+        'NAME': os.getenv('DB_NAME'),
+        'USER': os.getenv('DB_USER'),
+        'PASSWORD': os.getenv('DB_PASSWORD'),
+        'HOST': os.getenv('DB_HOST'),
+        'PORT': os.getenv('DB_PORT', '1433'),
         'OPTIONS': {
-            'driver': 'ODBC Driver 17 for SQL Server',
+            'driver': os.getenv('DB_ODBC_DRIVER', 'ODBC Driver 17 for SQL Server'),
         },
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('DB_NAME', 'quickbooks'),
+        'USER': os.getenv('DB_USER', 'postgres'),
+        'PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+    },
+    'sqlite': {
+        # Django's SQLite backend with BEGIN IMMEDIATE transactions, so concurrent syncs queue instead of failing
+        'ENGINE': 'quickbooks.db_backends.sqlite3',
+        # A path of its own: DB_NAME holds the server database's name
+        'NAME': os.getenv('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
+        # Seconds to wait on a locked database; WAL pragmas are applied in quickbooks/storage.py
+        'OPTIONS': {'timeout': 20},
+    },
+}
+
+if DB_PROFILE not in DATABASE_PROFILES:
+    raise ImproperlyConfigured(f"Unknown DB_PROFILE {DB_PROFILE!r}; expected one of {', '.join(DATABASE_PROFILES)}")
+
+DATABASES = {
+    'default': {
+        **DATABASE_PROFILES[DB_PROFILE],
+        # Keep connections open across requests instead of paying the connection handshake every time;
+        # health checks replace connections the server has dropped before they are reused.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replica for mirror-table reads (see quickbooks/db_router.py).
+# Pointing DB_REPLICA_NAME at the same SQLite file as default gives a second alias for local testing.
+if os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST', DATABASES['default'].get('HOST', '')),
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['quickbooks.db_router.ReadReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -135,6 +209,9 @@ USE_I18N = True
 USE_TZ = True
 
 
+LOG_DIR = BASE_DIR / 'logs'
+LOG_DIR.mkdir(exist_ok=True)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -152,7 +229,7 @@ LOGGING = {
         'file': {
             'level': 'DEBUG',
             'class': 'logging.FileHandler',
-            'filename': 'logs/debug.log',
+            'filename': LOG_DIR / 'debug.log',
             'formatter': 'verbose',
         },
     },
@@ -188,4 +265,40 @@ REDIRECT_URI = os.getenv('REDIRECT_URI')
 SCOPE = os.getenv('SCOPE')
 AUTHORIZATION_BASE_URL=os.getenv('AUTHORIZATION_BASE_URL')
 TOKEN_URL=os.getenv('TOKEN_URL')
-QUICKBOOKURL=os.getenv('QUICKBOOKURL')
\ No newline at end of file
+QUICKBOOKURL=os.getenv('QUICKBOOKURL')
+
+# Expose per-request DB query / upstream call counts as X-DB-* and X-Upstream-* response headers
+QUICKBOOKS_DEBUG_HEADERS = os.getenv('QUICKBOOKS_DEBUG_HEADERS', 'False').lower() == 'true'
+
+# Upstream resilience: (connect, read) timeout in seconds, circuit breakers and bulkheads
+QUICKBOOKS_TIMEOUT = (float(os.getenv('QUICKBOOKS_CONNECT_TIMEOUT', '3.05')), float(os.getenv('QUICKBOOKS_READ_TIMEOUT', '20')))
+QUICKBOOKS_BREAKER_FAILURES = int(os.getenv('QUICKBOOKS_BREAKER_FAILURES', '5'))
+QUICKBOOKS_GLOBAL_BREAKER_FAILURES = int(os.getenv('QUICKBOOKS_GLOBAL_BREAKER_FAILURES', '25'))
+QUICKBOOKS_BREAKER_RESET_SECONDS = float(os.getenv('QUICKBOOKS_BREAKER_RESET_SECONDS', '30'))
+QUICKBOOKS_REALM_CONCURRENCY = int(os.getenv('QUICKBOOKS_REALM_CONCURRENCY', '4'))
+QUICKBOOKS_GLOBAL_CONCURRENCY = int(os.getenv('QUICKBOOKS_GLOBAL_CONCURRENCY', '32'))
+QUICKBOOKS_BULKHEAD_WAIT_SECONDS = float(os.getenv('QUICKBOOKS_BULKHEAD_WAIT_SECONDS', '1'))
+
+# Cache shared by all workers (tokens and hot entities): Redis or memcached when configured,
+# otherwise a file cache that the workers on this host share
+if os.getenv('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv('REDIS_URL')}}
+elif os.getenv('MEMCACHED_LOCATION'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': os.getenv('MEMCACHED_LOCATION')}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / 'cache'))}}
+CACHES['default']['KEY_PREFIX'] = 'quickbooks'
+QUICKBOOKS_CACHE_ALIAS = 'default'
+QUICKBOOKS_TOKEN_CACHE_TTL = int(os.getenv('QUICKBOOKS_TOKEN_CACHE_TTL', '300'))
+QUICKBOOKS_ENTITY_CACHE_TTL = int(os.getenv('QUICKBOOKS_ENTITY_CACHE_TTL', '120'))
+QUICKBOOKS_QUERY_CACHE_TTL = int(os.getenv('QUICKBOOKS_QUERY_CACHE_TTL', '30'))
+
+# Memory budget shared by the in-process ID -> name snapshots of all realms
+QUICKBOOKS_SNAPSHOT_MAX_BYTES = int(os.getenv('QUICKBOOKS_SNAPSHOT_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Optional write-behind of create/update results to the mirror: buffered per model and flushed
+# in bulk every INTERVAL_MS or MAX_ROWS, journaled to JOURNAL until flushed
+QUICKBOOKS_WRITE_BEHIND = os.getenv('QUICKBOOKS_WRITE_BEHIND', 'False').lower() == 'true'
+QUICKBOOKS_WRITE_BEHIND_INTERVAL_MS = int(os.getenv('QUICKBOOKS_WRITE_BEHIND_INTERVAL_MS', '200'))
+QUICKBOOKS_WRITE_BEHIND_MAX_ROWS = int(os.getenv('QUICKBOOKS_WRITE_BEHIND_MAX_ROWS', '500'))
+QUICKBOOKS_WRITE_BEHIND_JOURNAL = os.getenv('QUICKBOOKS_WRITE_BEHIND_JOURNAL', str(BASE_DIR / 'journal'))
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'predicta_backend.settings')
 
 application = get_wsgi_application()
+
+# Import the URLconf, and with it every view, while booting. On its own this only moves the
+# cost off the first request; workers forked from a preloading master (gunicorn --preload) share it
+from django.urls import get_resolver  # noqa: E402
+get_resolver().url_patterns
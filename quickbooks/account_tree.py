@@ -0,0 +1,61 @@
+# quickbooks/account_tree.py
+from django.db.models import OuterRef, Subquery
+from .models import Account, AccountTreeRollup
+import logging
+logger = logging.getLogger('quickbooks')
+
+TREE_FIELDS = ('id', 'id_ref', 'fully_qualified_name', 'parent_id', 'path', 'depth')
+
+
+def parent_name(fully_qualified_name):
+    if ':' not in fully_qualified_name:
+        return None
+    return fully_qualified_name.rsplit(':', 1)[0]
+
+
+def rebuild_account_tree(realm_id):
+    """
+    Recompute parent links and materialized paths for a realm's chart of accounts.
+    Parents are resolved from fully_qualified_name; only rows whose position changed are written.
+    """
+    accounts = list(Account.objects.filter(realm_id=realm_id).only(*TREE_FIELDS))
+    by_name = {account.fully_qualified_name: account for account in accounts}
+    computed = {}
+
+    def locate(account):
+        if account.id in computed:
+            return computed[account.id]
+        parent = by_name.get(parent_name(account.fully_qualified_name))
+        if parent is None or parent.id == account.id:
+            computed[account.id] = (None, f"/{account.id_ref}/", 0)
+        else:
+            _, parent_path, parent_depth = locate(parent)
+            computed[account.id] = (parent.id, f"{parent_path}{account.id_ref}/", parent_depth + 1)
+        return computed[account.id]
+
+    changed = []
+    for account in accounts:
+        parent_id, path, depth = locate(account)
+        if (account.parent_id, account.path, account.depth) != (parent_id, path, depth):
+            account.parent_id, account.path, account.depth = parent_id, path, depth
+            changed.append(account)
+    if changed:
+        Account.objects.bulk_update(changed, ['parent', 'path', 'depth'], batch_size=500)
+    logger.debug(f"Account tree rebuilt for realm {realm_id}: {len(changed)} rows moved")
+    return len(changed)
+
+
+def account_subtree(realm_id, root_path):
+    """The account at root_path and all of its descendants, with rolled-up subtree balances."""
+    subtree_balance = AccountTreeRollup.objects.filter(
+        realm_id=OuterRef('realm_id'), path=OuterRef('fully_qualified_name'),
+    ).values('total_balance')[:1]
+    return (
+        Account.objects.filter(realm_id=realm_id, path__startswith=root_path)
+        .annotate(subtree_balance=Subquery(subtree_balance))
+        .order_by('path')
+        .values(
+            'id_ref', 'name', 'fully_qualified_name', 'parent__id_ref', 'depth', 'active',
+            'current_balance', 'current_balance_with_sub_accounts', 'subtree_balance',
+        )
+    )
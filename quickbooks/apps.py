@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class QuickbooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quickbooks'
+
+    def ready(self):
+        from . import shared_cache, storage
+        storage.connect_signals()
+        shared_cache.connect_signals()
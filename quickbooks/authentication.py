@@ -0,0 +1,51 @@
+# quickbooks/authentication.py
+"""
+Service-to-service auth for the JSON API: a static bearer token checked against
+SERVICE_API_TOKENS, with no session or user lookup in the database.
+
+While SERVICE_API_TOKENS is empty, every request is let through as before.
+"""
+import hmac
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+
+
+class ServiceUser:
+    """request.user for a caller authenticated by service token."""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class ServiceTokenAuthentication(BaseAuthentication):
+    keyword = b'bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword:
+            return None
+        if not settings.SERVICE_API_TOKENS:
+            # Unconfigured API: stay open, whatever the caller sends
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid service token header.')
+        token = auth[1]
+        for name, expected in settings.SERVICE_API_TOKENS.items():
+            if hmac.compare_digest(token, expected.encode()):
+                return ServiceUser(name), name
+        raise AuthenticationFailed('Invalid service token.')
+
+    def authenticate_header(self, request):
+        return 'Bearer'
+
+
+class HasServiceToken(BasePermission):
+    def has_permission(self, request, view):
+        return not settings.SERVICE_API_TOKENS or request.auth is not None
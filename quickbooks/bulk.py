@@ -0,0 +1,142 @@
+# quickbooks/bulk.py
+"""
+Bulk insert-or-update for the mirror tables, using each backend's native upsert:
+INSERT ... ON CONFLICT on SQLite and PostgreSQL, MERGE on SQL Server, and a
+select + bulk_update + bulk_create fallback anywhere else.
+"""
+from django.db import connections, router
+
+UPSERT_BATCH_SIZE = 1000
+# Bound parameters per statement
+POSTGRES_MAX_PARAMS = 65535
+MSSQL_MAX_PARAMS = 2100
+# SQL Server caps a table value constructor at 1000 rows
+MSSQL_MAX_ROWS = 1000
+
+
+def bulk_upsert(model, objs, update_fields, unique_fields=('realm_id', 'id_ref')):
+    """
+    Insert or update objs by their unique key in a constant number of statements,
+    instead of the two queries per row of update_or_create.
+    """
+    # A statement may not touch the same row twice, so the last copy of a key wins
+    objs = list({tuple(getattr(obj, field) for field in unique_fields): obj for obj in objs}.values())
+    if not objs:
+        return 0
+
+    connection = connections[router.db_for_write(model)]
+    update_fields = list(update_fields)
+    unique_fields = list(unique_fields)
+    if connection.vendor == 'sqlite' and connection.features.supports_update_conflicts_with_target:
+        _upsert_on_conflict(connection, model, objs, update_fields, unique_fields, max_params=None)
+    elif connection.vendor == 'postgresql':
+        _upsert_on_conflict(connection, model, objs, update_fields, unique_fields, max_params=POSTGRES_MAX_PARAMS)
+    elif connection.vendor == 'microsoft':
+        _upsert_merge(connection, model, objs, update_fields, unique_fields)
+    else:
+        _upsert_fallback(model, objs, update_fields, unique_fields)
+    return len(objs)
+
+
+def bulk_insert(model, objs):
+    """Plain bulk insert; a single executemany on SQLite rather than one statement per 999 bound parameters."""
+    objs = list(objs)
+    if not objs:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor != 'sqlite':
+        model.objects.bulk_create(objs, batch_size=UPSERT_BATCH_SIZE)
+        return len(objs)
+
+    qn = connection.ops.quote_name
+    fields = _insert_fields(model)
+    sql = (
+        f"INSERT INTO {qn(model._meta.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+        f"VALUES ({', '.join(['%s'] * len(fields))})"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [_row_params(connection, fields, obj) for obj in objs])
+    return len(objs)
+
+
+def _insert_fields(model):
+    return [field for field in model._meta.concrete_fields if not field.primary_key]
+
+
+def _row_params(connection, fields, obj):
+    return [field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields]
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _upsert_on_conflict(connection, model, objs, update_fields, unique_fields, max_params):
+    qn = connection.ops.quote_name
+    fields = _insert_fields(model)
+    columns = ', '.join(qn(field.column) for field in fields)
+    conflict = ', '.join(qn(model._meta.get_field(name).column) for name in unique_fields)
+    assignments = ', '.join(
+        f"{qn(column)} = EXCLUDED.{qn(column)}"
+        for column in (model._meta.get_field(name).column for name in update_fields)
+    )
+    row_placeholder = f"({', '.join(['%s'] * len(fields))})"
+    rows = [_row_params(connection, fields, obj) for obj in objs]
+
+    with connection.cursor() as cursor:
+        if max_params is None:
+            # SQLite: one prepared statement stepped once per row, in a single executemany call
+            sql = f"INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES {row_placeholder} ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+            cursor.executemany(sql, rows)
+            return
+        for chunk in _chunks(rows, max(max_params // len(fields), 1)):
+            sql = (
+                f"INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES {', '.join([row_placeholder] * len(chunk))} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+            )
+            cursor.execute(sql, [param for row in chunk for param in row])
+
+
+def _upsert_merge(connection, model, objs, update_fields, unique_fields):
+    qn = connection.ops.quote_name
+    fields = _insert_fields(model)
+    columns = [qn(field.column) for field in fields]
+    match = ' AND '.join(
+        f"target.{qn(column)} = source.{qn(column)}"
+        for column in (model._meta.get_field(name).column for name in unique_fields)
+    )
+    assignments = ', '.join(
+        f"target.{qn(column)} = source.{qn(column)}"
+        for column in (model._meta.get_field(name).column for name in update_fields)
+    )
+    row_placeholder = f"({', '.join(['%s'] * len(fields))})"
+    rows = [_row_params(connection, fields, obj) for obj in objs]
+    chunk_size = max(min(MSSQL_MAX_PARAMS // len(fields) - 1, MSSQL_MAX_ROWS), 1)
+
+    with connection.cursor() as cursor:
+        for chunk in _chunks(rows, chunk_size):
+            sql = (
+                f"MERGE INTO {qn(model._meta.db_table)} WITH (HOLDLOCK) AS target "
+                f"USING (VALUES {', '.join([row_placeholder] * len(chunk))}) AS source ({', '.join(columns)}) "
+                f"ON {match} "
+                f"WHEN MATCHED THEN UPDATE SET {assignments} "
+                f"WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join(f'source.{column}' for column in columns)});"
+            )
+            cursor.execute(sql, [param for row in chunk for param in row])
+
+
+def _upsert_fallback(model, objs, update_fields, unique_fields):
+    lookup = {f'{field}__in': {getattr(obj, field) for obj in objs} for field in unique_fields}
+    existing = {
+        tuple(row[:-1]): row[-1]
+        for row in model.objects.filter(**lookup).values_list(*unique_fields, 'pk')
+    }
+    to_update, to_create = [], []
+    for obj in objs:
+        obj.pk = existing.get(tuple(getattr(obj, field) for field in unique_fields))
+        (to_update if obj.pk else to_create).append(obj)
+    if to_update:
+        model.objects.bulk_update(to_update, update_fields, batch_size=UPSERT_BATCH_SIZE)
+    if to_create:
+        model.objects.bulk_create(to_create, batch_size=UPSERT_BATCH_SIZE)
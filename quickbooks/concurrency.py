@@ -0,0 +1,85 @@
+# quickbooks/concurrency.py
+"""
+Optimistic concurrency for updates without the client round trips.
+
+The SyncToken is filled in from the mirror when the caller leaves it out, or
+fetched from QuickBooks when the mirror does not have the entity either. When
+QuickBooks rejects the update as stale, only that entity is refetched, the
+caller's changes are rebased onto it as a sparse update, and the update is
+retried once.
+"""
+import json
+from django.conf import settings
+from .models import Account, CustomerInfo, Employee, CompanyInfo
+from . import upstream
+import logging
+logger = logging.getLogger('quickbooks')
+
+STALE_OBJECT_CODE = '5010'
+ENTITY_MODELS = {'Account': Account, 'Customer': CustomerInfo, 'Employee': Employee, 'CompanyInfo': CompanyInfo}
+# Maintained by QuickBooks, never sent back on a rebased update
+SERVER_FIELDS = ('MetaData', 'domain', 'sparse', 'SyncToken')
+
+
+def mirror_sync_token(realm_id, entity, id_ref):
+    return ENTITY_MODELS[entity].objects.filter(realm_id=realm_id, id_ref=id_ref).values_list('sync_token', flat=True).first()
+
+
+def is_stale_object(response):
+    if response.status_code != 400:
+        return False
+    try:
+        errors = response.json().get('Fault', {}).get('Error', [])
+    except ValueError:
+        return False
+    return any(str(error.get('code')) == STALE_OBJECT_CODE for error in errors)
+
+
+def supplied(value, sent=None):
+    """
+    The parts of an update payload the caller actually set: nulls and empty objects/lists
+    dropped, except nulls the request body `sent` sets explicitly.
+    """
+    if not isinstance(value, dict):
+        return value
+    sent = sent if isinstance(sent, dict) else {}
+    kept = {
+        key: supplied(item, sent.get(key)) for key, item in value.items()
+        if item is not None or (key in sent and sent[key] is None)
+    }
+    return {key: item for key, item in kept.items() if item not in ({}, [])}
+
+
+def rebase(payload, sync_token):
+    # The payload is already reduced to the caller's fields by minimal_update
+    changes = {key: value for key, value in payload.items() if key not in SERVER_FIELDS}
+    return {**changes, 'Id': payload['Id'], 'SyncToken': sync_token, 'sparse': True}
+
+
+def fetch_current(realm_id, entity, id_ref, headers):
+    return upstream.get(f'{settings.QUICKBOOKURL}/{realm_id}/{entity.lower()}/{id_ref}', realm_id=realm_id, headers=headers)
+
+
+def post_update(realm_id, entity, url, headers, payload):
+    """POST an update to QuickBooks, resolving the SyncToken server-side; returns the final upstream response."""
+    id_ref = payload.get('Id')
+    if id_ref and payload.get('SyncToken') in (None, ''):
+        sync_token = mirror_sync_token(realm_id, entity, id_ref)
+        if sync_token in (None, ''):
+            # Not mirrored yet: QuickBooks rejects a missing SyncToken outright, not as stale
+            current = fetch_current(realm_id, entity, id_ref, headers)
+            if current.status_code != 200:
+                return current
+            sync_token = current.json().get(entity, {}).get('SyncToken')
+        payload = {**payload, 'SyncToken': sync_token}
+
+    response = upstream.post(url, realm_id=realm_id, headers=headers, data=json.dumps(payload))
+    if not id_ref or not is_stale_object(response):
+        return response
+
+    current = fetch_current(realm_id, entity, id_ref, headers)
+    if current.status_code != 200:
+        return response
+    sync_token = current.json().get(entity, {}).get('SyncToken')
+    logger.info(f"Stale SyncToken for {entity} {id_ref} in realm {realm_id}, retrying at SyncToken {sync_token}")
+    return upstream.post(url, realm_id=realm_id, headers=headers, data=json.dumps(rebase(payload, sync_token)))
@@ -0,0 +1,72 @@
+# quickbooks/conditional.py
+"""
+ETag / If-None-Match support for the entity read endpoints.
+
+An entity's version is its SyncToken plus LastUpdatedTime, so the ETag can be
+computed from the QuickBooks response or from the mirror row alike. When the
+mirror already holds the version the client has, the view answers 304 without
+calling QuickBooks.
+"""
+from datetime import datetime
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+CACHE_CONTROL = 'private, no-cache'
+
+
+def entity_etag(sync_token, last_updated_time):
+    if sync_token in (None, ''):
+        return None
+    if isinstance(last_updated_time, str):
+        last_updated_time = parse_datetime(last_updated_time)
+    version = int(last_updated_time.timestamp()) if isinstance(last_updated_time, datetime) else 0
+    # Weak: the JSON we render is equivalent, not byte-identical, across versions of this service
+    return f'W/"{sync_token}-{version}"'
+
+
+def etag_from_entity(entity):
+    return entity_etag(entity.get('SyncToken'), entity.get('MetaData', {}).get('LastUpdatedTime'))
+
+
+def client_has(request, etag):
+    """Weak comparison of etag against the request's If-None-Match header."""
+    header = request.headers.get('If-None-Match')
+    if not header or not etag:
+        return False
+    client_etags = parse_etags(header)
+    if '*' in client_etags:
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(client_etag.removeprefix('W/') == opaque for client_etag in client_etags)
+
+
+def not_modified(etag):
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def not_modified_from_mirror(request, model, realm_id, id_ref):
+    """A 304 response when the mirrored version of the entity matches If-None-Match, else None."""
+    if not request.headers.get('If-None-Match'):
+        return None
+    row = model.objects.filter(realm_id=realm_id, id_ref=id_ref).values('sync_token', 'last_updated_time').first()
+    if not row:
+        return None
+    etag = entity_etag(row['sync_token'], row['last_updated_time'])
+    return not_modified(etag) if client_has(request, etag) else None
+
+
+def with_etag(request, response, entity):
+    """Tag a successful entity response, or swap it for a 304 when the client already has that version."""
+    etag = etag_from_entity(entity)
+    if not etag:
+        return response
+    if client_has(request, etag):
+        return not_modified(etag)
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
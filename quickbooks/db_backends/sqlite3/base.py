@@ -0,0 +1,16 @@
+# quickbooks/db_backends/sqlite3/base.py
+"""
+SQLite backend whose transactions take the write lock up front.
+
+Django opens transactions with a deferred BEGIN, which upgrades to a write lock at
+the first write. When two syncs have both read inside their transactions, the
+upgrade fails at once with "database is locked"; busy_timeout cannot wait it out,
+because waiting could deadlock. BEGIN IMMEDIATE queues writers at the start of the
+transaction instead, where busy_timeout applies. WAL readers are unaffected.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
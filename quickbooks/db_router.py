@@ -0,0 +1,55 @@
+# quickbooks/db_router.py
+"""
+Sends mirror-table reads to the 'replica' alias and everything else to 'default'.
+
+Reads stay on the primary when there is no replica configured, inside a transaction
+on the primary, and for the rest of a request once it has written anything
+(read-your-writes); PrimaryPinningMiddleware resets that pin per request.
+"""
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+
+REPLICA_ALIAS = 'replica'
+PRIMARY_ALIAS = 'default'
+MIRROR_MODELS = {'account', 'customerinfo', 'employee', 'companyinfo'}
+
+_pinned = ContextVar('quickbooks_primary_pinned', default=False)
+
+
+def pin_to_primary():
+    _pinned.set(True)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'quickbooks' or model._meta.model_name not in MIRROR_MODELS:
+            return None
+        if REPLICA_ALIAS not in settings.DATABASES or _pinned.get():
+            return PRIMARY_ALIAS
+        if connections[PRIMARY_ALIAS].in_atomic_block:
+            return PRIMARY_ALIAS
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return PRIMARY_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica receives schema and data from the primary
+        return db != REPLICA_ALIAS
+
+
+class PrimaryPinningMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _pinned.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
@@ -0,0 +1,128 @@
+# quickbooks/instrumentation.py
+"""
+Per-request and per-sync counters for DB queries and upstream QuickBooks calls.
+
+    with track("sync accounts") as metrics:
+        insert_accounts(realm_id, response)
+    metrics.db_queries, metrics.upstream_calls
+
+QueryCountMiddleware tracks every request, logs the totals and, when
+QUICKBOOKS_DEBUG_HEADERS is on, returns them as X-DB-* / X-Upstream-* headers.
+"""
+import time
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+import logging
+logger = logging.getLogger('quickbooks')
+
+_active = ContextVar('quickbooks_metrics', default=())
+
+
+class Metrics:
+    def __init__(self, label, capture_sql=False):
+        self.label = label
+        self.capture_sql = capture_sql
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.upstream_calls = 0
+        self.upstream_time = 0.0
+        self.elapsed = 0.0
+        self.sql = []
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.perf_counter() - started
+            if self.capture_sql:
+                self.sql.append(sql)
+
+    def as_dict(self):
+        return {
+            'db_queries': self.db_queries,
+            'db_time_ms': round(self.db_time * 1000, 2),
+            'upstream_calls': self.upstream_calls,
+            'upstream_time_ms': round(self.upstream_time * 1000, 2),
+            'elapsed_ms': round(self.elapsed * 1000, 2),
+        }
+
+    def __str__(self):
+        return f"{self.label}: " + ", ".join(f"{key}={value}" for key, value in self.as_dict().items())
+
+
+@contextmanager
+def track(label, capture_sql=False):
+    """Count DB queries (on every connection alias) and upstream calls made inside the block."""
+    metrics = Metrics(label, capture_sql)
+    token = _active.set(_active.get() + (metrics,))
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.db_wrapper))
+            yield metrics
+    finally:
+        metrics.elapsed = time.perf_counter() - started
+        _active.reset(token)
+
+
+def record_upstream(seconds):
+    for metrics in _active.get():
+        metrics.upstream_calls += 1
+        metrics.upstream_time += seconds
+
+
+@contextmanager
+def track_sync(entity, realm_id, rows):
+    """track() for a sync job, logging the totals together with the row count."""
+    with track(f"sync {entity} realm={realm_id}") as metrics:
+        yield metrics
+    logger.info(f"{metrics}, rows={rows}")
+
+
+class QueryCountMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track(f"{request.method} {request.path}") as metrics:
+            response = self.get_response(request)
+        logger.debug(str(metrics))
+        if getattr(settings, 'QUICKBOOKS_DEBUG_HEADERS', False):
+            response['X-DB-Queries'] = str(metrics.db_queries)
+            response['X-DB-Time-Ms'] = f"{metrics.db_time * 1000:.2f}"
+            response['X-Upstream-Calls'] = str(metrics.upstream_calls)
+            response['X-Upstream-Time-Ms'] = f"{metrics.upstream_time * 1000:.2f}"
+        return response
+
+
+@contextmanager
+def assert_max_queries(budget, label='block'):
+    """Fail with the captured SQL when the block runs more than `budget` queries."""
+    with track(label, capture_sql=True) as metrics:
+        yield metrics
+    if metrics.db_queries > budget:
+        queries = "\n".join(f"  {i}. {sql}" for i, sql in enumerate(metrics.sql, 1))
+        raise AssertionError(f"{label} ran {metrics.db_queries} queries, budget is {budget}:\n{queries}")
+
+
+def assert_constant_queries(run, sizes=(10, 100), slack=0, label='sync'):
+    """
+    Call run(n) for each size and fail when the query count grows with n.
+
+    slack allows for bulk statements that a backend splits into batches
+    (e.g. SQLite's bound-parameter limit); a per-row query pattern still fails.
+    """
+    counts = {}
+    for size in sizes:
+        with track(f"{label} n={size}") as metrics:
+            run(size)
+        counts[size] = metrics.db_queries
+    smallest, largest = counts[min(sizes)], counts[max(sizes)]
+    if largest - smallest > slack:
+        raise AssertionError(f"{label} query count grows with row count: {counts}")
+    return counts
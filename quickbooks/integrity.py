@@ -0,0 +1,66 @@
+# quickbooks/integrity.py
+"""
+Cheap mirror integrity checks over (id_ref, SyncToken).
+
+The realm's (Id, SyncToken) pairs in QuickBooks are diffed against the live mirror
+rows, and only the entities that differ are fetched in full: stale or missing ones
+are refetched by ID, and the ones QuickBooks no longer has are tombstoned. Entities
+that match cost nothing beyond the (Id, SyncToken) listing. QuickBooks cannot
+digest its side, so that listing is downloaded in full and compared directly.
+"""
+from django.conf import settings
+from .lookup import id_queries
+from .sync_runs import sync_run
+from .tombstones import TOMBSTONE_MODELS, auth_headers, tombstone, upstream_sync_tokens
+from . import shared_cache, upstream
+import logging
+logger = logging.getLogger('quickbooks')
+
+
+def drift(local, remote):
+    """IDs to refetch (stale or missing locally) and IDs gone from QuickBooks."""
+    stale = [id_ref for id_ref, sync_token in remote.items() if local.get(id_ref) != sync_token]
+    gone = [id_ref for id_ref in local if id_ref not in remote]
+    return stale, gone
+
+
+def verify_mirror(realm_id, entity, write=None):
+    """
+    Compare the mirror with QuickBooks. With a `write(realm_id, records)` mirror
+    writer the drift is repaired; without one it is only reported. Nothing is
+    touched when QuickBooks' listing does not add up to its count.
+    """
+    headers = auth_headers(realm_id)
+    model = TOMBSTONE_MODELS[entity]
+    with sync_run(realm_id, f'{entity} verify') as run:
+        # Read the mirror first, so an entity created while the IDs are paged cannot look deleted
+        with run.stage('map'):
+            local = dict(model.objects.filter(realm_id=realm_id, deleted_at__isnull=True).values_list('id_ref', 'sync_token'))
+        with run.stage('fetch'):
+            remote = upstream_sync_tokens(realm_id, entity, headers, run)
+        with run.stage('map'):
+            stale, gone = drift(local, remote)
+
+        if write is not None and (stale or gone):
+            records = []
+            with run.stage('fetch'):
+                for query in id_queries(entity, stale, include_inactive=True):
+                    response = upstream.get(f'{settings.QUICKBOOKURL}/{realm_id}/query', realm_id=realm_id, headers=headers, params={'query': query})
+                    response.raise_for_status()
+                    run.page(response)
+                    records.extend(response.json().get('QueryResponse', {}).get(entity, []))
+            with run.stage('write'):
+                if records:
+                    write(realm_id, records)
+                    shared_cache.invalidate_entities(realm_id, entity)
+                new = sum(1 for record in records if record['Id'] not in local)
+                run.add(rows_inserted=new, rows_updated=len(records) - new, rows_deleted=tombstone(realm_id, entity, gone))
+
+    summary = {
+        'checked': len(remote),
+        'stale': len(stale),
+        'gone': len(gone),
+        'repaired': write is not None,
+    }
+    logger.info(f"Verified {entity} mirror for realm {realm_id}: {summary}")
+    return summary
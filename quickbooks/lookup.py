@@ -0,0 +1,78 @@
+# quickbooks/lookup.py
+"""
+Resolve many entity IDs in one call: one indexed IN query per entity type against
+the mirror, and for IDs the mirror does not have, `select * from <Entity> where Id
+in (...)` queries to QuickBooks, a chunk of IDs at a time.
+
+With view=names, accounts and customers are answered from the realm's in-memory
+snapshot (quickbooks/snapshot.py) as {name, type or company, balance} entries instead.
+"""
+from .mirror import mirror_columns, mirror_entity
+from .models import Account, CustomerInfo, Employee
+from .snapshot import SNAPSHOT_SOURCES
+from . import snapshot
+
+RESOLVABLE_MODELS = {'Account': Account, 'Customer': CustomerInfo, 'Employee': Employee}
+MAX_RESOLVE_IDS = 1000
+# QuickBooks returns at most 100 rows per query unless told otherwise, and keeps the URL short
+UPSTREAM_ID_CHUNK = 100
+
+
+def parse_resolve_request(data):
+    """{entity: [id_ref, ...]} from the request body, de-duplicated; raises ValueError when malformed."""
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f"Body must map entity types ({', '.join(RESOLVABLE_MODELS)}) to lists of IDs.")
+    requested = {}
+    for entity, id_refs in data.items():
+        if entity not in RESOLVABLE_MODELS:
+            raise ValueError(f"Unknown entity type: {entity}")
+        if not isinstance(id_refs, list) or not all(isinstance(id_ref, (str, int)) for id_ref in id_refs):
+            raise ValueError(f"{entity} must be a list of IDs.")
+        requested[entity] = list(dict.fromkeys(str(id_ref) for id_ref in id_refs))
+    if sum(len(id_refs) for id_refs in requested.values()) > MAX_RESOLVE_IDS:
+        raise ValueError(f"At most {MAX_RESOLVE_IDS} IDs per request.")
+    return requested
+
+
+def mirror_rows(realm_id, entity, id_refs):
+    """
+    The mirrored IDs, keyed by id_ref, in a single query: each maps to the entity in
+    QuickBooks' shape, or to None when it is a tombstone.
+    """
+    if not id_refs:
+        return {}
+    rows = RESOLVABLE_MODELS[entity].objects.filter(realm_id=realm_id, id_ref__in=id_refs).values(*mirror_columns(entity), 'deleted_at')
+    return {row['id_ref']: None if row['deleted_at'] else mirror_entity(entity, row) for row in rows}
+
+
+def full_entities(realm_id, ids_by_entity):
+    return {entity: mirror_rows(realm_id, entity, id_refs) for entity, id_refs in ids_by_entity.items()}
+
+
+def snapshot_names(realm_id, ids_by_entity):
+    """Like full_entities, but with the snapshot's compact entries."""
+    found = {}
+    for entity, entries in snapshot.resolve(realm_id, ids_by_entity).items():
+        found[entity] = {id_ref: entry for id_ref, entry in entries.items() if entry is not None}
+        unknown = [id_ref for id_ref in ids_by_entity[entity] if id_ref not in found[entity]]
+        # The snapshot leaves tombstones out; they still count as found, and resolve to null
+        found[entity].update((id_ref, None) for id_ref, record in mirror_rows(realm_id, entity, unknown).items() if record is None)
+    return found
+
+
+# view= -> (entity types it covers, lookup returning {entity: {id_ref: entry or None for a tombstone}})
+RESOLVE_VIEWS = {
+    'full': (tuple(RESOLVABLE_MODELS), full_entities),
+    'names': (tuple(SNAPSHOT_SOURCES), snapshot_names),
+}
+
+
+def id_queries(entity, id_refs, include_inactive=False):
+    """QuickBooks queries fetching the IDs, UPSTREAM_ID_CHUNK at a time."""
+    # Without an Active filter QuickBooks leaves out inactive entities
+    active = "Active in (true, false) and " if include_inactive else ""
+    for start in range(0, len(id_refs), UPSTREAM_ID_CHUNK):
+        chunk = id_refs[start:start + UPSTREAM_ID_CHUNK]
+        # IDs are quoted literals; drop quotes so an ID cannot end the literal early
+        literals = ["'" + id_ref.replace("'", '') + "'" for id_ref in chunk]
+        yield f"select * from {entity} where {active}Id in ({', '.join(literals)})"
@@ -0,0 +1,175 @@
+import json
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from quickbooks.instrumentation import track
+from quickbooks.models import QuickBooksToken
+from quickbooks.stub_server import StubConfig, start_stub_server
+
+SCENARIOS = {
+    'list_accounts': lambda realm, i: f"/list-accounts/{realm}/?query=select * from Account",
+    'list_customers': lambda realm, i: f"/list-customer/{realm}/?query=select * from Customer",
+    'sync_employees': lambda realm, i: f"/list-employes/{realm}/?query=select * from Employee",
+    'get_account': lambda realm, i: f"/get-account/{realm}/{i}/",
+    'get_customer': lambda realm, i: f"/get-customer/{realm}/{i}/",
+    'get_employee': lambda realm, i: f"/get-employee/{realm}/{i}/",
+    'get_companyinfo': lambda realm, i: f"/get-companyinfo/{realm}/1/",
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return usage // 1024 if platform.system() == 'Darwin' else usage
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API against a local QuickBooks stub and save latency/throughput results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help="Requests per scenario")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--realm', default='benchmark-realm')
+        parser.add_argument('--accounts', type=int, default=200)
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--employees', type=int, default=100)
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--latency-ms', type=float, default=0.0, help="Injected upstream latency")
+        parser.add_argument('--jitter-ms', type=float, default=0.0)
+        parser.add_argument('--error-401-rate', type=float, default=0.0)
+        parser.add_argument('--error-429-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='bench_results.json')
+        parser.add_argument('--in-place', action='store_true',
+                            help="Run against the configured SQLITE_PATH instead of a throwaway database (never the tracked db.sqlite3)")
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be positive")
+        # The run stores a fake token and stub entities, which must never land in a real database
+        if options['in_place']:
+            if settings.DB_PROFILE != 'sqlite' or os.path.abspath(settings.DATABASES['default']['NAME']) == str(settings.BASE_DIR / 'db.sqlite3'):
+                raise CommandError("--in-place needs DB_PROFILE=sqlite and a SQLITE_PATH other than the project's db.sqlite3")
+            return self.benchmark(options)
+
+        scratch = tempfile.mkdtemp(prefix='quickbooks-benchmark-')
+        if settings.DB_PROFILE == 'sqlite':
+            # A file rather than Django's in-memory test database, so WAL and locking behave as in use
+            connections['default'].settings_dict['TEST']['NAME'] = os.path.join(scratch, 'benchmark.sqlite3')
+        old_config = setup_databases(verbosity=options['verbosity'], interactive=False)
+        try:
+            return self.benchmark(options)
+        finally:
+            teardown_databases(old_config, verbosity=options['verbosity'])
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def benchmark(self, options):
+        config = StubConfig(
+            accounts=options['accounts'],
+            customers=options['customers'],
+            employees=options['employees'],
+            page_size=options['page_size'],
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_401_rate=options['error_401_rate'],
+            error_429_rate=options['error_429_rate'],
+            seed=options['seed'],
+        )
+        stub = start_stub_server(config)
+        realm = options['realm']
+        QuickBooksToken.objects.update_or_create(
+            realm_id=realm,
+            defaults={'access_token': 'stub-access-token', 'refresh_token': 'stub-refresh-token', 'expires_in': 3600, 'scope': 'com.intuit.quickbooks.accounting'},
+        )
+
+        results = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'options': {key: value for key, value in options.items() if key not in ('verbosity', 'settings', 'pythonpath', 'traceback', 'no_color', 'force_color', 'skip_checks')},
+            'scenarios': {},
+        }
+        try:
+            with override_settings(QUICKBOOKURL=stub.base_url, TOKEN_URL=stub.token_url, ALLOWED_HOSTS=['*']):
+                for name in options['scenarios']:
+                    results['scenarios'][name] = self.run_scenario(name, realm, config, options)
+                    self.report(name, results['scenarios'][name])
+        finally:
+            stub.shutdown()
+        results['upstream_requests'] = stub.request_count
+        results['peak_rss_kb'] = peak_rss_kb()
+
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, indent=2)
+        self.stdout.write(f"peak RSS {results['peak_rss_kb']} KB; results written to {options['output']}")
+
+    def run_scenario(self, name, realm, config, options):
+        entity_total = {'get_account': config.accounts, 'get_customer': config.customers, 'get_employee': config.employees}.get(name, 1)
+        local = threading.local()
+        # Any configured service token will do; none is needed while the API is open
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}' for token in list(settings.SERVICE_API_TOKENS.values())[:1]}
+
+        def one_request(i):
+            if not hasattr(local, 'client'):
+                local.client = Client(**headers)
+            url = SCENARIOS[name](realm, i % entity_total + 1)
+            with track(name) as metrics:
+                response = local.client.get(url)
+            return metrics.elapsed, response.status_code, metrics.db_queries, metrics.upstream_calls
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            samples = list(pool.map(one_request, range(options['requests'])))
+        wall = time.perf_counter() - started
+
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        statuses = {}
+        for _, status_code, _, _ in samples:
+            statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+        queries = [sample[2] for sample in samples]
+        upstream_calls = [sample[3] for sample in samples]
+        return {
+            'requests': len(samples),
+            'concurrency': options['concurrency'],
+            'wall_seconds': round(wall, 4),
+            'requests_per_second': round(len(samples) / wall, 2) if wall else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'max': round(latencies[-1], 3),
+            },
+            'db_queries_per_request': {
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            },
+            'upstream_calls_per_request': round(sum(upstream_calls) / len(upstream_calls), 2),
+            'status_codes': statuses,
+        }
+
+    def report(self, name, result):
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"{name:<16} {result['requests_per_second']:>9} req/s  "
+            f"p50 {latency['p50']}ms  p95 {latency['p95']}ms  p99 {latency['p99']}ms  "
+            f"queries/req {result['db_queries_per_request']['mean']}  status {result['status_codes']}"
+        )
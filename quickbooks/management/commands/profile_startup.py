@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: load WSGI_APPLICATION the way a worker does, then serve one request
+PROBE = """
+import json, sys, time
+from wsgiref.util import setup_testing_defaults
+started = time.perf_counter()
+from django.conf import settings
+from django.utils.module_loading import import_string
+application = import_string(settings.WSGI_APPLICATION)
+ready = time.perf_counter()
+environ = {'PATH_INFO': sys.argv[1], 'REQUEST_METHOD': 'GET'}
+setup_testing_defaults(environ)
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+done = time.perf_counter()
+print(json.dumps({'boot_ms': (ready - started) * 1000, 'first_request_ms': (done - ready) * 1000, 'status': statuses[0]}))
+"""
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    help = "Measure worker cold start (loading the WSGI app + first request) in fresh interpreters and list the slowest imports"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', default='/__startup_probe__/', help="URL served as the first request")
+        parser.add_argument('--api-only', action='store_true', help="Measure with the API_ONLY settings profile")
+        parser.add_argument('--top', type=int, default=15, help="How many imports to list")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("--runs must be positive")
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'predicta_backend.settings'))
+        if options['api_only']:
+            env['API_ONLY'] = 'True'
+
+        runs = []
+        imports = {}
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', PROBE, options['path']],
+                env=env, capture_output=True, text=True,
+            )
+            wall_ms = (time.perf_counter() - started) * 1000
+            if result.returncode != 0:
+                raise CommandError(f"Start-up probe failed:\n{result.stderr[-2000:]}")
+            run = json.loads(result.stdout.strip().splitlines()[-1])
+            run['process_ms'] = wall_ms
+            runs.append(run)
+            # Keep the last run's import times; earlier runs warm the bytecode cache
+            imports = self.parse_imports(result.stderr)
+
+        summary = {
+            'api_only': options['api_only'],
+            'runs': options['runs'],
+            'status': runs[-1]['status'],
+            'boot_ms': round(statistics.median(run['boot_ms'] for run in runs), 1),
+            'first_request_ms': round(statistics.median(run['first_request_ms'] for run in runs), 1),
+            'process_ms': round(statistics.median(run['process_ms'] for run in runs), 1),
+            'slowest_imports': [
+                {'module': module, 'cumulative_ms': round(cumulative / 1000, 1), 'self_ms': round(own / 1000, 1)}
+                for module, (own, cumulative) in sorted(imports.items(), key=lambda item: -item[1][1])[:options['top']]
+            ],
+        }
+
+        self.stdout.write(
+            f"median of {summary['runs']} runs{' (API_ONLY)' if summary['api_only'] else ''}: "
+            f"boot {summary['boot_ms']} ms, first request {summary['first_request_ms']} ms "
+            f"({summary['status']}), process to first response {summary['process_ms']} ms"
+        )
+        self.stdout.write("slowest top-level imports (cumulative / self ms):")
+        for entry in summary['slowest_imports']:
+            self.stdout.write(f"  {entry['cumulative_ms']:>8} / {entry['self_ms']:>6}  {entry['module']}")
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(summary, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    @staticmethod
+    def parse_imports(stderr):
+        """Top-level entries of -X importtime output: {module: (self_us, cumulative_us)}."""
+        imports = {}
+        for line in stderr.splitlines():
+            match = IMPORT_LINE.match(line)
+            # One space of indent marks an import made directly by the probe or by Django's app loading
+            if match and len(match.group(3)) == 1:
+                imports[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+        return imports
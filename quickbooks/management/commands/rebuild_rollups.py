@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from quickbooks.models import QuickBooksToken
+from quickbooks.rollups import rebuild_rollups
+from quickbooks.account_tree import rebuild_account_tree
+
+
+class Command(BaseCommand):
+    help = "Recompute the balance rollup tables and the chart-of-accounts tree from the mirror tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('realm_ids', nargs='*', help="Realms to rebuild (default: every connected realm)")
+
+    def handle(self, *args, **options):
+        realm_ids = options['realm_ids'] or QuickBooksToken.objects.values_list('realm_id', flat=True)
+        for realm_id in realm_ids:
+            rebuild_account_tree(realm_id)
+            rebuild_rollups(realm_id)
+            self.stdout.write(f"Rebuilt rollups for realm {realm_id}")
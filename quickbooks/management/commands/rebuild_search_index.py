@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from quickbooks.models import QuickBooksToken
+from quickbooks.search import index_customers
+
+
+class Command(BaseCommand):
+    help = "Rebuild the customer typeahead search index from the mirror tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('realm_ids', nargs='*', help="Realms to index (default: every connected realm)")
+
+    def handle(self, *args, **options):
+        realm_ids = options['realm_ids'] or QuickBooksToken.objects.values_list('realm_id', flat=True)
+        for realm_id in realm_ids:
+            count = index_customers(realm_id)
+            self.stdout.write(f"Indexed {count} customers for realm {realm_id}")
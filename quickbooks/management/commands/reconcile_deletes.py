@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from quickbooks.models import QuickBooksToken
+from quickbooks.tombstones import TOMBSTONE_MODELS, reconcile_ids
+
+
+class Command(BaseCommand):
+    help = "Compare each realm's entity IDs in QuickBooks with the mirror and tombstone the rows deleted upstream"
+
+    def add_arguments(self, parser):
+        parser.add_argument('realm_ids', nargs='*', help="Realms to reconcile (default: every connected realm)")
+        parser.add_argument('--entity', action='append', choices=list(TOMBSTONE_MODELS), help="Entity type to reconcile (repeatable; default: all)")
+
+    def handle(self, *args, **options):
+        realm_ids = options['realm_ids'] or QuickBooksToken.objects.values_list('realm_id', flat=True)
+        for realm_id in realm_ids:
+            for entity in options['entity'] or TOMBSTONE_MODELS:
+                try:
+                    result = reconcile_ids(realm_id, entity)
+                except Exception as e:
+                    self.stderr.write(f"Realm {realm_id} {entity}: reconciliation failed: {e}")
+                    continue
+                self.stdout.write(
+                    f"Realm {realm_id} {entity}: {result['tombstoned']} tombstoned, "
+                    f"{len(result['missing'])} missing from the mirror"
+                )
@@ -0,0 +1,36 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from quickbooks.token_refresh import refresh_due_tokens
+
+
+class Command(BaseCommand):
+    help = "Refresh the QuickBooks tokens of every realm that are about to expire, in concurrent bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--within', type=int, default=900, help="Refresh access tokens expiring within this many seconds")
+        parser.add_argument('--refresh-within', type=int, default=30, help="Refresh tokens whose refresh token expires within this many days")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent refresh requests per batch")
+        parser.add_argument('--interval', type=int, default=0, help="Keep running, scanning every this many seconds (default: scan once)")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--batch-size and --workers must be positive")
+        while True:
+            started = time.perf_counter()
+            summary = refresh_due_tokens(
+                timedelta(seconds=options['within']),
+                timedelta(days=options['refresh_within']),
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+            )
+            self.stdout.write(
+                f"{summary['due']} due, {summary['refreshed']} refreshed, {len(summary['failed'])} failed "
+                f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+            )
+            for realm_id, error in summary['failed'].items():
+                self.stderr.write(f"  realm {realm_id}: {error}")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
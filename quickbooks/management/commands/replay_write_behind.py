@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from quickbooks.views import MIRROR_WRITERS
+from quickbooks.write_behind import replay
+
+
+class Command(BaseCommand):
+    help = "Write mirror updates left in the write-behind journal by processes that exited without flushing"
+
+    def handle(self, *args, **options):
+        written = replay(MIRROR_WRITERS)
+        self.stdout.write(f"Replayed {written} entities from {settings.QUICKBOOKS_WRITE_BEHIND_JOURNAL}")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from quickbooks.integrity import verify_mirror
+from quickbooks.models import QuickBooksToken
+from quickbooks.tombstones import TOMBSTONE_MODELS
+from quickbooks.views import MIRROR_WRITERS
+
+
+class Command(BaseCommand):
+    help = "Compare the mirror's (Id, SyncToken) pairs with QuickBooks and refetch only what drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('realm_ids', nargs='*', help="Realms to verify (default: every connected realm)")
+        parser.add_argument('--entity', action='append', choices=list(TOMBSTONE_MODELS), help="Entity type to verify (repeatable; default: all)")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without repairing it")
+
+    def handle(self, *args, **options):
+        realm_ids = options['realm_ids'] or QuickBooksToken.objects.values_list('realm_id', flat=True)
+        for realm_id in realm_ids:
+            for entity in options['entity'] or TOMBSTONE_MODELS:
+                write = None if options['dry_run'] else MIRROR_WRITERS[entity]
+                try:
+                    summary = verify_mirror(realm_id, entity, write=write)
+                except Exception as e:
+                    self.stderr.write(f"Realm {realm_id} {entity}: verification failed: {e}")
+                    continue
+                self.stdout.write(
+                    f"Realm {realm_id} {entity}: {summary['checked']} checked, "
+                    f"{summary['stale']} stale or missing, {summary['gone']} gone"
+                    + (" (repaired)" if summary['repaired'] and (summary['stale'] or summary['gone']) else "")
+                )
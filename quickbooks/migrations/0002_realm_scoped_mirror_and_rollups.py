@@ -0,0 +1,128 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:26
+
+from django.db import migrations, models
+
+MIRROR_MODELS = ('Account', 'CompanyInfo', 'CustomerInfo', 'Employee')
+
+
+def backfill_realm_id(apps, schema_editor):
+    """
+    Rows mirrored before realm scoping have no realm. With a single connected realm
+    they must be that realm's; otherwise there is no telling, so they are deleted and
+    come back with the next sync of each realm.
+    """
+    realm_ids = list(apps.get_model('quickbooks', 'QuickBooksToken').objects.values_list('realm_id', flat=True)[:2])
+    for name in MIRROR_MODELS:
+        legacy = apps.get_model('quickbooks', name).objects.filter(realm_id='')
+        if len(realm_ids) == 1:
+            legacy.update(realm_id=realm_ids[0])
+        else:
+            legacy.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickbooks', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='realm_id',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='companyinfo',
+            name='realm_id',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='customerinfo',
+            name='realm_id',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='realm_id',
+            field=models.CharField(db_index=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_realm_id, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='account',
+            name='id_ref',
+            field=models.CharField(max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='companyinfo',
+            name='id_ref',
+            field=models.CharField(max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='customerinfo',
+            name='id_ref',
+            field=models.CharField(max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='employee',
+            name='id_ref',
+            field=models.CharField(max_length=10),
+        ),
+        migrations.AlterUniqueTogether(
+            name='account',
+            unique_together={('realm_id', 'id_ref')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='companyinfo',
+            unique_together={('realm_id', 'id_ref')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='customerinfo',
+            unique_together={('realm_id', 'id_ref')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='employee',
+            unique_together={('realm_id', 'id_ref')},
+        ),
+        migrations.CreateModel(
+            name='CustomerBalanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('realm_id', models.CharField(max_length=255)),
+                ('city', models.CharField(max_length=100)),
+                ('total_balance', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('customer_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('realm_id', 'city')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AccountTreeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('realm_id', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=200)),
+                ('depth', models.IntegerField(default=0)),
+                ('total_balance', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('account_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('realm_id', 'path')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AccountBalanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('realm_id', models.CharField(max_length=255)),
+                ('classification', models.CharField(max_length=50)),
+                ('account_type', models.CharField(max_length=50)),
+                ('total_balance', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('account_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('realm_id', 'classification', 'account_type')},
+            },
+        ),
+    ]
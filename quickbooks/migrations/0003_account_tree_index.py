@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickbooks', '0002_realm_scoped_mirror_and_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='depth',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='children', to='quickbooks.account'),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='path',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['realm_id', 'path'], name='quickbooks__realm_i_946e23_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickbooks', '0003_account_tree_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('realm_id', models.CharField(max_length=255)),
+                ('token', models.CharField(max_length=100)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='quickbooks.customerinfo')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['realm_id', 'token'], name='quickbooks__realm_i_6ade3e_idx'), models.Index(fields=['customer', 'token'], name='quickbooks__custome_1c0020_idx')],
+            },
+        ),
+    ]
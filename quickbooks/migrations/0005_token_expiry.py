@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickbooks', '0004_customer_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quickbookstoken',
+            name='access_token_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quickbookstoken',
+            name='refresh_token_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='quickbookstoken',
+            name='refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-19 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quickbooks', '0005_token_expiry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('realm_id', models.CharField(max_length=255)),
+                ('entity', models.CharField(max_length=50)),
+                ('started_at', models.DateTimeField()),
+                ('status', models.CharField(default='success', max_length=20)),
+                ('error', models.TextField(blank=True, default='')),
+                ('pages_fetched', models.IntegerField(default=0)),
+                ('bytes_transferred', models.BigIntegerField(default=0)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('rows_skipped', models.IntegerField(default=0)),
+                ('rows_deleted', models.IntegerField(default=0)),
+                ('fetch_ms', models.FloatField(default=0)),
+                ('parse_ms', models.FloatField(default=0)),
+                ('map_ms', models.FloatField(default=0)),
+                ('write_ms', models.FloatField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('db_queries', models.IntegerField(default=0)),
+                ('upstream_calls', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['realm_id', 'entity', 'started_at'], name='quickbooks__realm_i_44d7dc_idx'), models.Index(fields=['started_at'], name='quickbooks__started_fdf29e_idx')],
+            },
+        ),
+    ]
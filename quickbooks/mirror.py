@@ -0,0 +1,175 @@
+# quickbooks/mirror.py
+"""
+Mirror rows in the shape QuickBooks returns them.
+
+MIRROR_COLUMNS maps the QuickBooks fields the mirror keeps to their columns.
+mirror_entity() turns a row back into an entity, so responses served from the
+mirror while QuickBooks is unavailable look like the live ones, minus the fields
+the mirror does not keep.
+"""
+import re
+from decimal import Decimal
+from rest_framework import status
+from rest_framework.response import Response
+from .concurrency import ENTITY_MODELS
+from .projection import project, project_query_response
+import logging
+logger = logging.getLogger('quickbooks')
+
+
+def _address(prefix, column_prefix):
+    return {
+        (prefix, 'Line1'): f'{column_prefix}_line1',
+        (prefix, 'City'): f'{column_prefix}_city',
+        (prefix, 'CountrySubDivisionCode'): f'{column_prefix}_country_sub_division_code',
+        (prefix, 'PostalCode'): f'{column_prefix}_postal_code',
+    }
+
+
+# QuickBooks field path -> mirror column, for the fields the mirror keeps
+MIRROR_COLUMNS = {
+    'Account': {
+        ('Name',): 'name',
+        ('SubAccount',): 'sub_account',
+        ('FullyQualifiedName',): 'fully_qualified_name',
+        ('Active',): 'active',
+        ('Classification',): 'classification',
+        ('AccountType',): 'account_type',
+        ('AccountSubType',): 'account_sub_type',
+        ('CurrentBalance',): 'current_balance',
+        ('CurrentBalanceWithSubAccounts',): 'current_balance_with_sub_accounts',
+        ('CurrencyRef', 'value'): 'currency_value',
+        ('CurrencyRef', 'name'): 'currency_name',
+    },
+    'Customer': {
+        ('Taxable',): 'taxable',
+        **_address('BillAddr', 'bill'),
+        **_address('ShipAddr', 'ship'),
+        ('Job',): 'job',
+        ('BillWithParent',): 'bill_with_parent',
+        ('Balance',): 'balance',
+        ('BalanceWithJobs',): 'balance_with_jobs',
+        ('CurrencyRef', 'value'): 'currency_value',
+        ('CurrencyRef', 'name'): 'currency_name',
+        ('PreferredDeliveryMethod',): 'preferred_delivery_method',
+        ('GivenName',): 'given_name',
+        ('FamilyName',): 'family_name',
+        ('FullyQualifiedName',): 'fully_qualified_name',
+        ('CompanyName',): 'company_name',
+        ('DisplayName',): 'display_name',
+        ('PrintOnCheckName',): 'print_on_check_name',
+        ('Active',): 'active',
+        ('PrimaryPhone', 'FreeFormNumber'): 'primary_phone',
+        ('PrimaryEmailAddr', 'Address'): 'primary_email_addr',
+    },
+    'Employee': {
+        ('BillableTime',): 'billable_time',
+        ('GivenName',): 'given_name',
+        ('FamilyName',): 'family_name',
+        ('DisplayName',): 'display_name',
+        ('PrintOnCheckName',): 'print_on_check_name',
+        ('Active',): 'active',
+    },
+    'CompanyInfo': {
+        ('CompanyName',): 'company_name',
+        ('LegalName',): 'legal_name',
+        **_address('CompanyAddr', 'company'),
+        **_address('CustomerCommunicationAddr', 'customer_communication'),
+        ('CustomerCommunicationEmailAddr', 'Address'): 'customer_communication_email_addr',
+        **_address('LegalAddr', 'legal'),
+        ('PrimaryPhone', 'FreeFormNumber'): 'primary_phone',
+        ('CompanyStartDate',): 'company_start_date',
+        ('FiscalYearStartMonth',): 'fiscal_year_start_month',
+        ('Country',): 'country',
+        ('Email', 'Address'): 'email',
+        ('SupportedLanguages',): 'supported_languages',
+    },
+}
+# Columns every mirror table has besides the mapped ones
+COMMON_COLUMNS = ('id_ref', 'sync_token', 'domain', 'sparse', 'create_time', 'last_updated_time')
+# QuickBooks' page when a query does not give one
+DEFAULT_START, DEFAULT_MAX_RESULTS = 1, 100
+_START = re.compile(r'\bstartposition\s+(\d+)', re.IGNORECASE)
+_MAX_RESULTS = re.compile(r'\bmaxresults\s+(\d+)', re.IGNORECASE)
+# The only queries the mirror can answer faithfully: every row, optionally paged
+_PLAIN_QUERY = re.compile(r'^\s*select\s+\*\s+from\s+(\w+)(\s+startposition\s+\d+)?(\s+maxresults\s+\d+)?\s*$', re.IGNORECASE)
+
+
+def mirror_columns(entity):
+    return COMMON_COLUMNS + tuple(dict.fromkeys(MIRROR_COLUMNS[entity].values()))
+
+
+def mirror_entity(entity, row):
+    """A values() row of mirror_columns(entity) as a QuickBooks entity; empty columns are left out."""
+    record = {
+        'Id': row['id_ref'],
+        'SyncToken': row['sync_token'],
+        'domain': row['domain'],
+        'sparse': row['sparse'],
+        'MetaData': {'CreateTime': row['create_time'], 'LastUpdatedTime': row['last_updated_time']},
+    }
+    for path, column in MIRROR_COLUMNS[entity].items():
+        value = row[column]
+        if value is None or value == '':
+            continue
+        node = record
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = float(value) if isinstance(value, Decimal) else value
+    return record
+
+
+def live_rows(entity, realm_id):
+    model = ENTITY_MODELS[entity]
+    rows = model.objects.filter(realm_id=realm_id)
+    if hasattr(model, 'deleted_at'):
+        rows = rows.filter(deleted_at__isnull=True)
+    return rows.values(*mirror_columns(entity))
+
+
+def mirror_record(realm_id, entity, id_ref):
+    """The live mirror copy of one entity in QuickBooks' shape; None when the mirror does not have it."""
+    row = live_rows(entity, realm_id).filter(id_ref=id_ref).first()
+    return mirror_entity(entity, row) if row else None
+
+
+def page_of(query):
+    """(startposition, maxresults) of a QuickBooks query, with QuickBooks' defaults."""
+    start = _START.search(query or '')
+    max_results = _MAX_RESULTS.search(query or '')
+    return (int(start.group(1)) if start else DEFAULT_START,
+            int(max_results.group(1)) if max_results else DEFAULT_MAX_RESULTS)
+
+
+def _mirror_response(payload):
+    response = Response({'success': payload, 'source': 'mirror'}, status=status.HTTP_200_OK)
+    response['X-Data-Source'] = 'mirror'
+    return response
+
+
+def mirror_fallback(entity, realm_id, id_ref=None, query=None, fields=None):
+    """
+    Serve the mirror while QuickBooks is unavailable; None when the mirror has nothing to offer.
+
+    A single entity comes back as {entity: {...}}, like a get; a list as a
+    QueryResponse paged by the query's startposition/maxresults and projected to
+    fields. Lists are only served for `select * from <entity>` queries; a query
+    with conditions, ordering or a column list gets None rather than the wrong rows.
+    """
+    if id_ref is not None:
+        record = mirror_record(realm_id, entity, id_ref)
+        if record is None:
+            return None
+        logger.info(f"Serving {entity} {id_ref} for realm {realm_id} from the mirror")
+        return _mirror_response({entity: project(record, fields)})
+
+    plain = _PLAIN_QUERY.match(query or '')
+    if not plain or plain.group(1).lower() != entity.lower():
+        return None
+    start, max_results = page_of(query)
+    page = [mirror_entity(entity, row) for row in live_rows(entity, realm_id).order_by('pk')[start - 1:start - 1 + max_results]]
+    if not page:
+        return None
+    logger.info(f"Serving {len(page)} {entity} rows for realm {realm_id} from the mirror")
+    data = {'QueryResponse': {entity: page, 'startPosition': start, 'maxResults': len(page)}}
+    return _mirror_response(project_query_response(data, entity, fields))
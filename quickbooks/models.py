@@ -7,15 +7,24 @@ class QuickBooksToken(models.Model):
     refresh_token = models.CharField(max_length=500)
     expires_in = models.IntegerField()
     scope = models.CharField(max_length=255)
+    # Absolute expiry times, so the refresh scheduler can scan for tokens about to lapse
+    access_token_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    refresh_token_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Token for {self.realm_id}"
 
 
 class Account(models.Model):
+    realm_id = models.CharField(max_length=255, db_index=True, default='')
     name = models.CharField(max_length=100)
     sub_account = models.BooleanField(default=False)
     fully_qualified_name = models.CharField(max_length=200)
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='children')
+    # Materialized path of id_refs from the root, e.g. "/1/7/"; maintained by account sync
+    path = models.CharField(max_length=255, default='')
+    depth = models.IntegerField(default=0)
     active = models.BooleanField(default=True)
     classification = models.CharField(max_length=50)
     account_type = models.CharField(max_length=50)
@@ -26,16 +35,23 @@ class Account(models.Model):
     currency_name = models.CharField(max_length=50)
     domain = models.CharField(max_length=50)
     sparse = models.BooleanField(default=False)
-    id_ref = models.CharField(max_length=10, unique=True)
+    id_ref = models.CharField(max_length=10)
     sync_token = models.CharField(max_length=10)
     create_time = models.DateTimeField()
     last_updated_time = models.DateTimeField()
+    # Set when QuickBooks reports the entity deleted; the row is kept as a tombstone
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('realm_id', 'id_ref')
+        indexes = [models.Index(fields=['realm_id', 'path'])]
 
     def __str__(self):
         return self.name
 
 
 class CustomerInfo(models.Model):
+    realm_id = models.CharField(max_length=255, db_index=True, default='')
     taxable = models.BooleanField(default=False)
     bill_line1 = models.CharField(max_length=255, blank=True, null=True)
     bill_city = models.CharField(max_length=100, blank=True, null=True)
@@ -54,7 +70,7 @@ class CustomerInfo(models.Model):
     preferred_delivery_method = models.CharField(max_length=50)
     domain = models.CharField(max_length=50)
     sparse = models.BooleanField(default=False)
-    id_ref = models.CharField(max_length=10, unique=True)
+    id_ref = models.CharField(max_length=10)
     sync_token = models.CharField(max_length=10)
     create_time = models.DateTimeField()
     last_updated_time = models.DateTimeField()
@@ -68,16 +84,22 @@ class CustomerInfo(models.Model):
     primary_phone = models.CharField(max_length=20, blank=True, null=True)
     primary_email_addr = models.EmailField(blank=True, null=True)
     default_tax_code_ref = models.CharField(max_length=10, blank=True, null=True)
+    # Set when QuickBooks reports the entity deleted; the row is kept as a tombstone
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('realm_id', 'id_ref')
 
     def __str__(self):
         return self.display_name
 
 
 class Employee(models.Model):
+    realm_id = models.CharField(max_length=255, db_index=True, default='')
     billable_time = models.BooleanField(default=False)
     domain = models.CharField(max_length=50)
     sparse = models.BooleanField(default=False)
-    id_ref = models.CharField(max_length=10, unique=True)
+    id_ref = models.CharField(max_length=10)
     sync_token = models.CharField(max_length=10)
     create_time = models.DateTimeField()
     last_updated_time = models.DateTimeField()
@@ -86,12 +108,18 @@ class Employee(models.Model):
     display_name = models.CharField(max_length=200)
     print_on_check_name = models.CharField(max_length=200)
     active = models.BooleanField(default=True)
+    # Set when QuickBooks reports the entity deleted; the row is kept as a tombstone
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('realm_id', 'id_ref')
 
     def __str__(self):
         return self.display_name
 
 
 class CompanyInfo(models.Model):
+    realm_id = models.CharField(max_length=255, db_index=True, default='')
     company_name = models.CharField(max_length=200)
     legal_name = models.CharField(max_length=200)
     company_line1 = models.CharField(max_length=255)
@@ -116,10 +144,104 @@ class CompanyInfo(models.Model):
     supported_languages = models.CharField(max_length=20)
     domain = models.CharField(max_length=50)
     sparse = models.BooleanField(default=False)
-    id_ref = models.CharField(max_length=10, unique=True)
+    id_ref = models.CharField(max_length=10)
     sync_token = models.CharField(max_length=10)
     create_time = models.DateTimeField()
     last_updated_time = models.DateTimeField()
 
+    class Meta:
+        unique_together = ('realm_id', 'id_ref')
+
     def __str__(self):
         return self.company_name
+
+
+class AccountBalanceRollup(models.Model):
+    """Running total of active account balances per classification/account type."""
+    realm_id = models.CharField(max_length=255)
+    classification = models.CharField(max_length=50)
+    account_type = models.CharField(max_length=50)
+    total_balance = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    account_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('realm_id', 'classification', 'account_type')
+
+    def __str__(self):
+        return f"{self.realm_id} {self.classification}/{self.account_type}"
+
+
+class CustomerBalanceRollup(models.Model):
+    """Running total of active customer balances per billing city."""
+    realm_id = models.CharField(max_length=255)
+    city = models.CharField(max_length=100)
+    total_balance = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    customer_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('realm_id', 'city')
+
+    def __str__(self):
+        return f"{self.realm_id} {self.city}"
+
+
+class AccountTreeRollup(models.Model):
+    """Subtree balance for every node of the chart of accounts, keyed by fully qualified name."""
+    realm_id = models.CharField(max_length=255)
+    path = models.CharField(max_length=200)
+    depth = models.IntegerField(default=0)
+    total_balance = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    account_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('realm_id', 'path')
+
+    def __str__(self):
+        return f"{self.realm_id} {self.path}"
+
+
+class CustomerSearchToken(models.Model):
+    """Normalized word from a customer's searchable fields, prefix-matched by the typeahead endpoint."""
+    realm_id = models.CharField(max_length=255)
+    token = models.CharField(max_length=100)
+    customer = models.ForeignKey(CustomerInfo, on_delete=models.CASCADE, related_name='search_tokens')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['realm_id', 'token']),
+            models.Index(fields=['customer', 'token']),
+        ]
+
+    def __str__(self):
+        return self.token
+
+
+class SyncRun(models.Model):
+    """One sync of an entity type for a realm: what it moved and where the time went."""
+    realm_id = models.CharField(max_length=255)
+    entity = models.CharField(max_length=50)
+    started_at = models.DateTimeField()
+    status = models.CharField(max_length=20, default='success')
+    error = models.TextField(blank=True, default='')
+    pages_fetched = models.IntegerField(default=0)
+    bytes_transferred = models.BigIntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    rows_skipped = models.IntegerField(default=0)
+    rows_deleted = models.IntegerField(default=0)
+    fetch_ms = models.FloatField(default=0)
+    parse_ms = models.FloatField(default=0)
+    map_ms = models.FloatField(default=0)
+    write_ms = models.FloatField(default=0)
+    total_ms = models.FloatField(default=0)
+    db_queries = models.IntegerField(default=0)
+    upstream_calls = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['realm_id', 'entity', 'started_at']),
+            models.Index(fields=['started_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.realm_id} {self.entity} {self.started_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,47 @@
+# quickbooks/projection.py
+"""
+Sparse field selection for list responses.
+
+    ?fields=Id,Name,CurrentBalance,MetaData.LastUpdatedTime
+
+keeps only those attributes (dotted paths reach into nested objects) on every
+entity of the QueryResponse. Id is always kept so clients can key the rows.
+"""
+import re
+
+FIELD_PATH = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+ALWAYS_INCLUDED = ('Id',)
+
+
+def parse_fields(raw):
+    """Turn 'Id,MetaData.LastUpdatedTime' into {'Id': {}, 'MetaData': {'LastUpdatedTime': {}}}; None when absent."""
+    if not raw:
+        return None
+    paths = [path.strip() for path in raw.split(',') if path.strip()]
+    invalid = [path for path in paths if not FIELD_PATH.match(path)]
+    if invalid:
+        raise ValueError(f"Invalid field name(s): {', '.join(invalid)}")
+    spec = {}
+    for path in list(ALWAYS_INCLUDED) + paths:
+        node = spec
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    return spec
+
+
+def project(value, spec):
+    if not spec:
+        return value
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: project(value[key], sub_spec) for key, sub_spec in spec.items() if key in value}
+
+
+def project_query_response(data, entity, spec):
+    """Project the entity list inside a QueryResponse, leaving the paging metadata as is."""
+    if not spec:
+        return data
+    query_response = data.get('QueryResponse', {})
+    return {**data, 'QueryResponse': {**query_response, entity: project(query_response.get(entity, []), spec)}}
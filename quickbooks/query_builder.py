@@ -0,0 +1,141 @@
+# quickbooks/query_builder.py
+"""
+Structured queries compiled into QuickBooks query strings.
+
+    {"entity": "Customer",
+     "filters": [{"field": "Balance", "op": ">", "value": 100}, {"field": "Active", "op": "=", "value": true}],
+     "order_by": ["-MetaData.LastUpdatedTime"],
+     "start": 1, "limit": 100}
+
+becomes
+
+    select * from Customer where Active = true and Balance > 100
+    orderby MetaData.LastUpdatedTime desc startposition 1 maxresults 100
+
+Fields, operators and values are validated, string literals are escaped, and
+unbounded queries (no or too large a page, very deep paging, huge IN lists) are
+rejected. Specs are normalized first, so equivalent specs compile to the same
+string, which also serves as the cache key for results.
+"""
+import json
+from functools import lru_cache
+
+META_FIELDS = ('Id', 'Active', 'MetaData.CreateTime', 'MetaData.LastUpdatedTime')
+FILTERABLE_FIELDS = {
+    'Account': META_FIELDS + ('Name', 'SubAccount', 'ParentRef', 'Description', 'Classification', 'AccountType',
+                              'AccountSubType', 'CurrentBalance', 'CurrentBalanceWithSubAccounts', 'FullyQualifiedName'),
+    'Customer': META_FIELDS + ('DisplayName', 'GivenName', 'FamilyName', 'CompanyName', 'FullyQualifiedName',
+                               'PrimaryEmailAddr', 'Balance', 'Job', 'ParentRef'),
+    'Employee': META_FIELDS + ('DisplayName', 'GivenName', 'FamilyName', 'PrimaryEmailAddr'),
+}
+OPERATORS = ('=', '<', '>', '<=', '>=', 'in', 'like')
+DEFAULT_LIMIT = 100
+# QuickBooks' own cap on maxresults
+MAX_LIMIT = 1000
+MAX_START = 10000
+MAX_IN_VALUES = 100
+
+
+class QueryError(ValueError):
+    pass
+
+
+def literal(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    raise QueryError(f"Unsupported value: {value!r}")
+
+
+def normalize(spec):
+    """Validate a spec and return it in canonical form; raises QueryError."""
+    if not isinstance(spec, dict):
+        raise QueryError("Query must be a JSON object.")
+    entity = spec.get('entity')
+    if not isinstance(entity, str) or entity not in FILTERABLE_FIELDS:
+        raise QueryError(f"entity must be one of {', '.join(FILTERABLE_FIELDS)}.")
+    fields = FILTERABLE_FIELDS[entity]
+
+    filters = []
+    if not isinstance(spec.get('filters') or [], list):
+        raise QueryError("filters must be a list.")
+    for item in spec.get('filters') or []:
+        if not isinstance(item, dict):
+            raise QueryError("Each filter needs field, op and value.")
+        field, op, value = item.get('field'), str(item.get('op', '=')).lower(), item.get('value')
+        if not isinstance(field, str) or field not in fields:
+            raise QueryError(f"{entity} cannot be filtered on {field!r}.")
+        if op not in OPERATORS:
+            raise QueryError(f"Unsupported operator {op!r}; use one of {', '.join(OPERATORS)}.")
+        if op == 'in':
+            if not isinstance(value, list) or not value:
+                raise QueryError(f"'in' on {field} needs a non-empty list.")
+            if len(value) > MAX_IN_VALUES:
+                raise QueryError(f"'in' takes at most {MAX_IN_VALUES} values.")
+        elif op == 'like' and (not isinstance(value, str) or not value.strip('%')):
+            raise QueryError(f"'like' on {field} needs a pattern with more than wildcards.")
+        # Before deduplicating, so nested lists and objects are rejected instead of failing to hash
+        for each in value if op == 'in' else [value]:
+            literal(each)
+        if op == 'in':
+            # Keyed by the JSON form, so true and 1 stay distinct values
+            value = [each for _, each in sorted({json.dumps(each): each for each in value}.items())]
+        filters.append((field, op, value))
+    filters.sort(key=json.dumps)
+
+    order_by = spec.get('order_by') or []
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    if not isinstance(order_by, list):
+        raise QueryError("order_by must be a field name or a list of them.")
+    ordering = []
+    for item in order_by:
+        field = str(item).lstrip('-')
+        if field not in fields:
+            raise QueryError(f"{entity} cannot be ordered by {field!r}.")
+        ordering.append((field, 'desc' if str(item).startswith('-') else 'asc'))
+
+    try:
+        start = int(spec.get('start', 1))
+        limit = int(spec.get('limit', DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        raise QueryError("start and limit must be integers.")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise QueryError(f"limit must be between 1 and {MAX_LIMIT}.")
+    if not 1 <= start <= MAX_START:
+        raise QueryError(f"start must be between 1 and {MAX_START}; narrow the filters instead of paging this deep.")
+
+    return {'entity': entity, 'filters': filters, 'order_by': ordering, 'start': start, 'limit': limit}
+
+
+@lru_cache(maxsize=512)
+def _compile(normalized_json):
+    spec = json.loads(normalized_json)
+    query = f"select * from {spec['entity']}"
+    conditions = []
+    for field, op, value in spec['filters']:
+        rendered = f"({', '.join(literal(each) for each in value)})" if op == 'in' else literal(value)
+        conditions.append(f"{field} {op} {rendered}")
+    if conditions:
+        query += " where " + " and ".join(conditions)
+    if spec['order_by']:
+        query += " orderby " + ", ".join(f"{field} {direction}" for field, direction in spec['order_by'])
+    return query + f" startposition {spec['start']} maxresults {spec['limit']}"
+
+
+def field_list(fields):
+    """The spec's "fields", a list of names or a comma-separated string, as a ?fields= string."""
+    if fields is None or isinstance(fields, str):
+        return fields
+    if isinstance(fields, list) and all(isinstance(field, str) for field in fields):
+        return ','.join(fields)
+    raise QueryError("fields must be a list of field names or a comma-separated string.")
+
+
+def build_query(spec):
+    """(entity, QuickBooks query string) for a structured spec; raises QueryError when invalid or unbounded."""
+    normalized = normalize(spec)
+    return normalized['entity'], _compile(json.dumps(normalized, sort_keys=True))
@@ -0,0 +1,154 @@
+# quickbooks/resilience.py
+"""
+Timeouts, circuit breakers and bulkheads for calls to QuickBooks.
+
+Every upstream call takes a slot in the global bulkhead and in its realm's
+bulkhead, and is refused while the global or realm circuit is open. A circuit
+opens after a run of consecutive failures (transport errors, 429 and 5xx),
+stays open for QUICKBOOKS_BREAKER_RESET_SECONDS, then lets one probe through
+(half-open): success closes it, failure opens it again.
+
+State is per process. Refused calls raise UpstreamUnavailable, which DRF
+renders as 503; read views catch it and serve the mirror instead.
+"""
+import threading
+import time
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+import logging
+logger = logging.getLogger('quickbooks')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class UpstreamUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'QuickBooks is unavailable, try again later.'
+    default_code = 'upstream_unavailable'
+
+
+def is_failure(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def cancel(self):
+        """Give back a half-open probe slot taken by allow() for a call that was never sent."""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.error(f"Circuit {self.name} opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class Bulkhead:
+    def __init__(self, name, limit):
+        self.name = name
+        self.semaphore = threading.BoundedSemaphore(limit)
+
+    def acquire(self, timeout):
+        if not self.semaphore.acquire(timeout=timeout):
+            raise UpstreamUnavailable(f"Too many concurrent QuickBooks calls for {self.name}, try again later.")
+
+    def release(self):
+        self.semaphore.release()
+
+
+_registry_lock = threading.Lock()
+_breakers = {}
+_bulkheads = {}
+
+
+def breaker(key):
+    with _registry_lock:
+        if key not in _breakers:
+            threshold = settings.QUICKBOOKS_GLOBAL_BREAKER_FAILURES if key is None else settings.QUICKBOOKS_BREAKER_FAILURES
+            _breakers[key] = CircuitBreaker(key or 'global', threshold, settings.QUICKBOOKS_BREAKER_RESET_SECONDS)
+        return _breakers[key]
+
+
+def bulkhead(key):
+    with _registry_lock:
+        if key not in _bulkheads:
+            limit = settings.QUICKBOOKS_GLOBAL_CONCURRENCY if key is None else settings.QUICKBOOKS_REALM_CONCURRENCY
+            _bulkheads[key] = Bulkhead(key or 'all realms', limit)
+        return _bulkheads[key]
+
+
+def guarded_call(realm_id, send):
+    """
+    Run send() (one HTTP request) under the global and realm bulkheads and breakers.
+    Calls without a realm (e.g. the token endpoint) are guarded globally only.
+    """
+    keys = [None] if realm_id is None else [None, realm_id]
+    breakers = []
+    acquired = []
+    sent = False
+    try:
+        for key in keys:
+            circuit = breaker(key)
+            if not circuit.allow():
+                raise UpstreamUnavailable(f"Circuit {circuit.name} is open, QuickBooks calls are paused.")
+            breakers.append(circuit)
+        for key in keys:
+            bulkhead(key).acquire(settings.QUICKBOOKS_BULKHEAD_WAIT_SECONDS)
+            acquired.append(key)
+        sent = True
+        try:
+            response = send()
+        except Exception as e:
+            for circuit in breakers:
+                circuit.record_failure()
+            raise UpstreamUnavailable(f"QuickBooks request failed: {e}") from e
+    finally:
+        for key in acquired:
+            bulkhead(key).release()
+        if not sent:
+            for circuit in breakers:
+                circuit.cancel()
+
+    for circuit in breakers:
+        if is_failure(response.status_code):
+            circuit.record_failure()
+        else:
+            circuit.record_success()
+    return response
+
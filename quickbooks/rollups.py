@@ -0,0 +1,149 @@
+# quickbooks/rollups.py
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Sum, Count
+from .bulk import bulk_upsert
+from .models import Account, CustomerInfo, AccountBalanceRollup, CustomerBalanceRollup, AccountTreeRollup
+import logging
+logger = logging.getLogger('quickbooks')
+
+ACCOUNT_ROLLUP_FIELDS = ('id_ref', 'classification', 'account_type', 'fully_qualified_name', 'current_balance', 'active')
+CUSTOMER_ROLLUP_FIELDS = ('id_ref', 'bill_city', 'balance', 'active')
+
+
+def to_decimal(value):
+    return Decimal(str(value or 0))
+
+
+def account_paths(fully_qualified_name):
+    """Every node from the root down to the account itself, e.g. 'A:B' -> ['A', 'A:B']."""
+    parts = (fully_qualified_name or '').split(':')
+    return [':'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def account_snapshots(realm_id, id_refs, for_update=False):
+    """Rollup-relevant state of the given accounts, keyed by id_ref."""
+    queryset = Account.objects.filter(realm_id=realm_id, id_ref__in=list(id_refs))
+    if for_update:
+        queryset = queryset.select_for_update()
+    return {row['id_ref']: row for row in queryset.values(*ACCOUNT_ROLLUP_FIELDS)}
+
+
+def customer_snapshots(realm_id, id_refs, for_update=False):
+    """Rollup-relevant state of the given customers, keyed by id_ref."""
+    queryset = CustomerInfo.objects.filter(realm_id=realm_id, id_ref__in=list(id_refs))
+    if for_update:
+        queryset = queryset.select_for_update()
+    return {row['id_ref']: row for row in queryset.values(*CUSTOMER_ROLLUP_FIELDS)}
+
+
+def _apply_deltas(model, realm_id, key_fields, count_field, deltas, extra_fields=None):
+    """Apply {key: [balance, count]} deltas to a rollup table in a fixed number of bulk statements."""
+    deltas = {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+    if not deltas:
+        return
+
+    lookup = {f'{field}__in': {key[i] for key in deltas} for i, field in enumerate(key_fields)}
+    existing = {
+        tuple(getattr(row, field) for field in key_fields): row
+        for row in model.objects.select_for_update().filter(realm_id=realm_id, **lookup)
+    }
+    to_save, to_delete = [], []
+    for key, (balance, count) in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            extra = extra_fields(key) if extra_fields else {}
+            row = model(realm_id=realm_id, total_balance=0, **{count_field: 0}, **dict(zip(key_fields, key)), **extra)
+        row.total_balance += balance
+        setattr(row, count_field, getattr(row, count_field) + count)
+        if getattr(row, count_field) > 0:
+            to_save.append(row)
+        elif row.pk:
+            to_delete.append(row.pk)
+
+    if to_delete:
+        model.objects.filter(pk__in=to_delete).delete()
+    bulk_upsert(model, to_save, ['total_balance', count_field], unique_fields=('realm_id',) + tuple(key_fields))
+
+
+def apply_account_deltas(realm_id, before, after):
+    """
+    Adjust the account rollups by the difference between two snapshots.
+    Only active accounts contribute; unchanged rows cancel out and touch nothing.
+    """
+    type_deltas = defaultdict(lambda: [Decimal('0'), 0])
+    tree_deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for id_ref in set(before) | set(after):
+        for row, sign in ((before.get(id_ref), -1), (after.get(id_ref), 1)):
+            if not row or not row['active']:
+                continue
+            balance = to_decimal(row['current_balance']) * sign
+            type_delta = type_deltas[(row['classification'], row['account_type'])]
+            type_delta[0] += balance
+            type_delta[1] += sign
+            for path in account_paths(row['fully_qualified_name']):
+                tree_deltas[(path,)][0] += balance
+                tree_deltas[(path,)][1] += sign
+
+    _apply_deltas(AccountBalanceRollup, realm_id, ('classification', 'account_type'), 'account_count', type_deltas)
+    _apply_deltas(
+        AccountTreeRollup, realm_id, ('path',), 'account_count', tree_deltas,
+        extra_fields=lambda key: {'depth': key[0].count(':')},
+    )
+
+
+def apply_customer_deltas(realm_id, before, after):
+    """Adjust the per-city customer rollup by the difference between two snapshots."""
+    city_deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for id_ref in set(before) | set(after):
+        for row, sign in ((before.get(id_ref), -1), (after.get(id_ref), 1)):
+            if not row or not row['active']:
+                continue
+            city_delta = city_deltas[(row['bill_city'] or '',)]
+            city_delta[0] += to_decimal(row['balance']) * sign
+            city_delta[1] += sign
+
+    _apply_deltas(CustomerBalanceRollup, realm_id, ('city',), 'customer_count', city_deltas)
+
+
+def rebuild_rollups(realm_id):
+    """Recompute every rollup of a realm from the mirror tables."""
+    with transaction.atomic():
+        AccountBalanceRollup.objects.filter(realm_id=realm_id).delete()
+        AccountTreeRollup.objects.filter(realm_id=realm_id).delete()
+        CustomerBalanceRollup.objects.filter(realm_id=realm_id).delete()
+
+        active_accounts = Account.objects.filter(realm_id=realm_id, active=True)
+        AccountBalanceRollup.objects.bulk_create([
+            AccountBalanceRollup(
+                realm_id=realm_id,
+                classification=row['classification'],
+                account_type=row['account_type'],
+                total_balance=row['total'] or 0,
+                account_count=row['count'],
+            )
+            for row in active_accounts.values('classification', 'account_type').annotate(total=Sum('current_balance'), count=Count('id'))
+        ])
+
+        tree = defaultdict(lambda: [Decimal('0'), 0])
+        for row in active_accounts.values('fully_qualified_name', 'current_balance'):
+            for path in account_paths(row['fully_qualified_name']):
+                tree[path][0] += to_decimal(row['current_balance'])
+                tree[path][1] += 1
+        AccountTreeRollup.objects.bulk_create([
+            AccountTreeRollup(realm_id=realm_id, path=path, depth=path.count(':'), total_balance=balance, account_count=count)
+            for path, (balance, count) in tree.items()
+        ])
+
+        active_customers = CustomerInfo.objects.filter(realm_id=realm_id, active=True)
+        CustomerBalanceRollup.objects.bulk_create([
+            CustomerBalanceRollup(
+                realm_id=realm_id,
+                city=row['bill_city'] or '',
+                total_balance=row['total'] or 0,
+                customer_count=row['count'],
+            )
+            for row in active_customers.values('bill_city').annotate(total=Sum('balance'), count=Count('id'))
+        ])
+    logger.info(f"Rollups rebuilt for realm {realm_id}")
@@ -0,0 +1,115 @@
+# quickbooks/search.py
+import re
+import unicodedata
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .bulk import bulk_insert
+from .models import CustomerInfo, CustomerSearchToken
+import logging
+logger = logging.getLogger('quickbooks')
+
+SEARCH_FIELDS = ('display_name', 'company_name', 'given_name', 'family_name', 'primary_email_addr', 'primary_phone')
+TOKEN_MAX_LENGTH = 100
+SELECTIVITY_PROBE = 500
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+
+def tokenize(text):
+    return [word[:TOKEN_MAX_LENGTH] for word in _WORD_RE.findall(normalize(text))]
+
+
+def customer_tokens(customer):
+    """Distinct search tokens for a customer (a model instance or a values() dict)."""
+    get = customer.get if isinstance(customer, dict) else lambda field: getattr(customer, field)
+    tokens = set()
+    for field in ('display_name', 'company_name', 'given_name', 'family_name'):
+        tokens.update(tokenize(get(field)))
+
+    email = normalize(get('primary_email_addr')).strip()
+    if email:
+        tokens.add(email[:TOKEN_MAX_LENGTH])
+        tokens.update(tokenize(email))
+
+    phone = get('primary_phone') or ''
+    digits = re.sub(r'\D', '', phone)
+    if digits:
+        tokens.add(digits[:TOKEN_MAX_LENGTH])
+        tokens.update(tokenize(phone))
+    return tokens
+
+
+def index_customers(realm_id, id_refs=None):
+    """
+    Rebuild the search tokens of the given customers, or of the whole realm when id_refs
+    is None. Tombstoned customers lose their tokens and get none back.
+    """
+    customers = CustomerInfo.objects.filter(realm_id=realm_id, deleted_at__isnull=True)
+    stale = CustomerSearchToken.objects.filter(realm_id=realm_id)
+    if id_refs is not None:
+        id_refs = list(id_refs)
+        customers = customers.filter(id_ref__in=id_refs)
+        stale = stale.filter(customer__id_ref__in=id_refs)
+    customers = list(customers.values('id', *SEARCH_FIELDS))
+
+    with transaction.atomic():
+        stale.delete()
+        bulk_insert(CustomerSearchToken, (
+            CustomerSearchToken(realm_id=realm_id, token=token, customer_id=customer['id'])
+            for customer in customers
+            for token in customer_tokens(customer)
+        ))
+    return len(customers)
+
+
+def query_terms(query):
+    """Search terms of a typeahead query; phone-like input is matched on its digits alone."""
+    stripped = (query or '').strip()
+    if stripped and re.fullmatch(r'[\d\s()+.-]+', stripped):
+        return [re.sub(r'\D', '', stripped)]
+    if '@' in stripped:
+        return [normalize(stripped)[:TOKEN_MAX_LENGTH]]
+    return tokenize(stripped)
+
+
+def prefix_range(term):
+    """
+    Range lookups matching tokens that start with term. The upper bound is the next
+    prefix after term, e.g. 'ab' -> 'ac', 'a9' -> 'aa', 'az' -> 'b', so it sorts the
+    same under binary and dictionary collations; a sentinel such as U+FFFF weighs
+    nothing in SQL Server's Windows collations.
+    """
+    stem = term.rstrip('z')
+    if not stem:
+        return {'token__gte': term}
+    last = stem[-1]
+    return {'token__gte': term, 'token__lt': stem[:-1] + ('a' if last == '9' else chr(ord(last) + 1))}
+
+
+def _term_tokens(realm_id, term):
+    # A range instead of LIKE so every backend can walk the (realm_id, token) index
+    return CustomerSearchToken.objects.filter(realm_id=realm_id, **prefix_range(term))
+
+
+def search_customers(realm_id, query, limit=20):
+    """Live customers with a token starting with every term of the query."""
+    terms = list(dict.fromkeys(query_terms(query)))
+    if not terms:
+        return CustomerInfo.objects.none()
+
+    if len(terms) > 1:
+        # Drive the lookup from the most selective term, probing at most SELECTIVITY_PROBE index entries per term
+        terms.sort(key=lambda term: _term_tokens(realm_id, term)[:SELECTIVITY_PROBE].count())
+    # Tombstones are filtered before the limit, so they cannot crowd out live matches
+    tokens = _term_tokens(realm_id, terms[0]).filter(customer__deleted_at__isnull=True)
+    for term in terms[1:]:
+        tokens = tokens.filter(Exists(
+            CustomerSearchToken.objects.filter(customer_id=OuterRef('customer_id'), **prefix_range(term))
+        ))
+    customer_ids = list(tokens.values_list('customer_id', flat=True).distinct()[:limit])
+    return CustomerInfo.objects.filter(id__in=customer_ids, deleted_at__isnull=True).order_by('display_name')
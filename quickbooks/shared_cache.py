@@ -0,0 +1,116 @@
+# quickbooks/shared_cache.py
+"""
+Cache shared by all workers for access tokens, hot entities and query results,
+through Django's cache framework (Redis, memcached or the file cache, see CACHES
+in settings).
+
+Keys carry two versions: SCHEMA_VERSION, bumped when the cached shape changes, and
+a generation per realm and entity type that a sync bumps to drop every entry of
+that type at once. Updates to a single entity delete just its key, and tokens are
+dropped whenever the QuickBooksToken row is saved or deleted. A per-realm mirror
+version counts every write to the mirror tables.
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from .models import QuickBooksToken
+
+SCHEMA_VERSION = 1
+
+
+def _cache():
+    return caches[settings.QUICKBOOKS_CACHE_ALIAS]
+
+
+def _token_key(realm_id):
+    return f'token:{realm_id}'
+
+
+def get_token(realm_id):
+    """The realm's QuickBooksToken, from the cache when possible; raises QuickBooksToken.DoesNotExist."""
+    token = _cache().get(_token_key(realm_id), version=SCHEMA_VERSION)
+    if token is None:
+        token = QuickBooksToken.objects.get(realm_id=realm_id)
+        _cache().set(_token_key(realm_id), token, timeout=settings.QUICKBOOKS_TOKEN_CACHE_TTL, version=SCHEMA_VERSION)
+    return token
+
+
+def invalidate_token(sender, instance, **kwargs):
+    _cache().delete(_token_key(instance.realm_id), version=SCHEMA_VERSION)
+
+
+def invalidate_tokens(realm_ids):
+    """For token rows written in bulk, which send no post_save signals."""
+    _cache().delete_many([_token_key(realm_id) for realm_id in realm_ids], version=SCHEMA_VERSION)
+
+
+def _generation_key(realm_id, entity):
+    return f'gen:{realm_id}:{entity}'
+
+
+def _generation(realm_id, entity):
+    return _cache().get_or_set(_generation_key(realm_id, entity), 1, timeout=None, version=SCHEMA_VERSION)
+
+
+def entity_key(realm_id, entity, id_ref):
+    """Key for one entity at the current generation; read it before fetching and reuse it to store the result."""
+    return f'entity:{realm_id}:{entity}:{id_ref}:{_generation(realm_id, entity)}'
+
+
+def get_entity(key):
+    return _cache().get(key, version=SCHEMA_VERSION)
+
+
+def set_entity(key, payload):
+    _cache().set(key, payload, timeout=settings.QUICKBOOKS_ENTITY_CACHE_TTL, version=SCHEMA_VERSION)
+
+
+def query_key(realm_id, entity, query):
+    """Key for a query's results at the entity type's current generation, so a sync drops them too."""
+    digest = hashlib.sha256(query.encode()).hexdigest()
+    return f'query:{realm_id}:{entity}:{digest}:{_generation(realm_id, entity)}'
+
+
+def get_query(key):
+    return _cache().get(key, version=SCHEMA_VERSION)
+
+
+def set_query(key, data):
+    _cache().set(key, data, timeout=settings.QUICKBOOKS_QUERY_CACHE_TTL, version=SCHEMA_VERSION)
+
+
+def invalidate_entity(realm_id, entity, id_ref):
+    if id_ref is not None:
+        _cache().delete(entity_key(realm_id, entity, id_ref), version=SCHEMA_VERSION)
+
+
+def _increment(key):
+    try:
+        _cache().incr(key, version=SCHEMA_VERSION)
+    except ValueError:
+        _cache().set(key, 2, timeout=None, version=SCHEMA_VERSION)
+
+
+def invalidate_entities(realm_id, entity):
+    """Drop every cached entity of this type for the realm by moving to a new generation."""
+    _increment(_generation_key(realm_id, entity))
+    bump_mirror_version(realm_id)
+
+
+def _mirror_key(realm_id):
+    return f'mirror:{realm_id}'
+
+
+def mirror_version(realm_id):
+    """Counter bumped on every write to the realm's mirror tables; versions the in-process snapshots."""
+    return _cache().get_or_set(_mirror_key(realm_id), 1, timeout=None, version=SCHEMA_VERSION)
+
+
+def bump_mirror_version(realm_id):
+    _increment(_mirror_key(realm_id))
+
+
+def connect_signals():
+    post_save.connect(invalidate_token, sender=QuickBooksToken, dispatch_uid='quickbooks.shared_cache.token_saved')
+    post_delete.connect(invalidate_token, sender=QuickBooksToken, dispatch_uid='quickbooks.shared_cache.token_deleted')
@@ -0,0 +1,155 @@
+# quickbooks/snapshot.py
+"""
+Compact in-process snapshot of a realm's master data for resolving IDs to names.
+
+Each realm's accounts and customers are loaded from the mirror tables once into
+parallel arrays (name, type, balance in cents) with a dict from id_ref to position,
+so resolving thousands of IDs is a dict lookup apiece instead of a query each.
+
+A snapshot is tagged with the realm's mirror version from the shared cache, which
+every sync and write-through bumps; a stale snapshot is rebuilt on next use. The
+snapshots of all realms share a memory budget, QUICKBOOKS_SNAPSHOT_MAX_BYTES, and
+the least recently used realms are evicted to stay under it.
+"""
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from decimal import Decimal
+from django.conf import settings
+from .models import Account, CustomerInfo
+from . import shared_cache
+import logging
+logger = logging.getLogger('quickbooks')
+
+# Entity name -> (model, (name, kind, balance) columns, key the kind is returned under)
+SNAPSHOT_SOURCES = {
+    'Account': (Account, ('fully_qualified_name', 'account_type', 'current_balance'), 'type'),
+    'Customer': (CustomerInfo, ('display_name', 'company_name', 'balance'), 'company'),
+}
+
+
+class EntityTable:
+    """id_ref -> (name, kind, balance) for one entity type, stored column-wise."""
+    __slots__ = ('kind_label', 'index', 'names', 'types', 'balances')
+
+    def __init__(self, rows, kind_label):
+        self.kind_label = kind_label
+        self.index = {}
+        self.names = []
+        self.types = []
+        # Balances have two decimal places; whole cents fit a compact signed 64-bit array
+        self.balances = array('q')
+        for id_ref, name, kind, balance in rows:
+            self.index[sys.intern(id_ref)] = len(self.names)
+            self.names.append(name)
+            # Types repeat across rows, so share one string object per distinct value
+            self.types.append(sys.intern(kind) if kind else kind)
+            self.balances.append(int((balance or 0) * 100))
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, id_ref):
+        position = self.index.get(id_ref)
+        if position is None:
+            return None
+        return {
+            'name': self.names[position],
+            self.kind_label: self.types[position],
+            'balance': Decimal(self.balances[position]).scaleb(-2),
+        }
+
+    def nbytes(self):
+        size = sys.getsizeof(self.index) + sys.getsizeof(self.names) + sys.getsizeof(self.types) + self.balances.itemsize * len(self.balances)
+        size += sum(sys.getsizeof(id_ref) for id_ref in self.index)
+        size += sum(sys.getsizeof(name) for name in self.names if name)
+        return size + sum(sys.getsizeof(kind) for kind in set(self.types) if kind)
+
+
+class RealmSnapshot:
+    __slots__ = ('realm_id', 'version', 'tables', 'nbytes')
+
+    def __init__(self, realm_id, version, tables):
+        self.realm_id = realm_id
+        self.version = version
+        self.tables = tables
+        self.nbytes = sum(table.nbytes() for table in tables.values())
+
+
+def build_snapshot(realm_id, version):
+    tables = {}
+    for entity, (model, columns, kind_label) in SNAPSHOT_SOURCES.items():
+        rows = model.objects.filter(realm_id=realm_id, deleted_at__isnull=True).values_list('id_ref', *columns)
+        tables[entity] = EntityTable(rows.iterator(chunk_size=5000), kind_label)
+    return RealmSnapshot(realm_id, version, tables)
+
+
+class SnapshotStore:
+    """Snapshots of many realms under one memory budget, evicting the least recently used."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.snapshots = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, realm_id):
+        version = shared_cache.mirror_version(realm_id)
+        with self.lock:
+            snapshot = self.snapshots.get(realm_id)
+            if snapshot is not None and snapshot.version == version:
+                self.snapshots.move_to_end(realm_id)
+                return snapshot
+
+        snapshot = build_snapshot(realm_id, version)
+        logger.debug(f"Built snapshot for realm {realm_id} at version {version}: {snapshot.nbytes} bytes")
+        with self.lock:
+            self._discard(realm_id)
+            self.snapshots[realm_id] = snapshot
+            self.nbytes += snapshot.nbytes
+            # Always keep the snapshot just built, even when it alone is over budget
+            while self.nbytes > self.max_bytes and len(self.snapshots) > 1:
+                evicted, _ = next(iter(self.snapshots.items()))
+                logger.debug(f"Evicting snapshot for realm {evicted}")
+                self._discard(evicted)
+        return snapshot
+
+    def _discard(self, realm_id):
+        snapshot = self.snapshots.pop(realm_id, None)
+        if snapshot is not None:
+            self.nbytes -= snapshot.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+            self.nbytes = 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SnapshotStore(settings.QUICKBOOKS_SNAPSHOT_MAX_BYTES)
+    return _store
+
+
+def resolve(realm_id, ids_by_entity):
+    """
+    Resolve many IDs at once, e.g. {'Account': ['1', '7'], 'Customer': ['42']}.
+
+    Returns {entity: {id_ref: entry or None when unknown}}, where an entry is
+    {'name', 'type', 'balance'} for accounts and {'name', 'company', 'balance'} for customers.
+    Raises KeyError for an entity type the snapshot does not hold.
+    """
+    snapshot = store().get(realm_id)
+    resolved = {}
+    for entity, id_refs in ids_by_entity.items():
+        table = snapshot.tables[entity]
+        resolved[entity] = {id_ref: table.get(id_ref) for id_ref in id_refs}
+    return resolved
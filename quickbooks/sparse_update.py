@@ -0,0 +1,70 @@
+# quickbooks/sparse_update.py
+"""
+Turns update requests into minimal sparse updates by diffing them against the mirror.
+
+Only top-level fields whose value differs from the mirrored record are sent.
+A nested object such as BillAddr is sent whole when any of its fields changed,
+with the mirrored subfields the caller left out filled back in, because QuickBooks
+replaces nested objects on a sparse update. Fields the mirror does not keep are
+always sent, since they cannot be shown to be unchanged.
+
+The diff is only made against a mirror row at the caller's SyncToken (or when the
+caller gave none). Otherwise the mirror is known to be behind, and the caller's
+fields are sent as they are.
+"""
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from .concurrency import ENTITY_MODELS, SERVER_FIELDS, supplied
+from .mirror import MIRROR_COLUMNS, mirror_columns, mirror_entity
+
+# The Id inside a nested object says which address it is, not that it changed
+IDENTITY_FIELDS = ('Id',)
+
+
+def same(mirrored, value):
+    if isinstance(mirrored, Decimal):
+        try:
+            return mirrored == Decimal(str(value))
+        except InvalidOperation:
+            return False
+    if isinstance(mirrored, date):
+        return mirrored.isoformat() == str(value)
+    if mirrored is None:
+        return value in ('', None)
+    return mirrored == value
+
+
+def changed(row, columns, path, value):
+    if isinstance(value, dict):
+        return any(changed(row, columns, path + (key,), item) for key, item in value.items() if key not in IDENTITY_FIELDS)
+    column = columns.get(path)
+    return column is None or not same(row[column], value)
+
+
+def minimal_update(realm_id, entity, payload, sent=None):
+    """
+    The sparse update to send for this request: the changed fields plus Id, SyncToken
+    (from the mirror when the caller left it out) and sparse=True.
+
+    sent is the request body the payload was built from; fields it sets to null
+    explicitly are sent as null, which clears them in QuickBooks.
+    """
+    id_ref = payload.get('Id')
+    if not id_ref:
+        return payload
+    columns = MIRROR_COLUMNS[entity]
+    row = ENTITY_MODELS[entity].objects.filter(realm_id=realm_id, id_ref=id_ref).values(*mirror_columns(entity)).first()
+    changes = {key: value for key, value in supplied(payload, sent).items() if key not in SERVER_FIELDS and key != 'Id'}
+    requested_token = payload.get('SyncToken')
+    if row and requested_token in (None, '', row['sync_token']):
+        current = mirror_entity(entity, row)
+        changes = {
+            key: {**current.get(key, {}), **value} if isinstance(value, dict) else value
+            for key, value in changes.items() if changed(row, columns, (key,), value)
+        }
+    sync_token = requested_token or (row['sync_token'] if row else None)
+    return {**changes, 'Id': id_ref, 'SyncToken': sync_token, 'sparse': True}
+
+
+def has_changes(update):
+    return any(key not in ('Id', 'SyncToken', 'sparse') for key in update)
@@ -0,0 +1,24 @@
+# quickbooks/storage.py
+from django.db.backends.signals import connection_created
+
+# Tuned for bulk sync: WAL lets readers run alongside the sync writer, NORMAL sync is
+# durable at checkpoints under WAL, and a larger page cache keeps upserts off the disk.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA busy_timeout=20000',
+)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+
+
+def connect_signals():
+    connection_created.connect(configure_sqlite, dispatch_uid='quickbooks.storage.configure_sqlite')
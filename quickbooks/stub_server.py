@@ -0,0 +1,318 @@
+# quickbooks/stub_server.py
+"""
+Local stand-in for the QuickBooks Online REST API, used by the benchmark command.
+
+Serves deterministic Account/Customer/Employee/CompanyInfo entities for any realm,
+with configurable page sizes, latency and injected 401/429 faults. Queries may
+filter with `where Id in (...)`, entities listed in server.deleted are gone, and
+/cdc reports updated and deleted entities. Updates are
+remembered per entity, rejected when they carry no SyncToken, and rejected with a
+stale-object fault when their SyncToken is out of date.
+"""
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+TIMESTAMP = "2024-01-01T00:00:00-08:00"
+ENTITIES = ('Account', 'Customer', 'Employee')
+
+
+@dataclass
+class StubConfig:
+    accounts: int = 200
+    customers: int = 1000
+    employees: int = 100
+    page_size: int = 1000
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_401_rate: float = 0.0
+    error_429_rate: float = 0.0
+    seed: int = 0
+
+
+def merge_update(entity, update):
+    """Apply an update body the way QuickBooks does: nested objects merge, nulls are ignored."""
+    for key, value in update.items():
+        if value is None:
+            continue
+        if isinstance(value, dict) and isinstance(entity.get(key), dict):
+            merge_update(entity[key], value)
+        else:
+            entity[key] = value
+
+
+def fault(code, message):
+    return {"Fault": {"Error": [{"Message": message, "code": str(code)}], "type": "ValidationFault"}, "time": TIMESTAMP}
+
+
+def account_parent(i):
+    return (i - 1) // 10 if i > 10 else None
+
+
+def account_fqn(i):
+    parent = account_parent(i)
+    return f"{account_fqn(parent)}:Account {i}" if parent else f"Account {i}"
+
+
+def make_account(i):
+    return {
+        "Id": str(i),
+        "Name": f"Account {i}",
+        "SubAccount": account_parent(i) is not None,
+        "FullyQualifiedName": account_fqn(i),
+        "Active": True,
+        "Classification": ("Asset", "Liability", "Equity", "Revenue", "Expense")[i % 5],
+        "AccountType": ("Bank", "Accounts Payable", "Equity", "Income", "Expense")[i % 5],
+        "AccountSubType": "Checking",
+        "CurrentBalance": round(i * 10.25, 2),
+        "CurrentBalanceWithSubAccounts": round(i * 10.25, 2),
+        "CurrencyRef": {"value": "USD", "name": "United States Dollar"},
+        "domain": "QBO",
+        "sparse": False,
+        "SyncToken": "0",
+        "MetaData": {"CreateTime": TIMESTAMP, "LastUpdatedTime": TIMESTAMP},
+    }
+
+
+def make_customer(i):
+    return {
+        "Id": str(i),
+        "Taxable": bool(i % 2),
+        "BillAddr": {"Line1": f"{i} Main St", "City": f"City {i % 50}", "CountrySubDivisionCode": "CA", "PostalCode": f"{90000 + i % 1000}"},
+        "Job": False,
+        "BillWithParent": False,
+        "Balance": round(i * 1.5, 2),
+        "BalanceWithJobs": round(i * 1.5, 2),
+        "CurrencyRef": {"value": "USD", "name": "United States Dollar"},
+        "PreferredDeliveryMethod": "Print",
+        "domain": "QBO",
+        "sparse": False,
+        "SyncToken": "0",
+        "MetaData": {"CreateTime": TIMESTAMP, "LastUpdatedTime": TIMESTAMP},
+        "GivenName": f"Given{i}",
+        "FamilyName": f"Family{i}",
+        "FullyQualifiedName": f"Customer {i}",
+        "CompanyName": f"Company {i}",
+        "DisplayName": f"Customer {i}",
+        "PrintOnCheckName": f"Customer {i}",
+        "Active": True,
+        "PrimaryPhone": {"FreeFormNumber": f"(555) {i:07d}"},
+        "PrimaryEmailAddr": {"Address": f"customer{i}@example.com"},
+    }
+
+
+def make_employee(i):
+    return {
+        "Id": str(i),
+        "BillableTime": False,
+        "domain": "QBO",
+        "sparse": False,
+        "SyncToken": "0",
+        "MetaData": {"CreateTime": TIMESTAMP, "LastUpdatedTime": TIMESTAMP},
+        "GivenName": f"Given{i}",
+        "FamilyName": f"Family{i}",
+        "DisplayName": f"Employee {i}",
+        "PrintOnCheckName": f"Employee {i}",
+        "Active": True,
+    }
+
+
+def make_company_info(i):
+    return {
+        "Id": str(i),
+        "CompanyName": "Benchmark Co",
+        "LegalName": "Benchmark Co LLC",
+        "CompanyAddr": {"Line1": "1 Bench Way", "City": "Mountain View", "CountrySubDivisionCode": "CA", "PostalCode": "94043"},
+        "CustomerCommunicationAddr": {"Line1": "1 Bench Way", "City": "Mountain View", "CountrySubDivisionCode": "CA", "PostalCode": "94043"},
+        "LegalAddr": {"Line1": "1 Bench Way", "City": "Mountain View", "CountrySubDivisionCode": "CA", "PostalCode": "94043"},
+        "CustomerCommunicationEmailAddr": {"Address": "billing@example.com"},
+        "PrimaryPhone": {"FreeFormNumber": "(555) 555-5555"},
+        "CompanyStartDate": "2020-01-01",
+        "FiscalYearStartMonth": "January",
+        "Country": "US",
+        "Email": {"Address": "info@example.com"},
+        "SupportedLanguages": "en",
+        "domain": "QBO",
+        "sparse": False,
+        "SyncToken": "0",
+        "MetaData": {"CreateTime": TIMESTAMP, "LastUpdatedTime": TIMESTAMP},
+    }
+
+
+BUILDERS = {'account': make_account, 'customer': make_customer, 'employee': make_employee, 'companyinfo': make_company_info}
+_FROM_RE = re.compile(r'\bfrom\s+(\w+)', re.IGNORECASE)
+_START_RE = re.compile(r'\bstartposition\s+(\d+)', re.IGNORECASE)
+_MAX_RE = re.compile(r'\bmaxresults\s+(\d+)', re.IGNORECASE)
+_IDS_RE = re.compile(r'\bid\s+in\s*\(([^)]*)\)', re.IGNORECASE)
+_COUNT_RE = re.compile(r'^\s*select\s+count\(\*\)', re.IGNORECASE)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "QuickBooksStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_json(self, status_code, body, extra_headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def injected_fault(self):
+        """Sleep for the configured latency and maybe answer with a 401/429 instead of the real response."""
+        with self.server.lock:
+            roll = self.server.random.random()
+            jitter = self.server.random.uniform(-1, 1) * self.config.jitter_ms
+        delay = max(self.config.latency_ms + jitter, 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if roll < self.config.error_401_rate:
+            self.send_json(401, fault(3200, "AuthenticationFailed"))
+            return True
+        if roll < self.config.error_401_rate + self.config.error_429_rate:
+            self.send_json(429, fault(3001, "ThrottleExceeded"), {'Retry-After': '1'})
+            return True
+        return False
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.request_count += 1
+        if self.injected_fault():
+            return
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+        if len(parts) >= 2 and parts[-1] == 'query':
+            return self.handle_query(parse_qs(parsed.query).get('query', [''])[0])
+        if len(parts) >= 2 and parts[-1] == 'cdc':
+            return self.handle_cdc(parse_qs(parsed.query).get('entities', [''])[0].split(','))
+        if len(parts) >= 3 and parts[-2].lower() in BUILDERS:
+            entity, entity_id = parts[-2].lower(), parts[-1]
+            if not entity_id.isdigit() or not self.exists(entity, int(entity_id)):
+                return self.send_json(400, fault(610, "Object Not Found"))
+            with self.server.lock:
+                body = self.server.updated.get((entity, int(entity_id))) or BUILDERS[entity](int(entity_id))
+            key = 'CompanyInfo' if entity == 'companyinfo' else entity.capitalize()
+            return self.send_json(200, {key: body, "time": TIMESTAMP})
+        self.send_json(404, fault(404, "Unsupported stub route"))
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.request_count += 1
+        body = self.read_body()
+        if self.injected_fault():
+            return
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+        if parts and parts[-1] == 'bearer':
+            return self.send_json(200, {
+                "access_token": "stub-access-token",
+                "refresh_token": "stub-refresh-token",
+                "expires_in": 3600,
+                "x_refresh_token_expires_in": 8726400,
+                "token_type": "bearer",
+            })
+        if parts and parts[-1].lower() in BUILDERS:
+            entity = parts[-1].lower()
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                return self.send_json(400, fault(2010, "Request has invalid or unsupported property"))
+            if data.get('Id') and data.get('SyncToken') in (None, ''):
+                return self.send_json(400, fault(2020, "Required param missing, need to supply the required value for the API"))
+            entity_id = int(data.get('Id') or 1)
+            with self.server.lock:
+                current = self.server.updated.get((entity, entity_id))
+                merged = json.loads(json.dumps(current)) if current else BUILDERS[entity](entity_id)
+                if data.get('SyncToken') not in (None, merged['SyncToken']):
+                    return self.send_json(400, fault(5010, "Stale Object Error : You and another user were working on the same thing."))
+                merge_update(merged, data)
+                merged['SyncToken'] = str(int(merged.get('SyncToken') or 0) + 1)
+                self.server.updated[(entity, entity_id)] = merged
+            key = 'CompanyInfo' if entity == 'companyinfo' else entity.capitalize()
+            return self.send_json(200, {key: merged, "time": TIMESTAMP})
+        self.send_json(404, fault(404, "Unsupported stub route"))
+
+    def exists(self, entity, entity_id):
+        return 1 <= entity_id <= self.entity_total(entity) and (entity, entity_id) not in self.server.deleted
+
+    def entity_total(self, entity):
+        return {'account': self.config.accounts, 'customer': self.config.customers,
+                'employee': self.config.employees, 'companyinfo': 1}[entity]
+
+    def handle_query(self, query):
+        match = _FROM_RE.search(query)
+        entity = match.group(1).capitalize() if match else ''
+        if entity not in ENTITIES:
+            return self.send_json(400, fault(4000, f"Error parsing query: {query}"))
+        start = int(_START_RE.search(query).group(1)) if _START_RE.search(query) else 1
+        max_results = int(_MAX_RE.search(query).group(1)) if _MAX_RE.search(query) else self.config.page_size
+        max_results = min(max_results, self.config.page_size)
+        key = entity.lower()
+        total = self.entity_total(key)
+        id_filter = _IDS_RE.search(query)
+        if id_filter:
+            matching = [i for i in sorted({int(value) for value in re.findall(r"'(\d+)'", id_filter.group(1))}) if 1 <= i <= total]
+        else:
+            matching = range(1, total + 1)
+        builder = BUILDERS[key]
+        with self.server.lock:
+            # Deleted entities are filtered out before paging, as QuickBooks does
+            if self.server.deleted:
+                matching = [i for i in matching if (key, i) not in self.server.deleted]
+            ids = matching[start - 1:start - 1 + max_results]
+            rows = [self.server.updated.get((key, i)) or builder(i) for i in ids]
+        if _COUNT_RE.search(query):
+            return self.send_json(200, {"QueryResponse": {"totalCount": len(matching)}, "time": TIMESTAMP})
+        self.send_json(200, {
+            "QueryResponse": {entity: rows, "startPosition": start, "maxResults": len(rows)},
+            "time": TIMESTAMP,
+        })
+
+    def handle_cdc(self, entities):
+        """Entities changed by POSTs plus deleted ones, regardless of changedSince."""
+        query_responses = []
+        with self.server.lock:
+            for entity in entities:
+                key = entity.lower()
+                changed = [body for (name, _), body in self.server.updated.items() if name == key]
+                deleted = [{"Id": str(i), "status": "Deleted", "domain": "QBO", "MetaData": {"LastUpdatedTime": TIMESTAMP}}
+                           for name, i in self.server.deleted if name == key]
+                if changed or deleted:
+                    query_responses.append({entity: changed + deleted, "startPosition": 1, "maxResults": len(changed) + len(deleted)})
+        self.send_json(200, {"CDCResponse": [{"QueryResponse": query_responses}], "time": TIMESTAMP})
+
+
+def start_stub_server(config=None, host='127.0.0.1', port=0):
+    """Start the stub in a daemon thread; returns the server, whose base_url points at /v3/company."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.config = config or StubConfig()
+    server.lock = threading.Lock()
+    server.random = random.Random(server.config.seed)
+    server.request_count = 0
+    # Entities changed by POSTs, so later reads and stale SyncTokens behave like QuickBooks
+    server.updated = {}
+    # (entity, id) pairs deleted in QuickBooks, e.g. {('customer', 7)}
+    server.deleted = set()
+    server.base_url = f"http://{host}:{server.server_address[1]}/v3/company"
+    server.token_url = f"http://{host}:{server.server_address[1]}/oauth2/v1/tokens/bearer"
+    threading.Thread(target=server.serve_forever, name='quickbooks-stub', daemon=True).start()
+    return server
@@ -0,0 +1,171 @@
+# quickbooks/sync_runs.py
+"""
+History of sync runs: one SyncRun row per sync of an entity type, with row counts,
+bytes transferred and the time spent in each stage.
+
+    with sync_run(realm_id, 'Account') as run:
+        with run.stage('fetch'):
+            response = upstream.get(url, realm_id=realm_id, headers=headers)
+        run.page(response)
+        ...
+
+Records whose SyncToken and balances match the mirror are counted as skipped and
+left out of the write. Balances are compared too because QuickBooks recalculates
+them after every transaction without bumping the SyncToken.
+"""
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.db import router
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+from .instrumentation import track
+from .models import Account, CustomerInfo, SyncRun
+import logging
+logger = logging.getLogger('quickbooks')
+
+STAGES = ('fetch', 'parse', 'map', 'write')
+# Keeps the IN list under SQL Server's bound-parameter limit
+DIFF_BATCH_SIZE = 1000
+# Mirror column -> QuickBooks field for values that change without a new SyncToken
+DERIVED_FIELDS = {
+    Account: {'current_balance': 'CurrentBalance', 'current_balance_with_sub_accounts': 'CurrentBalanceWithSubAccounts'},
+    CustomerInfo: {'balance': 'Balance', 'balance_with_jobs': 'BalanceWithJobs'},
+}
+
+
+def _decimal(value):
+    try:
+        return Decimal(str(value if value is not None else 0))
+    except InvalidOperation:
+        return None
+
+
+class SyncRecorder:
+    def __init__(self, realm_id, entity):
+        self.run = SyncRun(realm_id=realm_id, entity=entity, started_at=timezone.now())
+
+    @contextmanager
+    def stage(self, name):
+        if name not in STAGES:
+            raise ValueError(f"Unknown sync stage: {name}")
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            field = f'{name}_ms'
+            setattr(self.run, field, getattr(self.run, field) + (time.perf_counter() - started) * 1000)
+
+    def page(self, response):
+        self.run.pages_fetched += 1
+        self.run.bytes_transferred += len(response.content or b'')
+
+    def changed_records(self, model, records):
+        """The records that are new or changed since the mirror copy; counts inserts, updates and skips."""
+        realm_id = self.run.realm_id
+        records = [record for record in records if record.get('Id')]
+        derived = DERIVED_FIELDS.get(model, {})
+        current = {}
+        # Read from the primary: a lagging replica would make fresh rows look new
+        rows = model.objects.using(router.db_for_write(model)).filter(realm_id=realm_id)
+        for start in range(0, len(records), DIFF_BATCH_SIZE):
+            id_refs = [record['Id'] for record in records[start:start + DIFF_BATCH_SIZE]]
+            for row in rows.filter(id_ref__in=id_refs).values('id_ref', 'sync_token', 'deleted_at', *derived):
+                current[row['id_ref']] = row
+
+        changed = []
+        for record in records:
+            known = current.get(record['Id'])
+            if known is None:
+                self.run.rows_inserted += 1
+            # A tombstone is rewritten even at the same SyncToken, which brings it back
+            elif (known['sync_token'] == str(record.get('SyncToken')) and known['deleted_at'] is None
+                  and all(known[column] == _decimal(record.get(field)) for column, field in derived.items())):
+                self.run.rows_skipped += 1
+                continue
+            else:
+                self.run.rows_updated += 1
+            changed.append(record)
+        return changed
+
+    def add(self, **counts):
+        """Add to row counters, e.g. add(rows_deleted=3)."""
+        for field, count in counts.items():
+            setattr(self.run, field, getattr(self.run, field) + count)
+
+    def fail(self, error):
+        self.run.status = 'failed'
+        self.run.error = str(error)
+
+    def counts(self):
+        return {
+            'pages_fetched': self.run.pages_fetched,
+            'rows_inserted': self.run.rows_inserted,
+            'rows_updated': self.run.rows_updated,
+            'rows_skipped': self.run.rows_skipped,
+            'rows_deleted': self.run.rows_deleted,
+        }
+
+
+@contextmanager
+def sync_run(realm_id, entity):
+    """Record a SyncRun for the block; an exception marks it failed and is re-raised."""
+    recorder = SyncRecorder(realm_id, entity)
+    metrics = None
+    try:
+        with track(f"sync run {entity} realm={realm_id}") as metrics:
+            yield recorder
+    except Exception as e:
+        recorder.fail(e)
+        raise
+    finally:
+        run = recorder.run
+        if metrics is not None:
+            run.total_ms = metrics.elapsed * 1000
+            run.db_queries = metrics.db_queries
+            run.upstream_calls = metrics.upstream_calls
+        try:
+            run.save()
+        except Exception as e:
+            # History is best effort; never fail the sync because of it
+            logger.error(f"Could not record sync run for {entity} in realm {realm_id}: {e}")
+        logger.info(
+            f"Sync run {entity} realm={realm_id} {run.status}: {run.pages_fetched} pages, {run.bytes_transferred} bytes, "
+            f"+{run.rows_inserted} ~{run.rows_updated} ={run.rows_skipped} -{run.rows_deleted}, "
+            + ", ".join(f"{stage}={getattr(run, f'{stage}_ms'):.1f}ms" for stage in STAGES)
+        )
+
+
+def sync_trends(days=7, entity=None, min_runs=3):
+    """
+    Compare each realm/entity's average sync time over the last `days` days with the
+    `days` before that. Returns one dict per realm/entity, most slowed-down first.
+    """
+    now = timezone.now()
+    recent = Q(started_at__gte=now - timedelta(days=days))
+    baseline = Q(started_at__lt=now - timedelta(days=days))
+    runs = SyncRun.objects.filter(started_at__gte=now - timedelta(days=2 * days), status='success')
+    if entity:
+        runs = runs.filter(entity=entity)
+    rows = runs.values('realm_id', 'entity').annotate(
+        recent_runs=Count('id', filter=recent),
+        recent_avg_ms=Avg('total_ms', filter=recent),
+        recent_fetch_ms=Avg('fetch_ms', filter=recent),
+        recent_write_ms=Avg('write_ms', filter=recent),
+        baseline_runs=Count('id', filter=baseline),
+        baseline_avg_ms=Avg('total_ms', filter=baseline),
+        baseline_fetch_ms=Avg('fetch_ms', filter=baseline),
+        baseline_write_ms=Avg('write_ms', filter=baseline),
+    )
+
+    trends = []
+    for row in rows:
+        enough = row['recent_runs'] >= min_runs and row['baseline_runs'] >= min_runs
+        row['slowdown'] = round(row['recent_avg_ms'] / row['baseline_avg_ms'], 2) if enough and row['baseline_avg_ms'] else None
+        for key, value in row.items():
+            if key.endswith('_ms') and value is not None:
+                row[key] = round(value, 1)
+        trends.append(row)
+    trends.sort(key=lambda row: -(row['slowdown'] or 0))
+    return trends
@@ -1,999 +1,877 @@
-from django.test import TestCase
-
-# Create your tests here.
-from django.db import transaction
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework.permissions import AllowAny
-from rest_framework.decorators import api_view
-from rest_framework import status
-from django.conf import settings
-from .models import *
+import glob
+import gzip
 import json
-import requests
-from requests_oauthlib import OAuth2Session
-import logging
-logger = logging.getLogger('quickbooks')
-
-def get_oauth_session():
-    return OAuth2Session(client_id=settings.CLIENT_ID, redirect_uri=settings.REDIRECT_URI, scope=settings.SCOPE)
-
-
-
-class RefreshToken:
-    """Handles refreshing the access token when it expires."""
-
-    @staticmethod
-    def refresh(realm_id):
-        token_obj = QuickBooksToken.objects.filter(realm_id=realm_id).first()
-        if not token_obj or not token_obj.refresh_token:
-            return {"error": "Refresh token not found"}
-
-        token_url = settings.TOKEN_URL
-        payload = {
-            "grant_type": "refresh_token",
-            "refresh_token": token_obj.refresh_token,
-            "client_id": settings.CLIENT_ID,
-            "client_secret": settings.CLIENT_SECRET,
-        }
-
-        try:
-            response = requests.post(token_url, data=payload)
-            response.raise_for_status()
-            token_data = response.json()
-
-            # Update stored token information
-            StoreToken.store(realm_id, token_data)
-            return {"message": "Token refreshed successfully", "token_data": token_data}
-        except requests.exceptions.RequestException as e:
-            return {"error": "Failed to refresh token", "details": str(e)}
-
-
-class StoreToken:
-    @staticmethod
-    def store(realm_id, token):
-        token_obj, created = QuickBooksToken.objects.update_or_create(
-            realm_id=realm_id,
-            defaults={
-                'access_token': token.get('access_token'),
-                'refresh_token': token.get('refresh_token'),
-                'expires_in': token.get('expires_in'),
-                'scope': token.get('scope', 'com.intuit.quickbooks.accounting'),
-            }
-        )
-        return token_obj
-
-
-class AuthURLView(APIView):
-    permission_classes = [AllowAny]
-
-    def get(self, request):
-        logger.info("GET request received at DemoLoggingView")
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import compression, resilience, shared_cache, tombstones, upstream, write_behind
+from .conditional import entity_etag
+from .integrity import verify_mirror
+from .projection import parse_fields, project
+from .query_builder import QueryError, build_query
+from .rollups import rebuild_rollups
+from .search import index_customers, prefix_range, search_customers
+from .snapshot import SnapshotStore, resolve, store
+from .token_refresh import refresh_due_tokens
+from .sparse_update import has_changes, minimal_update
+from .instrumentation import assert_constant_queries, assert_max_queries
+from .models import (Account, AccountBalanceRollup, AccountTreeRollup, CustomerBalanceRollup, CustomerInfo,
+                     QuickBooksToken, SyncRun)
+from .stub_server import StubConfig, make_account, make_customer, make_employee, start_stub_server
+from .views import MIRROR_WRITERS, upsert_accounts, upsert_customers, upsert_employees
+
+REALM = 'test-realm'
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'KEY_PREFIX': 'quickbooks'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE, SERVICE_API_TOKENS={})
+class StubTestCase(TestCase):
+    """Runs against a local QuickBooks stub, with a token for REALM and fresh breakers and bulkheads."""
+    stub_config = StubConfig(accounts=30, customers=30, employees=30)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = start_stub_server(cls.stub_config)
+        cls.addClassCleanup(cls.stub.shutdown)
+
+    def setUp(self):
+        self.stub.updated.clear()
+        self.stub.deleted.clear()
+        self.stub.request_count = 0
+        cache.clear()
+        resilience._breakers.clear()
+        resilience._bulkheads.clear()
+        QuickBooksToken.objects.create(realm_id=REALM, access_token='access', refresh_token='refresh', expires_in=3600, scope='')
+        settings_override = override_settings(QUICKBOOKURL=self.stub.base_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+
+    def open_circuit(self, realm_id=REALM):
+        circuit = resilience.breaker(realm_id)
+        circuit.state, circuit.opened_at = resilience.OPEN, time.monotonic()
+
+
+class SyncQueryBudgetTests(TestCase):
+    """The mirror writers must run a fixed number of queries, whatever the batch size."""
+    sizes = (10, 200)
+
+    def assert_sync_budget(self, upsert, make, label, slack=0):
+        def insert(n):
+            upsert(f'insert-{n}', [make(i) for i in range(1, n + 1)])
+
+        def update(n):
+            upsert(f'insert-{n}', [dict(make(i), SyncToken='1') for i in range(1, n + 1)])
+
+        assert_constant_queries(insert, self.sizes, slack=slack, label=f'{label} insert')
+        assert_constant_queries(update, self.sizes, slack=slack, label=f'{label} update')
+
+    def test_upsert_accounts(self):
+        # SQLite splits the account tree's bulk_update at its bound-parameter limit
+        self.assert_sync_budget(upsert_accounts, make_account, 'accounts', slack=1)
+
+    def test_upsert_customers(self):
+        self.assert_sync_budget(upsert_customers, make_customer, 'customers')
+
+    def test_upsert_employees(self):
+        self.assert_sync_budget(upsert_employees, make_employee, 'employees')
+
+    def test_resync_of_unchanged_batch(self):
+        employees = [make_employee(i) for i in range(1, 201)]
+        upsert_employees('resync', employees)
+        with assert_max_queries(5, label='employee resync'):
+            upsert_employees('resync', employees)
+
+
+class ServiceTokenTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    @override_settings(SERVICE_API_TOKENS={'dash': 'secret123'})
+    def test_token_refresh_needs_a_service_token(self):
+        self.assertEqual(self.client.get('/refresh-token/1/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(self.client.get('/refresh-token/1/').status_code, 401)
+
+    @override_settings(SERVICE_API_TOKENS={'dash': 'secret123'})
+    def test_valid_token_is_let_through(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer secret123')
+        self.assertEqual(self.client.get('/sync-runs/1/').status_code, 200)
+
+    @override_settings(SERVICE_API_TOKENS={})
+    def test_unconfigured_api_ignores_bearer_headers(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer anything')
+        self.assertEqual(self.client.get('/sync-runs/1/').status_code, 200)
+
+    @override_settings(SERVICE_API_TOKENS={'dash': 'secret123'})
+    def test_oauth_login_stays_open(self):
+        self.assertNotIn(self.client.get('/login/').status_code, (401, 403))
+
+
+class MirrorFallbackTests(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 21)])
+        self.open_circuit()
+
+    def list_customers(self, query):
+        return self.client.get(f'/list-customer/{REALM}/', {'query': query})
+
+    def test_plain_list_is_served_from_the_mirror(self):
+        response = self.list_customers('select * from Customer startposition 11 maxresults 5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Data-Source'], 'mirror')
+        page = response.json()['success']['QueryResponse']['Customer']
+        self.assertEqual([customer['Id'] for customer in page], ['11', '12', '13', '14', '15'])
+
+    def test_filtered_list_is_not_answered_with_the_wrong_rows(self):
+        for query in ("select * from Customer where Id = '5'",
+                      'select * from Customer orderby DisplayName',
+                      'select DisplayName from Customer'):
+            with self.subTest(query=query):
+                self.assertEqual(self.list_customers(query).status_code, 503)
+
+    def test_get_is_served_from_the_mirror(self):
+        response = self.client.get(f'/get-customer/{REALM}/5/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['success']['Customer']['DisplayName'], 'Customer 5')
+        self.assertEqual(self.stub.request_count, 0)
+
+
+class VerifyMirrorTests(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 31)])
+        self.stub.deleted.add(('customer', 7))
+        self.stub.updated[('customer', 3)] = dict(make_customer(3), SyncToken='4', DisplayName='Renamed')
+
+    def test_drift_is_repaired(self):
+        summary = verify_mirror(REALM, 'Customer', write=upsert_customers)
+        self.assertEqual((summary['stale'], summary['gone']), (1, 1))
+        self.assertIsNotNone(CustomerInfo.objects.get(realm_id=REALM, id_ref='7').deleted_at)
+        renamed = CustomerInfo.objects.get(realm_id=REALM, id_ref='3')
+        self.assertEqual((renamed.sync_token, renamed.display_name), ('4', 'Renamed'))
+
+    def test_dry_run_changes_nothing(self):
+        summary = verify_mirror(REALM, 'Customer')
+        self.assertEqual((summary['stale'], summary['gone']), (1, 1))
+        self.assertFalse(CustomerInfo.objects.filter(realm_id=REALM, deleted_at__isnull=False).exists())
+
+    def test_incomplete_listing_tombstones_nothing(self):
+        # As if an entity deleted mid-listing had shifted a live one off the pages
+        with mock.patch.object(tombstones, 'upstream_count', return_value=30):
+            with self.assertRaises(RuntimeError):
+                verify_mirror(REALM, 'Customer', write=upsert_customers)
+        self.assertFalse(CustomerInfo.objects.filter(realm_id=REALM, deleted_at__isnull=False).exists())
+        self.assertEqual(CustomerInfo.objects.get(realm_id=REALM, id_ref='3').sync_token, '0')
+
+
+class TombstonedCustomerSearchTests(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 11)])
+        self.stub.deleted.add(('customer', 7))
+
+    def found(self, query):
+        return list(search_customers(REALM, query).values_list('id_ref', flat=True))
+
+    def test_deleted_customer_stays_out_of_search_after_a_rebuild(self):
+        self.assertEqual(self.found('Given7'), ['7'])
+        self.assertEqual(self.client.get(f'/sync-changes/{REALM}/').status_code, 200)
+        self.assertEqual(self.found('Given7'), [])
+        index_customers(REALM)
+        self.assertEqual(self.found('Given7'), [])
+        index_customers(REALM, ['7'])
+        self.assertEqual(self.found('Given7'), [])
+        self.assertEqual(self.found('Given'), [str(i) for i in (1, 10, 2, 3, 4, 5, 6, 8, 9)])
+
+
+class QueryBuilderTests(TestCase):
+    def test_compiles_a_canonical_query(self):
+        spec = {'entity': 'Customer', 'order_by': '-DisplayName', 'limit': 10, 'filters': [
+            {'field': 'Id', 'op': 'in', 'value': ['3', '1', '3']},
+            {'field': 'Balance', 'op': '>', 'value': 100},
+        ]}
+        self.assertEqual(build_query(spec), ('Customer',
+            "select * from Customer where Balance > 100 and Id in ('1', '3') "
+            "orderby DisplayName desc startposition 1 maxresults 10"))
+        self.assertEqual(build_query(dict(spec, filters=spec['filters'][::-1])), build_query(spec))
+
+    def test_string_literals_are_escaped(self):
+        _, query = build_query({'entity': 'Customer', 'filters': [{'field': 'DisplayName', 'value': "O'Brien \\ Sons"}]})
+        self.assertIn("DisplayName = 'O\\'Brien \\\\ Sons'", query)
+
+    def test_invalid_specs_are_rejected(self):
+        for spec in (
+            [],
+            {'entity': 'Invoice'},
+            {'entity': ['Customer']},
+            {'entity': 'Customer', 'filters': 5},
+            {'entity': 'Customer', 'filters': [{'field': 'Notes', 'value': 'x'}]},
+            {'entity': 'Customer', 'filters': [{'field': ['Id'], 'value': 'x'}]},
+            {'entity': 'Customer', 'filters': [{'field': 'Id', 'op': 'between', 'value': 'x'}]},
+            {'entity': 'Customer', 'filters': [{'field': 'Id', 'op': 'in', 'value': [{'a': 1}, ['b']]}]},
+            {'entity': 'Customer', 'filters': [{'field': 'Id', 'op': 'in', 'value': [str(i) for i in range(101)]}]},
+            {'entity': 'Customer', 'filters': [{'field': 'DisplayName', 'op': 'like', 'value': '%%'}]},
+            {'entity': 'Customer', 'filters': [{'field': 'DisplayName', 'value': {'$ne': 1}}]},
+            {'entity': 'Customer', 'order_by': 5},
+            {'entity': 'Customer', 'order_by': ['Notes']},
+            {'entity': 'Customer', 'limit': 5000},
+            {'entity': 'Customer', 'start': 20000},
+            {'entity': 'Customer', 'limit': 'many'},
+        ):
+            with self.subTest(spec=spec):
+                with self.assertRaises(QueryError):
+                    build_query(spec)
+
+
+class QueryViewTests(StubTestCase):
+    def post(self, body):
+        return self.client.post(f'/query/{REALM}/', body, format='json')
+
+    def test_bad_input_is_a_client_error(self):
+        for body in (
+            {'entity': 'Customer', 'filters': [{'field': 'Id', 'op': 'in', 'value': [{'a': 1}]}]},
+            {'entity': 'Customer', 'filters': [{'field': 'Id', 'op': 'in', 'value': [['1']]}]},
+            {'entity': 'Customer', 'fields': ['DisplayName', 5]},
+            {'entity': 'Customer', 'fields': 5},
+        ):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+    def test_results_are_cached(self):
+        body = {'entity': 'Customer', 'filters': [{'field': 'Id', 'op': 'in', 'value': ['2', '1']}], 'fields': ['DisplayName']}
+        first, second = self.post(body).json(), self.post(body).json()
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+        self.assertEqual(second['success']['QueryResponse']['Customer'], [{'Id': '1', 'DisplayName': 'Customer 1'}, {'Id': '2', 'DisplayName': 'Customer 2'}])
+        self.assertEqual(self.stub.request_count, 1)
+
+
+class SyncTokenResolutionTests(StubTestCase):
+    def update_middle_name(self, customer_id, middle_name, **body):
+        return self.client.put(f'/update-sparse-customer/{REALM}/', dict(body, Id=customer_id, MiddleName=middle_name), format='json')
+
+    def test_token_is_fetched_when_the_mirror_lacks_the_entity(self):
+        response = self.update_middle_name('5', 'Q')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stub.updated[('customer', 5)]['MiddleName'], 'Q')
+        self.assertEqual(CustomerInfo.objects.get(realm_id=REALM, id_ref='5').sync_token, '1')
+
+    def test_stale_mirror_token_is_rebased_and_retried(self):
+        upsert_customers(REALM, [make_customer(5)])
+        self.stub.updated[('customer', 5)] = dict(make_customer(5), SyncToken='3', DisplayName='Changed elsewhere')
+        response = self.update_middle_name('5', 'Q')
+        self.assertEqual(response.status_code, 200)
+        updated = self.stub.updated[('customer', 5)]
+        self.assertEqual((updated['SyncToken'], updated['MiddleName'], updated['DisplayName']), ('4', 'Q', 'Changed elsewhere'))
+
+    def test_stale_caller_token_is_rebased_too(self):
+        self.stub.updated[('customer', 5)] = dict(make_customer(5), SyncToken='2')
+        self.assertEqual(self.update_middle_name('5', 'Q', SyncToken='0').status_code, 200)
+        self.assertEqual(self.stub.updated[('customer', 5)]['SyncToken'], '3')
+
+    def test_unknown_entity_reports_the_lookup_failure(self):
+        self.assertEqual(self.update_middle_name('999', 'Q').status_code, 400)
+        self.assertNotIn(('customer', 999), self.stub.updated)
+
+
+@override_settings(QUICKBOOKS_BREAKER_FAILURES=2, QUICKBOOKS_GLOBAL_BREAKER_FAILURES=100, QUICKBOOKS_BREAKER_RESET_SECONDS=30,
+                   QUICKBOOKS_REALM_CONCURRENCY=1, QUICKBOOKS_BULKHEAD_WAIT_SECONDS=0)
+class ResilienceTests(SimpleTestCase):
+    def setUp(self):
+        resilience._breakers.clear()
+        resilience._bulkheads.clear()
+
+    def call(self, status_code=200):
+        return resilience.guarded_call(REALM, lambda: SimpleNamespace(status_code=status_code))
+
+    def fail(self):
+        def send():
+            raise ConnectionError('reset by peer')
+        with self.assertRaises(resilience.UpstreamUnavailable):
+            resilience.guarded_call(REALM, send)
+
+    def elapse_reset(self):
+        resilience.breaker(REALM).opened_at -= 30
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.call(500)
+        self.call(200)
+        self.call(429)
+        self.assertEqual(resilience.breaker(REALM).state, resilience.CLOSED)
+        self.fail()
+        self.assertEqual(resilience.breaker(REALM).state, resilience.OPEN)
+        with self.assertRaises(resilience.UpstreamUnavailable):
+            self.call()
+        # Only the realm's circuit opened
+        resilience.guarded_call('other-realm', lambda: SimpleNamespace(status_code=200))
+
+    def test_half_open_lets_one_probe_through(self):
+        self.call(503)
+        self.call(503)
+        self.elapse_reset()
+        circuit = resilience.breaker(REALM)
+        self.assertTrue(circuit.allow())
+        self.assertEqual(circuit.state, resilience.HALF_OPEN)
+        self.assertFalse(circuit.allow())
+        circuit.cancel()
+        self.assertTrue(circuit.allow())
+
+    def test_failed_probe_reopens_and_successful_probe_closes(self):
+        self.call(503)
+        self.call(503)
+        self.elapse_reset()
+        self.call(503)
+        self.assertEqual(resilience.breaker(REALM).state, resilience.OPEN)
+        with self.assertRaises(resilience.UpstreamUnavailable):
+            self.call()
+        self.elapse_reset()
+        self.call(200)
+        self.assertEqual(resilience.breaker(REALM).state, resilience.CLOSED)
+        self.call(200)
+
+    def test_full_bulkhead_rejects_without_charging_the_circuit(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def slow_send():
+            entered.set()
+            release.wait(5)
+            return SimpleNamespace(status_code=200)
+
+        worker = threading.Thread(target=resilience.guarded_call, args=(REALM, slow_send))
+        worker.start()
         try:
-            oauth = get_oauth_session()
-            auth_url, state = oauth.authorization_url(settings.AUTHORIZATION_BASE_URL)
-            logger.debug(f"Operation result auth url: {auth_url}")
-            return Response({"auth_url": auth_url}, status=status.HTTP_200_OK)
-        except Exception as e:
-            ogger.error(f"auth url An error occurred: {e}")
-            return Response({"error": str(e)}, status=status.HTTP_200_OK)
-
-
-
-class CallbackView(APIView):
-    permission_classes = [AllowAny]
-
-    def get(self, request):
-        logger.info("GET request received at CallbackView")
-        code = request.query_params.get("code")
-        realm_id = request.query_params.get("realmId")
-
-        if not code or not realm_id:
-            return Response({"error": "Missing authorization code or realmId"}, status=status.HTTP_400_BAD_REQUEST)
-
-        token_url = settings.TOKEN_URL
-        payload = {
-            "grant_type": "authorization_code",
-            "code": code,
-            "redirect_uri": settings.REDIRECT_URI,
-            "client_id": settings.CLIENT_ID,
-            "client_secret": settings.CLIENT_SECRET,
-            
+            self.assertTrue(entered.wait(5))
+            for _ in range(3):
+                with self.assertRaisesMessage(resilience.UpstreamUnavailable, 'Too many concurrent'):
+                    self.call()
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(resilience.breaker(REALM).failures, 0)
+        self.call()
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class WriteBehindTests(TransactionTestCase):
+    """Flushes are driven by hand; the background thread only runs them on close()."""
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp(prefix='write-behind-')
+        self.addCleanup(shutil.rmtree, self.journal_dir, ignore_errors=True)
+
+    def start_buffer(self, writers=MIRROR_WRITERS):
+        buffer = write_behind.WriteBehindBuffer(writers, interval_ms=3600 * 1000, max_rows=10 ** 6, journal_dir=self.journal_dir)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def segments(self):
+        return glob.glob(os.path.join(self.journal_dir, '*.jsonl'))
+
+    def mirrored(self, id_ref):
+        return CustomerInfo.objects.filter(realm_id=REALM, id_ref=id_ref).values_list('sync_token', 'display_name').first()
+
+    def write_orphan(self, lines):
+        # Named like a segment of a process that died without flushing
+        with open(os.path.join(self.journal_dir, '999999-1-1.jsonl'), 'w') as segment:
+            segment.write('\n'.join(lines))
+
+    def entry(self, record):
+        return json.dumps({'realm_id': REALM, 'entity': 'Customer', 'record': record})
+
+    def test_flush_writes_the_latest_version_once(self):
+        buffer = self.start_buffer()
+        buffer.add(REALM, 'Customer', dict(make_customer(5), SyncToken='1', DisplayName='First'))
+        buffer.add(REALM, 'Customer', dict(make_customer(5), SyncToken='2', DisplayName='Second'))
+        self.assertEqual(buffer.rows, 1)
+        self.assertIsNone(self.mirrored('5'))
+        with open(self.segments()[0]) as segment:
+            self.assertEqual(len(segment.readlines()), 2)
+
+        buffer.flush()
+        self.assertEqual(self.mirrored('5'), ('2', 'Second'))
+        # The flushed segment is released; only the open one is left
+        self.assertEqual(len(self.segments()), 1)
+
+    def test_flush_never_regresses_the_mirror(self):
+        upsert_customers(REALM, [dict(make_customer(5), SyncToken='5', DisplayName='Newer')])
+        buffer = self.start_buffer()
+        buffer.add(REALM, 'Customer', dict(make_customer(5), SyncToken='3', DisplayName='Older'))
+        buffer.add(REALM, 'Customer', dict(make_customer(6), SyncToken='1'))
+        buffer.flush()
+        self.assertEqual(self.mirrored('5'), ('5', 'Newer'))
+        self.assertEqual(self.mirrored('6')[0], '1')
+
+    def test_failed_flush_is_retried_from_the_buffer(self):
+        calls = []
+
+        def flaky(realm_id, records):
+            calls.append(len(records))
+            if len(calls) == 1:
+                raise RuntimeError('database is down')
+            upsert_customers(realm_id, records)
+
+        buffer = self.start_buffer({'Customer': flaky})
+        buffer.add(REALM, 'Customer', make_customer(5))
+        buffer.flush()
+        self.assertEqual((buffer.rows, len(self.segments())), (1, 2))
+        buffer.flush()
+        self.assertEqual((buffer.rows, len(self.segments())), (0, 1))
+        self.assertEqual(self.mirrored('5')[0], '0')
+
+    def test_replay_after_a_crash(self):
+        upsert_customers(REALM, [dict(make_customer(7), SyncToken='9')])
+        self.write_orphan([
+            self.entry(dict(make_customer(5), SyncToken='1', DisplayName='Old')),
+            self.entry(dict(make_customer(5), SyncToken='2', DisplayName='Replayed')),
+            self.entry(dict(make_customer(7), SyncToken='4')),
+            '{"realm_id": "torn',
+        ])
+        self.assertEqual(write_behind.replay(MIRROR_WRITERS, self.journal_dir), 1)
+        self.assertEqual(self.mirrored('5'), ('2', 'Replayed'))
+        self.assertEqual(self.mirrored('7')[0], '9')
+        self.assertEqual(self.segments(), [])
+
+    def test_replay_leaves_live_segments_alone(self):
+        buffer = self.start_buffer()
+        buffer.add(REALM, 'Customer', make_customer(5))
+        self.assertEqual(write_behind.replay(MIRROR_WRITERS, self.journal_dir), 0)
+        self.assertEqual(len(self.segments()), 1)
+        self.assertIsNone(self.mirrored('5'))
+
+
+class MinimalUpdateTests(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        upsert_customers(REALM, [dict(make_customer(5), SyncToken='2')])
+
+    def test_only_changed_fields_are_sent(self):
+        update = minimal_update(REALM, 'Customer', {'Id': '5', 'DisplayName': 'Customer 5', 'Balance': 7.5, 'GivenName': 'New', 'MiddleName': 'M'})
+        self.assertEqual(update, {'GivenName': 'New', 'MiddleName': 'M', 'Id': '5', 'SyncToken': '2', 'sparse': True})
+
+    def test_changed_nested_object_is_sent_whole(self):
+        update = minimal_update(REALM, 'Customer', {'Id': '5', 'BillAddr': {'Id': '9', 'City': 'Elsewhere'}, 'PrimaryEmailAddr': {'Address': 'customer5@example.com'}})
+        self.assertEqual(update['BillAddr'], {'Line1': '5 Main St', 'City': 'Elsewhere', 'CountrySubDivisionCode': 'CA', 'PostalCode': '90005', 'Id': '9'})
+        self.assertNotIn('PrimaryEmailAddr', update)
+
+    def test_explicit_nulls_are_kept_and_omitted_fields_dropped(self):
+        payload = {'Id': '5', 'CompanyName': None, 'FamilyName': None}
+        update = minimal_update(REALM, 'Customer', payload, sent={'Id': '5', 'CompanyName': None})
+        self.assertEqual(update, {'CompanyName': None, 'Id': '5', 'SyncToken': '2', 'sparse': True})
+
+    def test_no_diff_against_a_mirror_that_is_behind(self):
+        update = minimal_update(REALM, 'Customer', {'Id': '5', 'SyncToken': '3', 'DisplayName': 'Customer 5'})
+        self.assertEqual(update, {'DisplayName': 'Customer 5', 'Id': '5', 'SyncToken': '3', 'sparse': True})
+
+    def test_unchanged_update_does_not_call_quickbooks(self):
+        self.assertFalse(has_changes(minimal_update(REALM, 'Customer', {'Id': '5', 'DisplayName': 'Customer 5', 'Active': True})))
+        response = self.client.put(f'/update-sparse-customer/{REALM}/', {'Id': '5', 'SyncToken': '2'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['unchanged'])
+        self.assertEqual(response.json()['success']['Customer']['DisplayName'], 'Customer 5')
+        self.assertEqual(self.stub.request_count, 0)
+
+
+class TombstoneTests(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 31)])
+        upsert_accounts(REALM, [make_account(i) for i in range(1, 31)])
+
+    def live_customers(self):
+        return set(CustomerInfo.objects.filter(realm_id=REALM, deleted_at__isnull=True).values_list('id_ref', flat=True))
+
+    def test_cdc_tombstones_deleted_and_upserts_changed_entities(self):
+        self.stub.deleted.update({('customer', 7), ('account', 12)})
+        self.stub.updated[('customer', 3)] = dict(make_customer(3), SyncToken='1', DisplayName='Renamed')
+        response = self.client.get(f'/sync-changes/{REALM}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['success']['rows_deleted'], 2)
+        deleted = CustomerInfo.objects.get(realm_id=REALM, id_ref='7')
+        self.assertEqual((deleted.active, deleted.deleted_at is not None), (False, True))
+        self.assertIsNotNone(Account.objects.get(realm_id=REALM, id_ref='12').deleted_at)
+        self.assertEqual(CustomerInfo.objects.get(realm_id=REALM, id_ref='3').display_name, 'Renamed')
+
+        # Seen again in CDC, a tombstoned entity is not counted twice
+        self.assertEqual(self.client.get(f'/sync-changes/{REALM}/').json()['success']['rows_deleted'], 0)
+
+    def test_entity_that_comes_back_is_live_again(self):
+        tombstones.tombstone(REALM, 'Customer', ['7'])
+        upsert_customers(REALM, [dict(make_customer(7), SyncToken='1')])
+        self.assertIn('7', self.live_customers())
+
+    def test_reconcile_tombstones_ids_gone_upstream(self):
+        self.stub.deleted.update({('customer', 4), ('customer', 30)})
+        CustomerInfo.objects.filter(realm_id=REALM, id_ref='2').delete()
+        result = tombstones.reconcile_ids(REALM, 'Customer')
+        self.assertEqual(result, {'tombstoned': 2, 'missing': ['2']})
+        self.assertEqual(self.live_customers(), {str(i) for i in range(1, 31)} - {'2', '4', '30'})
+
+    def test_reconcile_pages_through_every_id(self):
+        self.stub.deleted.add(('customer', 25))
+        with mock.patch.object(tombstones, 'ID_PAGE_SIZE', 10):
+            self.assertEqual(tombstones.reconcile_ids(REALM, 'Customer')['tombstoned'], 1)
+        self.assertEqual(len(self.live_customers()), 29)
+
+    def test_reconcile_count_mismatch_tombstones_nothing(self):
+        self.stub.deleted.add(('customer', 4))
+        # As if an entity deleted mid-listing had shifted a live one off the pages
+        with mock.patch.object(tombstones, 'upstream_count', return_value=30):
+            with self.assertRaisesMessage(RuntimeError, 'nothing tombstoned'):
+                tombstones.reconcile_ids(REALM, 'Customer')
+        self.assertEqual(len(self.live_customers()), 30)
+
+
+class ConditionalGetTests(StubTestCase):
+    def get_customer(self, customer_id, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(f'/get-customer/{REALM}/{customer_id}/', **headers)
+
+    def test_etag_is_the_sync_token_and_update_time(self):
+        self.assertEqual(entity_etag('3', '2024-01-01T00:00:00-08:00'), 'W/"3-1704096000"')
+        self.assertIsNone(entity_etag(None, '2024-01-01T00:00:00-08:00'))
+
+    def test_revalidation_answers_304(self):
+        first = self.get_customer('5')
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        for header in (etag, etag.removeprefix('W/'), f'"other", {etag}', '*'):
+            with self.subTest(header=header):
+                response = self.get_customer('5', header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.stub.request_count, 1)
+
+    def test_mirror_answers_304_without_calling_quickbooks(self):
+        upsert_customers(REALM, [make_customer(5)])
+        etag = entity_etag('0', '2024-01-01T00:00:00-08:00')
+        self.assertEqual(self.get_customer('5', etag).status_code, 304)
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_outdated_etag_gets_the_new_version(self):
+        upsert_customers(REALM, [make_customer(5)])
+        self.stub.updated[('customer', 5)] = dict(make_customer(5), SyncToken='1')
+        response = self.get_customer('5', 'W/"0-1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], entity_etag('1', '2024-01-01T00:00:00-08:00'))
+
+
+class RollupTests(TestCase):
+    """Rollups maintained during sync must always equal a rebuild from the mirror."""
+
+    def rollups(self):
+        return {
+            'types': set(AccountBalanceRollup.objects.filter(realm_id=REALM).values_list('classification', 'account_type', 'total_balance', 'account_count')),
+            'tree': set(AccountTreeRollup.objects.filter(realm_id=REALM).values_list('path', 'depth', 'total_balance', 'account_count')),
+            'cities': set(CustomerBalanceRollup.objects.filter(realm_id=REALM).values_list('city', 'total_balance', 'customer_count')),
         }
 
-        try:
-            response = requests.post(token_url, data=payload)
-            response.raise_for_status()
-            token_data = response.json()
-            
-            StoreToken.store(realm_id, token_data)
-            token_data['realmId'] = realm_id
-            logger.debug(f"Operation result callback: {token_data}")
-            return Response({"message": "Token saved successfully", "token_data": token_data}, status=status.HTTP_200_OK)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"An error occurred callback: {e}")
-            return Response({"error": "Failed to fetch token", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-
-class RefreshQuickBooksTokenView(APIView):
-    """
-    API to refresh the QuickBooks access token using the stored refresh token.
-    """
-    permission_classes = [AllowAny]
-
-    def get(self, request, realm_id):
-        logger.info("GET request received at refreshtokenview")
-        """
-        Handles GET request to refresh the token for the given realm_id.
-        """
-        try:
-            # Call the refresh method from the RefreshToken class
-            refresh_response = RefreshToken.refresh(realm_id)
-
-            if "error" in refresh_response:
-                return Response(
-                    {
-                        "error": refresh_response["error"],
-                        "details": refresh_response.get("details", "No additional details provided.")
-                    },
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            logger.debug(f"Operation result refreshtokenview: {refresh_response}")
-            return Response(
-                {
-                    "message": refresh_response["message"],
-                    "token_data": refresh_response["token_data"]
-                },
-                status=status.HTTP_200_OK
-            )
-        except Exception as e:
-            logger.error(f"An error occurred refreshtokenview: {e}")
-            return Response(
-                {"error": "Unexpected error occurred while refreshing token", "details": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-
-class CreateAccountView(APIView):
-    def post(self, request, realm_id):
-        logger.info("post request received at create account")
-        name = request.data.get('name')
-        account_type = request.data.get('account_type')
-        if not name and not account_type:
-            return Response({"error": "Name and Account Type is required in the request body."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred create account : realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        payload = json.dumps({
-            "Name": name,
-            "AccountType": account_type
+    def assert_matches_rebuild(self):
+        incremental = self.rollups()
+        rebuild_rollups(REALM)
+        self.assertEqual(incremental, self.rollups())
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        upsert_accounts(REALM, [make_account(i) for i in range(1, 31)])
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 31)])
+        self.assert_matches_rebuild()
+        self.assertEqual(AccountTreeRollup.objects.get(realm_id=REALM, path='Account 1').account_count, 11)
+
+        # Balances change, a customer moves city, an account is deactivated
+        upsert_accounts(REALM, [dict(make_account(3), SyncToken='1', CurrentBalance=1000),
+                                dict(make_account(12), SyncToken='1', Active=False)])
+        upsert_customers(REALM, [dict(make_customer(4), SyncToken='1', Balance=99.5, BillAddr={'City': 'Elsewhere'})])
+        self.assert_matches_rebuild()
+
+        # An account changes type and is moved under another parent
+        moved = dict(make_account(25), SyncToken='1', Classification='Expense', AccountType='Expense',
+                     FullyQualifiedName='Account 3:Account 25', ParentRef={'value': '3'})
+        upsert_accounts(REALM, [moved])
+        self.assert_matches_rebuild()
+
+        # Deleted upstream, and a deactivated account coming back
+        tombstones.tombstone(REALM, 'Account', ['7', '21'])
+        tombstones.tombstone(REALM, 'Customer', ['5'])
+        upsert_accounts(REALM, [dict(make_account(12), SyncToken='2')])
+        self.assert_matches_rebuild()
+
+
+@override_settings(CACHES=LOCMEM_CACHE, SERVICE_API_TOKENS={})
+class AccountTreeTests(TestCase):
+    def setUp(self):
+        upsert_accounts(REALM, [make_account(i) for i in range(1, 31)])
+
+    def subtree(self, account_id):
+        return {account['id_ref']: account for account in APIClient().get(f'/account-subtree/{REALM}/{account_id}/').json()['success']}
+
+    def test_subtree_with_rolled_up_balance(self):
+        subtree = self.subtree('1')
+        self.assertEqual(set(subtree), {'1'} | {str(i) for i in range(11, 21)})
+        self.assertEqual((subtree['15']['parent_id'], subtree['15']['depth']), ('1', 1))
+        self.assertEqual(float(subtree['1']['subtree_balance']), 10.25 * (1 + sum(range(11, 21))))
+
+    def test_reparented_account_moves_with_its_path(self):
+        upsert_accounts(REALM, [dict(make_account(15), SyncToken='1', FullyQualifiedName='Account 2:Account 15')])
+        self.assertNotIn('15', self.subtree('1'))
+        self.assertEqual(Account.objects.get(realm_id=REALM, id_ref='15').path, '/2/15/')
+        self.assertEqual(self.subtree('2')['15']['parent_id'], '2')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SnapshotTests(TestCase):
+    realms = ('realm-a', 'realm-b', 'realm-c')
+
+    def setUp(self):
+        cache.clear()
+        store().clear()
+        for realm_id in self.realms:
+            upsert_customers(realm_id, [make_customer(i) for i in range(1, 51)])
+            upsert_accounts(realm_id, [make_account(i) for i in range(1, 11)])
+
+    def test_least_recently_used_realm_is_evicted(self):
+        size = SnapshotStore(10 ** 9).get('realm-a').nbytes
+        snapshots = SnapshotStore(int(size * 2.5))
+        snapshots.get('realm-a')
+        snapshots.get('realm-b')
+        snapshots.get('realm-a')
+        snapshots.get('realm-c')
+        self.assertEqual(list(snapshots.snapshots), ['realm-a', 'realm-c'])
+        self.assertEqual(snapshots.nbytes, sum(snapshot.nbytes for snapshot in snapshots.snapshots.values()))
+
+    def test_snapshot_over_budget_is_still_kept(self):
+        snapshots = SnapshotStore(1)
+        snapshots.get('realm-a')
+        snapshots.get('realm-b')
+        self.assertEqual(list(snapshots.snapshots), ['realm-b'])
+
+    def test_mirror_writes_rebuild_the_snapshot(self):
+        self.assertEqual(resolve('realm-a', {'Customer': ['5']})['Customer']['5']['name'], 'Customer 5')
+        upsert_customers('realm-a', [dict(make_customer(5), SyncToken='1', DisplayName='Renamed')])
+        tombstones.tombstone('realm-a', 'Customer', ['6'])
+        shared_cache.bump_mirror_version('realm-a')
+        resolved = resolve('realm-a', {'Customer': ['5', '6', '999'], 'Account': ['3']})
+        self.assertEqual(resolved['Customer'], {
+            '5': {'name': 'Renamed', 'company': 'Company 5', 'balance': Decimal('7.50')}, '6': None, '999': None,
         })
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {token.access_token}'
-        }
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/account'
-        response = requests.post(url, headers=headers, data=payload)
-
-        try:
-            if response.status_code == 200:
-                logger.debug(f"Operation result create account: {response.json()}")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred create account: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred create account: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-
-def insert_accounts(api_response):
-    try:
-        accounts = api_response.get("QueryResponse", {}).get("Account", [])
-        if not accounts:
-            return {"status": "error", "message": "No accounts found in the response"}
-
-        for account_data in accounts:
-            print(account_data,'account_data.get("CurrencyRef")>>>>>>')
-            # Process related objects first
-            currency_ref_data = account_data.get("CurrencyRef")
-
-            currency_ref = None
-            if currency_ref_data:
-                currency_ref = CurrencyRef.objects.create(
-                    value=currency_ref_data["value"],
-                    name=currency_ref_data["name"],
-                )
-            
-            metadata_data = account_data.get("MetaData")
-            metadata = None
-            if metadata_data:
-                metadata = MetaData.objects.create(
-                    create_time=metadata_data["CreateTime"],
-                    last_updated_time= metadata_data["LastUpdatedTime"]
-                )
-            
-            # Insert or update the Account
-            Account.objects.update_or_create(
-                id_ref=account_data["Id"],  # Unique identifier
-                defaults={
-                    "name": account_data["Name"],
-                    "sub_account": account_data.get("SubAccount", False),
-                    "fully_qualified_name": account_data["FullyQualifiedName"],
-                    "active": account_data.get("Active", True),
-                    "classification": account_data["Classification"],
-                    "account_type": account_data["AccountType"],
-                    "account_sub_type": account_data["AccountSubType"],
-                    "current_balance": account_data["CurrentBalance"],
-                    "current_balance_with_sub_accounts": account_data["CurrentBalanceWithSubAccounts"],
-                    "currency_ref": currency_ref,
-                    "domain": account_data["domain"],
-                    "sparse": account_data.get("sparse", False),
-                    "sync_token": account_data["SyncToken"],
-                    "metadata": metadata,
-                }
-            )
-        
-        return Response({"status": "success", "message": "Accounts inserted successfully"})
-    except Exception as e:
-        return Response({"status": "fail", "error": str(e)})
-
-
-class ListAccountsView(APIView):
-    def get(self, request, realm_id):
-        logger.info("GET request received at listaccountview")
-        query = request.query_params.get('query')
-        if not query:
-            return Response({"error": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred listaccountview: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/query?query={query}'
-        headers = {
-            'Authorization': f'Bearer {token.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                insert_accounts(response.json())
-                logger.debug(f"Operation result listaccountview: {response.json()}")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred listaccountview: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            print(e,'dsdddddddddddd')
-            logger.error(f"An error occurred listaccountview: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-class GetAccountView(APIView):
-    def get(self, request, realm_id, account_id):
-        logger.info("GET request received at GetAccountView")
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred GetAccountView: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/account/{account_id}'
-        headers = {
-            'Authorization': f'Bearer {token.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                logger.debug(f"Operation result GetAccountView:")
-
-                try:
-                    response.raise_for_status()
-                    account_data = response.json().get('Account', {})
-                    currency_ref = CurrencyRef.objects.create(
-                        value=account_data['CurrencyRef']['value'],
-                        name=account_data['CurrencyRef']['name']
-                    )
-
-                    metadata = MetaData.objects.create(
-                        create_time=account_data['MetaData']['CreateTime'],
-                        last_updated_time=account_data['MetaData']['LastUpdatedTime']
-                    )
-
-                    Account.objects.update_or_create(
-                    id_ref=account_data['Id'],
-                    defaults={
-                        'name': account_data['Name'],
-                        'sub_account': account_data['SubAccount'],
-                        'fully_qualified_name': account_data['FullyQualifiedName'],
-                        'active': account_data['Active'],
-                        'classification': account_data['Classification'],
-                        'account_type': account_data['AccountType'],
-                        'account_sub_type': account_data['AccountSubType'],
-                        'current_balance': account_data['CurrentBalance'],
-                        'current_balance_with_sub_accounts': account_data['CurrentBalanceWithSubAccounts'],
-                        'currency_ref': currency_ref,
-                        'domain': account_data['domain'],
-                        'sparse': account_data['sparse'],
-                        'sync_token': account_data['SyncToken'],
-                        'metadata': metadata,
-                    }
-                )
-                except Exception as e:
-                    print(e)
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred GetAccountView: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred GetAccountView: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-class UpdateAccountView(APIView):
-    def put(self, request, realm_id, account_id):
-        logger.info("put request received at UpdateAccountView")
-        data = request.data
-        if not data:
-            return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred UpdateAccountView: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-        payload =  {
-                "Name": request.data.get('Name'),
-                "SubAccount": request.data.get('SubAccount'),
-                "FullyQualifiedName": request.data.get('FullyQualifiedName'),
-                "Active": request.data.get('Active'),
-                "Classification": request.data.get('Classification'),
-                "AccountType": request.data.get('AccountType'),
-                "AccountSubType": request.data.get('AccountSubType'),
-                "CurrentBalance": request.data.get('CurrentBalance'),
-                "CurrentBalanceWithSubAccounts": request.data.get('CurrentBalanceWithSubAccounts'),
-                "CurrencyRef": {
-                    "value": request.data.get('PrimaryEmailAddr', {}).get('value'),
-                    "name": request.data.get('PrimaryEmailAddr', {}).get('name'),
-                },
-                "domain": request.data.get('domain'),
-                "sparse": request.data.get('sparse'),
-                "Id": account_id,
-                "SyncToken": request.data.get('SyncToken'),
-                "MetaData": {
-                    "CreateTime": request.data.get('PrimaryEmailAddr', {}).get('CreateTime'),
-                    "LastUpdatedTime": request.data.get('PrimaryEmailAddr', {}).get('LastUpdatedTime'),
-                }
-        }
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/account'
-        headers = {
-            'Authorization': f"Bearer {token.access_token}",
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        try:
-            if response.status_code == 200:
-                logger.debug(f"Operation result UpdateAccountView:")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred UpdateAccountView: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred UpdateAccountView: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-class CreateCustomerView(APIView):
-    def post(self, request, realm_id):
-        logger.info("POST request received at Create Customer")
-        data = request.data
-        if not data:
-            return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred Create Customer: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-
-        data = {
-            "FullyQualifiedName": request.data.get('FullyQualifiedName'),
-            "PrimaryEmailAddr": {
-                "Address": request.data.get('PrimaryEmailAddr', {}).get('Address')
-            },
-            "DisplayName": request.data.get('DisplayName'),
-            "Suffix": request.data.get('Suffix'),
-            "Title": request.data.get('Title'),
-            "MiddleName": request.data.get('MiddleName'),
-            "Notes": request.data.get('Notes'),
-            "FamilyName": request.data.get('FamilyName'),
-            "PrimaryPhone": {
-                "FreeFormNumber":request.data.get('PrimaryPhone', {}).get('FreeFormNumber')
-            },
-            "CompanyName": request.data.get('CompanyName'),
-            "BillAddr": {
-                "CountrySubDivisionCode": request.data.get('BillAddr', {}).get('CountrySubDivisionCode'),
-                "City": request.data.get('BillAddr', {}).get('City'),
-                "PostalCode": request.data.get('BillAddr', {}).get('PostalCode'),
-                "Line1": request.data.get('BillAddr', {}).get('Line1'),
-                "Country": request.data.get('BillAddr', {}).get('Country')
-            },
-            "GivenName":request.data.get('GivenName')
-        }
-
-        payload = json.dumps(data)
-
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {token.access_token}'
-        }
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/customer'
-        response = requests.post(url, headers=headers, data=payload)
-
-        try:
-            if response.status_code == 200:
-                logger.debug(f"Operation result Create Customer:")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred Create Customer:: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred Create Customer: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-
-def insert_customer_list(customer_data):
-    try:
-        for customer in customer_data:
-            # Handle BillAddr
-            bill_addr_data = customer.get("BillAddr", {})
-            bill_addr_id = bill_addr_data.get("Id")
-            
-            
-            if  bill_addr_id:
-                bill_address, _ = Address.objects.update_or_create(
-                    id_ref=bill_addr_id,
-                    defaults={
-                        "line1": bill_addr_data.get("Line1"),
-                        "city": bill_addr_data.get("City"),
-                        "country_sub_division_code": bill_addr_data.get("CountrySubDivisionCode"),
-                        "postal_code": bill_addr_data.get("PostalCode"),
-                        "lat": bill_addr_data.get("Lat"),
-                        "long": bill_addr_data.get("Long"),
-                    }
-                )
-            else:
-                logger.warning(f"BillAddr missing 'Id' for customer {customer.get('Id')}. Skipping...")
-                bill_addr_id = None
-
-            # Handle ShipAddr
-            ship_addr_data = customer.get("ShipAddr", {})
-            ship_addr_id = ship_addr_data.get("Id")
-
-            if ship_addr_id:
-                ship_address, _ = Address.objects.update_or_create(
-                id_ref=ship_addr_id,
-                defaults={
-                    "line1": ship_addr_data.get("Line1"),
-                    "city": ship_addr_data.get("City"),
-                    "country_sub_division_code": ship_addr_data.get("CountrySubDivisionCode"),
-                    "postal_code": ship_addr_data.get("PostalCode"),
-                    "lat": ship_addr_data.get("Lat"),
-                    "long": ship_addr_data.get("Long"),
-                }
-               )
-                # continue
-
-            else:
-                logger.warning(f"ShipAddr missing 'Id' for customer {customer.get('Id')}. Skipping...")
-                ship_address = None
-            # Handle CurrencyRef
-            currency_data = customer.get("CurrencyRef", {})
-            currency_ref = CurrencyRef.objects.create(
-                value=currency_data.get("value"),
-                name=currency_data.get("name"),
-            )
-
-            # Handle MetaData
-            metadata_data = customer.get("MetaData", {})
-            metadata = MetaData.objects.create(
-                create_time=metadata_data.get("CreateTime"),
-                last_updated_time=metadata_data.get("LastUpdatedTime"),
-            )
-
-            # Create or update CustomerInfo
-            CustomerInfo.objects.update_or_create(
-                id_ref=customer.get("Id"),
-                defaults={
-                    "taxable": customer.get("Taxable"),
-                    "bill_addr": bill_address,
-                    "ship_addr": ship_address,
-                    "job": customer.get("Job"),
-                    "bill_with_parent": customer.get("BillWithParent"),
-                    "balance": customer.get("Balance"),
-                    "balance_with_jobs": customer.get("BalanceWithJobs"),
-                    "currency_ref": currency_ref,
-                    "preferred_delivery_method": customer.get("PreferredDeliveryMethod"),
-                    "domain": customer.get("domain"),
-                    "sparse": customer.get("sparse"),
-                    "sync_token": customer.get("SyncToken"),
-                    "metadata": metadata,
-                    "given_name": customer.get("GivenName"),
-                    "family_name": customer.get("FamilyName", 'predicta'),
-                    "fully_qualified_name": customer.get("FullyQualifiedName"),
-                    "company_name": customer.get("CompanyName", "predicta"),
-                    "display_name": customer.get("DisplayName"),
-                    "print_on_check_name": customer.get("PrintOnCheckName"),
-                    "active": customer.get("Active"),
-                    "primary_phone": customer.get("PrimaryPhone", {}).get("FreeFormNumber"),
-                    "primary_email_addr": customer.get("PrimaryEmailAddr", {}).get("Address"),
-                    "default_tax_code_ref": customer.get("DefaultTaxCodeRef"),
-                },
-            )
-
-        return Response({"message": "Customers successfully inserted or updated."}, status=status.HTTP_201_CREATED)
-    except Exception as e:
-        logger.error(f"Error saving customers: {e}")
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-
-class ListCustomerView(APIView):
-    def get(self, request, realm_id):
-        logger.info("GET request received at list customer view")
-        query = request.query_params.get('query')
-        if not query:
-            return Response({"error": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred list customer view: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/query?query={query}'
-        headers = {
-            'Authorization': f'Bearer {token.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                customer_data = response.json().get("QueryResponse", {}).get("Customer", [])
-                insert_customer_list(customer_data)
-                logger.debug(f"Operation result list customer: { response.json()}")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred list customer: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred list customer: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-
-class GetCustomerView(APIView):
-    def get(self, request, realm_id, customer_id):
-        logger.info("GET request received at GetCustomerView")
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred GetCustomerView: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/customer/{customer_id}'
-        headers = {
-            'Authorization': f'Bearer {token.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                customer_data = response.json().get('Customer', {})
-
-                currency_ref = CurrencyRef.objects.create(
-                        value=customer_data['CurrencyRef']['value'],
-                        name=customer_data['CurrencyRef']['name']
-                    )
-
-                metadata = MetaData.objects.create(
-                        create_time=customer_data['MetaData']['CreateTime'],
-                        last_updated_time=customer_data['MetaData']['LastUpdatedTime']
-                    )
-                # Save BillAddr
-                bill_addr, _ = Address.objects.update_or_create(
-                    id_ref=customer_data['BillAddr']['Id'],
-                    defaults={
-                        'line1': customer_data['BillAddr']['Line1'],
-                        'city': customer_data['BillAddr']['City'],
-                        'country_sub_division_code': customer_data['BillAddr']['CountrySubDivisionCode'],
-                        'postal_code': customer_data['BillAddr']['PostalCode'],
-                        'lat': customer_data['BillAddr'].get('Lat', None),
-                        'long': customer_data['BillAddr'].get('Long', None),
-                    }
-                )
-
-                # Save ShipAddr
-                ship_addr, _ = Address.objects.update_or_create(
-                    id_ref=customer_data['ShipAddr']['Id'],
-                    defaults={
-                        'line1': customer_data['ShipAddr']['Line1'],
-                        'city': customer_data['ShipAddr']['City'],
-                        'country_sub_division_code': customer_data['ShipAddr']['CountrySubDivisionCode'],
-                        'postal_code': customer_data['ShipAddr']['PostalCode'],
-                        'lat': customer_data['ShipAddr'].get('Lat', None),
-                        'long': customer_data['ShipAddr'].get('Long', None),
-                    }
-                )
-                # Save CustomerInfo
-                CustomerInfo.objects.update_or_create(
-                    id_ref=customer_data['Id'],
-                    defaults={
-                        'taxable': customer_data['Taxable'],
-                        'bill_addr': bill_addr,
-                        'ship_addr': ship_addr,
-                        'job': customer_data['Job'],
-                        'bill_with_parent': customer_data['BillWithParent'],
-                        'balance': customer_data['Balance'],
-                        'balance_with_jobs': customer_data['BalanceWithJobs'],
-                        'currency_ref': currency_ref,
-                        'preferred_delivery_method': customer_data['PreferredDeliveryMethod'],
-                        'domain': customer_data['domain'],
-                        'sparse': customer_data['sparse'],
-                        'sync_token': customer_data['SyncToken'],
-                        'metadata': metadata,
-                        'given_name': customer_data['GivenName'],
-                        'family_name': customer_data['FamilyName'],
-                        'fully_qualified_name': customer_data['FullyQualifiedName'],
-                        'company_name': customer_data.get('CompanyName', 'predicta'),
-                        'display_name': customer_data['DisplayName'],
-                        'print_on_check_name': customer_data['PrintOnCheckName'],
-                        'active': customer_data['Active'],
-                        'primary_phone': customer_data['PrimaryPhone'].get('FreeFormNumber', None) if 'PrimaryPhone' in customer_data else None,
-                        'primary_email_addr': customer_data['PrimaryEmailAddr'].get('Address', None) if 'PrimaryEmailAddr' in customer_data else None,
-                        'default_tax_code_ref': customer_data['DefaultTaxCodeRef'].get('value', None) if 'DefaultTaxCodeRef' in customer_data else None,
-                    }
-                )
-                logger.debug(f"Operation result GetCustomerView:")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred GetCustomerView: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred GetCustomerView: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-class UpdateCustomerView(APIView):
-    def put(self, request, realm_id):
-        logger.info("PUT request received at update customer")
-        data = request.data
-        if not data:
-            return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred update customer: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        payload = {
-            "Taxable": request.data.get('Taxable'),
-            "BillAddr": {
-                "Id": request.data.get('BillAddr', {}).get('Id'),
-                "Line1": request.data.get('BillAddr', {}).get('Line1'),
-                "City": request.data.get('BillAddr', {}).get('City'),
-                "CountrySubDivisionCode": request.data.get('BillAddr', {}).get('CountrySubDivisionCode'),
-                "PostalCode": request.data.get('BillAddr', {}).get('PostalCode'),
-                "Lat": request.data.get('BillAddr', {}).get('Lat'),
-                "Long": request.data.get('BillAddr', {}).get('Long')
-            },
-            "Job": request.data.get('Job'),
-            "BillWithParent": request.data.get('BillWithParent'),
-            "Balance": request.data.get('Balance'),
-            "BalanceWithJobs": request.data.get('BalanceWithJobs'),
-            "CurrencyRef": {
-                "value": request.data.get('CurrencyRef', {}).get('value'),
-                "name": request.data.get('CurrencyRef', {}).get('name')
-            },
-            "PreferredDeliveryMethod": request.data.get('PreferredDeliveryMethod'),
-            "domain": request.data.get('domain'),
-            "sparse": request.data.get('sparse'),
-            "Id": request.data.get('Id'),
-            "SyncToken": request.data.get('SyncToken'),
-            "MetaData": {
-                "CreateTime": request.data.get('MetaData', {}).get('CreateTime'),
-                "LastUpdatedTime": request.data.get('MetaData', {}).get('LastUpdatedTime')
-            },
-            "GivenName": request.data.get('GivenName'),
-            "FamilyName": request.data.get('FamilyName'),
-            "FullyQualifiedName": request.data.get('FullyQualifiedName'),
-            "CompanyName": request.data.get('CompanyName'),
-            "DisplayName": request.data.get('DisplayName'),
-            "PrintOnCheckName": request.data.get('PrintOnCheckName'),
-            "Active": request.data.get('Active'),
-            "PrimaryPhone": {
-                "FreeFormNumber": request.data.get('PrimaryPhone', {}).get('FreeFormNumber')
-            },
-            "PrimaryEmailAddr": {
-                "Address": request.data.get('PrimaryEmailAddr', {}).get('Address')
-            }
-        }
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/customer'
-        headers = {
-            'Authorization': f"Bearer {token.access_token}",
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        try:
-            if response.status_code == 200:
-                logger.debug(f"Operation result update customer:")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred update customer: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred update customer: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-
-
-
-
-
-class ListEmployesView(APIView):
-    def get(self, request, realm_id):
-        logger.info("GET request received at ListEmployeesView")
-        query = request.query_params.get('query')
-        if not query:
-            return Response({"error": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred in ListEmployeesView: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/query?query={query}'
-        headers = {
-            'Authorization': f'Bearer {token.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                response_data = response.json()
-                print(response_data)
-                employees = response_data.get("QueryResponse", {}).get("Employee", [])
-                
-                if not employees:
-                    logger.info("No employees found in the response")
-                    return Response({"message": "No employees found"}, status=status.HTTP_200_OK)
-                
-                with transaction.atomic():
-                        for emp in employees:
-                            # Extract metadata
-                            meta_data = emp.get("MetaData", {})
-                            create_time = meta_data.get("CreateTime")
-                            last_updated_time = meta_data.get("LastUpdatedTime")
-
-                            # Find all matching MetaData records
-                            metadata_records = MetaData.objects.filter(
-                                create_time=create_time,
-                                last_updated_time=last_updated_time
-                            )
-
-                            if metadata_records.exists():
-                                # Update all matching MetaData records
-                                for record in metadata_records:
-                                    record.create_time = create_time
-                                    record.last_updated_time = last_updated_time
-                                    record.save()
-                                metadata_instance = metadata_records.first()  # Pick the first record as reference
-                            else:
-                                # Create a new MetaData record
-                                metadata_instance = MetaData.objects.create(
-                                    create_time=create_time,
-                                    last_updated_time=last_updated_time
-                                )
-
-                            # Update or create employee
-                            Employee.objects.update_or_create(
-                                id_ref=emp["Id"],
-                                defaults={
-                                    "billable_time": emp.get("BillableTime", False),
-                                    "domain": emp.get("domain", ""),
-                                    "sparse": emp.get("sparse", False),
-                                    "sync_token": emp.get("SyncToken", ""),
-                                    "metadata": metadata_instance,
-                                    "given_name": emp.get("GivenName", ""),
-                                    "family_name": emp.get("FamilyName", ""),
-                                    "display_name": emp.get("DisplayName", ""),
-                                    "print_on_check_name": emp.get("PrintOnCheckName", ""),
-                                    "active": emp.get("Active", True),
-                                }
-                            )
-                logger.info("Employee data saved successfully")
-                return Response({"message": "Employees saved successfully"}, status=status.HTTP_200_OK)
-            else:
-                print("helllo")
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred in ListEmployeesView: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred in ListEmployeesView: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
-
-
-
-
-
-class GetCompanyifoView(APIView):
-    def get(self, request, realm_id, company_info_id):
-        logger.info("get request received at get-company-info")
-        
-        try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
-        except QuickBooksToken.DoesNotExist:
-            logger.error(f"An error occurred get-company-info: realm_id does not exist")
-            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
-
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/companyinfo/{company_info_id}'
-        headers = {
-            'Authorization': f'Bearer {token.access_token}',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
-
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                logger.debug(f"Operation result get-company-info:")
-                company_info = response.json().get('CompanyInfo', {})
-                company_addr = self.create_or_update_address(company_info['CompanyAddr'])
-                customer_communication_addr = self.create_or_update_address(company_info['CustomerCommunicationAddr'])
-                legal_addr = self.create_or_update_address(company_info['LegalAddr'])
-                # Parse and create NameValue instances
-                name_values_ids = self.create_name_values(company_info['NameValue'])
-                # Parse and create MetaData instance
-                metadata = self.create_metadata(company_info['MetaData'])
-                company_info_instance, created = CompanyInfo.objects.update_or_create(
-                    id_ref=company_info['Id'],  # Use id_ref as the unique field for lookup
-                    defaults={
-                        'company_name': company_info['CompanyName'],
-                        'legal_name': company_info['LegalName'],
-                        'company_addr': company_addr,
-                        'customer_communication_addr': customer_communication_addr,
-                        'legal_addr': legal_addr,
-                        'customer_communication_email_addr': company_info.get('CustomerCommunicationEmailAddr', {}).get('Address'),
-                        'primary_phone': company_info.get('PrimaryPhone', {}).get('FreeFormNumber'),
-                        'company_start_date': company_info['CompanyStartDate'],
-                        'fiscal_year_start_month': company_info['FiscalYearStartMonth'],
-                        'country': company_info['Country'],
-                        'email': company_info.get('Email', {}).get('Address'),
-                        'web_addr': company_info.get('WebAddr', {}),
-                        'supported_languages': company_info['SupportedLanguages'],
-                        'domain': company_info['domain'],
-                        'sparse': company_info['sparse'],
-                        'sync_token': company_info['SyncToken'],
-                        'metadata': metadata
-                    }
-                )
-                # Unpack the returned tuple to get the instance directly
-                company_info_instance = company_info_instance
-                # Fetch NameValue instances based on the IDs
-                name_values_instances = NameValue.objects.filter(id__in=name_values_ids)
-                # Now assign the NameValues to the company_info_instance using the many-to-many set() method
-                company_info_instance.name_values.set(name_values_instances)
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred get-company-info: {message}")
-                return Response({'error': message}, status=response.status_code)
-
-        except Exception as e:
-            logger.error(f"An error occurred get-company-info: {e}")
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    def create_or_update_address(self, address_data):
-        """
-        Helper function to create or update an Address instance.
-        If the address already exists (based on postal_code, lat, and long), it updates the existing one.
-        Otherwise, it creates a new Address instance.
-        """
-        address, created = Address.objects.update_or_create(
-            id_ref=address_data['Id'],
-            postal_code=address_data['PostalCode'],
-            lat=address_data['Lat'],
-            long=address_data['Long'],
-            defaults={
-                'line1': address_data['Line1'],
-                'city': address_data['City'],
-                'country_sub_division_code': address_data['CountrySubDivisionCode'],
-            }
+        self.assertEqual(resolved['Account']['3'], {'name': 'Account 3', 'type': 'Income', 'balance': Decimal('30.75')})
+
+
+class ResolveTests(StubTestCase):
+    def setUp(self):
+        super().setUp()
+        store().clear()
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 11)])
+        tombstones.tombstone(REALM, 'Customer', ['4'])
+
+    def resolve(self, body, view=None):
+        url = f'/resolve/{REALM}/' + (f'?view={view}' if view else '')
+        return self.client.post(url, body, format='json')
+
+    def test_mirror_hits_misses_and_tombstones(self):
+        response = self.resolve({'Customer': ['1', '4', '25', '999']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Data-Source'], 'quickbooks')
+        customers = response.json()['success']['Customer']
+        self.assertEqual(customers['1']['DisplayName'], 'Customer 1')
+        self.assertEqual(customers['1']['BillAddr']['City'], 'City 1')
+        self.assertEqual(customers['25']['DisplayName'], 'Customer 25')
+        self.assertIsNone(customers['4'])
+        self.assertIsNone(customers['999'])
+        # The fetched customer is mirrored now, so a second call stays local
+        self.stub.request_count = 0
+        self.assertEqual(self.resolve({'Customer': ['1', '25']})['X-Data-Source'], 'mirror')
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_names_view(self):
+        response = self.resolve({'Customer': ['2', '4', '25']}, view='names')
+        self.assertEqual(response.status_code, 200)
+        customers = response.json()['success']['Customer']
+        self.assertEqual((customers['2']['name'], customers['2']['company']), ('Customer 2', 'Company 2'))
+        self.assertEqual(customers['25']['name'], 'Customer 25')
+        self.assertIsNone(customers['4'])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.resolve({'Customer': ['1']}, view='everything').status_code, 400)
+        self.assertEqual(self.resolve({'Employee': ['1']}, view='names').status_code, 400)
+        self.assertEqual(self.resolve({'Customer': '1'}).status_code, 400)
+
+
+class CustomerSearchTests(TestCase):
+    def setUp(self):
+        upsert_customers(REALM, [make_customer(i) for i in range(1, 31)])
+
+    def found(self, query):
+        return set(search_customers(REALM, query).values_list('id_ref', flat=True))
+
+    def test_prefix_range_upper_bound_is_the_next_prefix(self):
+        self.assertEqual(prefix_range('ab'), {'token__gte': 'ab', 'token__lt': 'ac'})
+        self.assertEqual(prefix_range('a9'), {'token__gte': 'a9', 'token__lt': 'aa'})
+        self.assertEqual(prefix_range('az'), {'token__gte': 'az', 'token__lt': 'b'})
+        self.assertEqual(prefix_range('zz'), {'token__gte': 'zz'})
+
+    def test_every_term_must_match_a_prefix(self):
+        self.assertEqual(self.found('Given1'), {'1'} | {str(i) for i in range(10, 20)})
+        self.assertEqual(self.found('given1 family12'), {'12'})
+        self.assertEqual(self.found('Gïven2 Company'), {'2', '20', '21', '22', '23', '24', '25', '26', '27', '28', '29'})
+        self.assertEqual(self.found('nobody'), set())
+
+    def test_email_and_phone_lookups(self):
+        self.assertEqual(self.found('customer7@example.com'), {'7'})
+        self.assertEqual(self.found('(555) 000-0013'), {'13'})
+
+
+class ProjectionAndCompressionTests(StubTestCase):
+    def test_parse_fields(self):
+        self.assertEqual(parse_fields('Name, MetaData.LastUpdatedTime'), {'Id': {}, 'Name': {}, 'MetaData': {'LastUpdatedTime': {}}})
+        self.assertIsNone(parse_fields(''))
+        with self.assertRaises(ValueError):
+            parse_fields('Name,1Bad')
+
+    def test_project_keeps_only_the_requested_paths(self):
+        entity = {'Id': '1', 'Name': 'A', 'Balance': 3, 'MetaData': {'CreateTime': 'x', 'LastUpdatedTime': 'y'}}
+        self.assertEqual(project(entity, parse_fields('Name,MetaData.LastUpdatedTime')),
+                         {'Id': '1', 'Name': 'A', 'MetaData': {'LastUpdatedTime': 'y'}})
+
+    def test_accepts_brotli(self):
+        for header, expected in (('br', True), ('gzip, br;q=0.5', True), ('BR', True), ('br;q=0', False),
+                                 ('br;q=0.0, gzip', False), ('gzip', False), ('brotli', False), ('', False)):
+            with self.subTest(header=header):
+                self.assertEqual(compression.accepts_brotli(header), expected)
+
+    def test_projected_list_is_compressed(self):
+        response = self.client.get(f'/list-customer/{REALM}/', {'query': 'select * from Customer', 'fields': 'DisplayName'},
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        customers = json.loads(gzip.decompress(response.content))['success']['QueryResponse']['Customer']
+        self.assertEqual(len(customers), 30)
+        self.assertEqual(customers[0], {'Id': '1', 'DisplayName': 'Customer 1'})
+
+
+class SyncRunTests(StubTestCase):
+    def sync_accounts(self):
+        self.assertEqual(self.client.get(f'/list-accounts/{REALM}/', {'query': 'select * from Account'}).status_code, 200)
+        run = SyncRun.objects.filter(realm_id=REALM, entity='Account').latest('started_at')
+        return run.rows_inserted, run.rows_updated, run.rows_skipped
+
+    def test_unchanged_rows_are_skipped(self):
+        self.assertEqual(self.sync_accounts(), (30, 0, 0))
+        self.assertEqual(self.sync_accounts(), (0, 0, 30))
+        self.stub.updated[('account', 4)] = dict(make_account(4), SyncToken='1', Name='Renamed')
+        self.assertEqual(self.sync_accounts(), (0, 1, 29))
+
+    def test_balance_change_at_the_same_sync_token_is_written(self):
+        self.sync_accounts()
+        self.stub.updated[('account', 4)] = dict(make_account(4), CurrentBalance=123.45)
+        self.assertEqual(self.sync_accounts(), (0, 1, 29))
+        self.assertEqual(Account.objects.get(realm_id=REALM, id_ref='4').current_balance, Decimal('123.45'))
+
+    def test_tombstone_is_revived_at_the_same_sync_token(self):
+        self.sync_accounts()
+        tombstones.tombstone(REALM, 'Account', ['4'])
+        self.assertEqual(self.sync_accounts(), (0, 1, 29))
+        self.assertIsNone(Account.objects.get(realm_id=REALM, id_ref='4').deleted_at)
+
+    def test_runs_are_listed_with_failures(self):
+        self.sync_accounts()
+        self.open_circuit()
+        self.client.get(f'/list-accounts/{REALM}/', {'query': "select * from Account where Id = '1'"})
+        runs = self.client.get(f'/sync-runs/{REALM}/', {'entity': 'Account'}).json()['success']
+        self.assertEqual([run['status'] for run in runs], ['failed', 'success'])
+        self.assertEqual(runs[1]['pages_fetched'], 1)
+
+
+class TokenRefreshTests(StubTestCase):
+    def add_token(self, realm_id, access_in=None, refresh_in=None, refresh_token='refresh'):
+        now = timezone.now()
+        return QuickBooksToken.objects.create(
+            realm_id=realm_id, access_token='old', refresh_token=refresh_token, expires_in=3600, scope='',
+            access_token_expires_at=now + access_in if access_in is not None else None,
+            refresh_token_expires_at=now + refresh_in if refresh_in is not None else None,
         )
-        
-        if created:
-            logger.info(f"Created new address: {address}")
-        else:
-            logger.info(f"Updated existing address: {address}")
-        
-        return address
-
-
-    def create_name_values(self, name_value_data):
-        """
-        Helper function to create NameValue instances.
-        This method ensures no duplicates and uses update_or_create.
-        """
-        name_value_objects = []
-        for item in name_value_data:
-            # Use update_or_create to prevent duplicates
-            name_value = NameValue.objects.create(
-                name=item['Name'],
-                value=item['Value']
-            )
-            name_value_objects.append(name_value.id)
-        return name_value_objects
-
-
-    def create_metadata(self, metadata_data):
-        """
-        Helper function to create a MetaData instance.
-        """
-        return MetaData.objects.create(
-            create_time=metadata_data['CreateTime'],
-            last_updated_time=metadata_data['LastUpdatedTime']
-        )
-
 
+    def test_due_tokens_are_refreshed_in_batches(self):
+        self.add_token('expiring', access_in=timedelta(minutes=5), refresh_in=timedelta(days=90))
+        self.add_token('refresh-expiring', access_in=timedelta(hours=1), refresh_in=timedelta(days=3))
+        self.add_token('fresh', access_in=timedelta(hours=1), refresh_in=timedelta(days=90))
+        self.add_token('revoked', refresh_token='')
+        self.open_circuit('expiring')
+        self.assertEqual(shared_cache.get_token(REALM).access_token, 'access')
+
+        with override_settings(TOKEN_URL=self.stub.token_url):
+            summary = refresh_due_tokens(timedelta(minutes=15), timedelta(days=30), batch_size=1, workers=2)
+
+        self.assertEqual((summary['due'], summary['refreshed']), (3, 2))
+        self.assertEqual(list(summary['failed']), ['expiring'])
+        tokens = dict(QuickBooksToken.objects.values_list('realm_id', 'access_token'))
+        self.assertEqual(tokens, {REALM: 'stub-access-token', 'refresh-expiring': 'stub-access-token',
+                                  'expiring': 'old', 'fresh': 'old', 'revoked': 'old'})
+        refreshed = QuickBooksToken.objects.get(realm_id=REALM)
+        self.assertGreater(refreshed.refresh_token_expires_at, timezone.now() + timedelta(days=90))
+        # The cached token is dropped along with the bulk write
+        self.assertEqual(shared_cache.get_token(REALM).access_token, 'stub-access-token')
+
+
+class WriteThroughTests(StubTestCase):
+    def test_update_is_mirrored_and_served_from_cache(self):
+        upsert_customers(REALM, [make_customer(5)])
+        response = self.client.put(f'/update-sparse-customer/{REALM}/', {'Id': '5', 'MiddleName': 'Q'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CustomerInfo.objects.get(realm_id=REALM, id_ref='5').sync_token, '1')
+
+        self.stub.request_count = 0
+        response = self.client.get(f'/get-customer/{REALM}/5/')
+        self.assertEqual(response.json()['success']['Customer']['MiddleName'], 'Q')
+        self.assertEqual(self.stub.request_count, 0)
+
+    def test_failed_mirror_write_keeps_the_upstream_result_and_drops_the_cache(self):
+        upsert_customers(REALM, [make_customer(5)])
+        self.client.get(f'/get-customer/{REALM}/5/')
+        with mock.patch.dict(MIRROR_WRITERS, {'Customer': mock.Mock(side_effect=RuntimeError('disk full'))}):
+            response = self.client.put(f'/update-sparse-customer/{REALM}/', {'Id': '5', 'MiddleName': 'Q'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CustomerInfo.objects.get(realm_id=REALM, id_ref='5').sync_token, '0')
+        self.assertIsNone(shared_cache.get_entity(shared_cache.entity_key(REALM, 'Customer', '5')))
+
+
+class CoalescedGetTests(StubTestCase):
+    stub_config = StubConfig(customers=30, latency_ms=200)
+
+    def read_concurrently(self, urls):
+        results = [None] * len(urls)
+
+        def read(i):
+            results[i] = upstream.coalesced_get(REALM, urls[i], headers={'Accept': 'application/json'})
+
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(len(urls))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_concurrent_reads_share_one_upstream_call(self):
+        urls = [f'{self.stub.base_url}/{REALM}/customer/{1 + i % 2}' for i in range(10)]
+        results = self.read_concurrently(urls)
+        self.assertEqual(self.stub.request_count, 2)
+        self.assertEqual({r.json()['Customer']['Id'] for r in results}, {'1', '2'})
+        self.assertIs(results[0].json(), results[2].json())
+
+    def test_reads_after_completion_go_upstream_again(self):
+        url = f'{self.stub.base_url}/{REALM}/customer/1'
+        self.read_concurrently([url])
+        self.read_concurrently([url])
+        self.assertEqual(self.stub.request_count, 2)
@@ -0,0 +1,110 @@
+# quickbooks/token_refresh.py
+"""
+Refresh QuickBooks tokens ahead of expiry, for every realm at once.
+
+Tokens whose access token expires within the look-ahead window, or whose refresh
+token is nearing its 100-day limit, are refreshed in batches. Each batch is sent
+concurrently through the pooled upstream client, bounded by a worker count, and the
+results are written back in a single bulk upsert.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .bulk import bulk_upsert
+from .models import QuickBooksToken
+from . import shared_cache, upstream
+import logging
+logger = logging.getLogger('quickbooks')
+
+DEFAULT_SCOPE = 'com.intuit.quickbooks.accounting'
+TOKEN_UPDATE_FIELDS = ('access_token', 'refresh_token', 'expires_in', 'scope',
+                       'access_token_expires_at', 'refresh_token_expires_at', 'refreshed_at')
+
+
+def token_fields(token_data, now=None):
+    """Model field values for a token endpoint response, including the absolute expiry times."""
+    now = now or timezone.now()
+    fields = {
+        'access_token': token_data.get('access_token'),
+        'refresh_token': token_data.get('refresh_token'),
+        'expires_in': token_data.get('expires_in'),
+        'scope': token_data.get('scope', DEFAULT_SCOPE),
+        'refreshed_at': now,
+        'access_token_expires_at': None,
+        'refresh_token_expires_at': None,
+    }
+    if token_data.get('expires_in') is not None:
+        fields['access_token_expires_at'] = now + timedelta(seconds=int(token_data['expires_in']))
+    if token_data.get('x_refresh_token_expires_in') is not None:
+        fields['refresh_token_expires_at'] = now + timedelta(seconds=int(token_data['x_refresh_token_expires_in']))
+    return fields
+
+
+def due_tokens(access_within, refresh_within, now=None):
+    """Tokens to refresh, soonest expiry first; rows stored before expiry times were tracked count as due."""
+    now = now or timezone.now()
+    return (
+        QuickBooksToken.objects
+        .exclude(refresh_token='')
+        .filter(
+            Q(access_token_expires_at__isnull=True)
+            | Q(access_token_expires_at__lte=now + access_within)
+            | Q(refresh_token_expires_at__lte=now + refresh_within)
+        )
+        .order_by('access_token_expires_at')
+    )
+
+
+def request_refresh(token):
+    """Exchange the token's refresh token; returns the token endpoint's JSON, raises on failure."""
+    response = upstream.post(settings.TOKEN_URL, realm_id=token.realm_id, data={
+        "grant_type": "refresh_token",
+        "refresh_token": token.refresh_token,
+        "client_id": settings.CLIENT_ID,
+        "client_secret": settings.CLIENT_SECRET,
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def refresh_batch(tokens, workers):
+    """Refresh tokens concurrently and store the successes in bulk; returns (refreshed, {realm_id: error})."""
+    refreshed, failed = [], {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='token-refresh') as executor:
+        results = executor.map(_attempt, tokens)
+        for token, (token_data, error) in zip(tokens, results):
+            if error is not None:
+                failed[token.realm_id] = error
+                continue
+            for field, value in token_fields(token_data).items():
+                setattr(token, field, value)
+            # QuickBooks may keep the refresh token as is; never overwrite it with nothing
+            token.refresh_token = token_data.get('refresh_token') or token.refresh_token
+            refreshed.append(token)
+
+    bulk_upsert(QuickBooksToken, refreshed, TOKEN_UPDATE_FIELDS, unique_fields=('realm_id',))
+    shared_cache.invalidate_tokens([token.realm_id for token in refreshed])
+    return refreshed, failed
+
+
+def _attempt(token):
+    try:
+        return request_refresh(token), None
+    except Exception as e:
+        logger.error(f"Token refresh failed for realm {token.realm_id}: {e}")
+        return None, str(e)
+
+
+def refresh_due_tokens(access_within, refresh_within, batch_size=50, workers=8):
+    """Refresh every due token in batches of batch_size; returns {'due', 'refreshed', 'failed'}."""
+    due = list(due_tokens(access_within, refresh_within))
+    summary = {'due': len(due), 'refreshed': 0, 'failed': {}}
+    for start in range(0, len(due), batch_size):
+        batch = due[start:start + batch_size]
+        refreshed, failed = refresh_batch(batch, workers=min(workers, len(batch)))
+        summary['refreshed'] += len(refreshed)
+        summary['failed'].update(failed)
+        logger.info(f"Token refresh batch: {len(refreshed)} refreshed, {len(failed)} failed")
+    return summary
@@ -0,0 +1,136 @@
+# quickbooks/tombstones.py
+"""
+Deleted entities become tombstones: the mirror row is kept, made inactive and
+stamped with deleted_at, so the rollups drop it and lookups stop returning it.
+
+Deletions arrive two ways. Change data capture (CDC) responses list deleted
+entities with status "Deleted", and parse_cdc separates them from the live records.
+reconcile_ids is the optional periodic check: it pages through the realm's IDs in
+QuickBooks, ordered by Id, and tombstones the mirror rows whose IDs are gone,
+without rewriting any other row. When the pages do not add up to QuickBooks' count,
+nothing is tombstoned.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import Account, CustomerInfo, CustomerSearchToken, Employee
+from .rollups import account_snapshots, customer_snapshots, apply_account_deltas, apply_customer_deltas
+from .sync_runs import sync_run
+from . import shared_cache, upstream
+import logging
+logger = logging.getLogger('quickbooks')
+
+TOMBSTONE_MODELS = {'Account': Account, 'Customer': CustomerInfo, 'Employee': Employee}
+# Entity -> (snapshot, apply deltas) for the entities with balance rollups
+ROLLUPS = {
+    'Account': (account_snapshots, apply_account_deltas),
+    'Customer': (customer_snapshots, apply_customer_deltas),
+}
+TOMBSTONE_BATCH_SIZE = 1000
+ID_PAGE_SIZE = 1000
+
+
+def tombstone(realm_id, entity, id_refs, deleted_at=None):
+    """Mark the entities deleted, keeping the rollups in step; returns how many rows were live."""
+    model = TOMBSTONE_MODELS[entity]
+    deleted_at = deleted_at or timezone.now()
+    id_refs = list(id_refs)
+    count = 0
+    for start in range(0, len(id_refs), TOMBSTONE_BATCH_SIZE):
+        batch = id_refs[start:start + TOMBSTONE_BATCH_SIZE]
+        with transaction.atomic():
+            snapshots, apply_deltas = ROLLUPS.get(entity, (None, None))
+            before = snapshots(realm_id, batch, for_update=True) if snapshots else None
+            count += model.objects.filter(realm_id=realm_id, id_ref__in=batch, deleted_at__isnull=True).update(active=False, deleted_at=deleted_at)
+            if snapshots:
+                apply_deltas(realm_id, before, snapshots(realm_id, batch))
+            if entity == 'Customer':
+                # Out of the typeahead too; upsert_customers re-indexes a customer that comes back
+                CustomerSearchToken.objects.filter(realm_id=realm_id, customer__id_ref__in=batch).delete()
+    if count:
+        shared_cache.invalidate_entities(realm_id, entity)
+    return count
+
+
+def parse_cdc(data, entities=tuple(TOMBSTONE_MODELS)):
+    """{entity: (live records, deleted IDs)} from a CDC response."""
+    changes = {entity: ([], []) for entity in entities}
+    for response in data.get('CDCResponse', []):
+        for query_response in response.get('QueryResponse', []):
+            for entity, (live, deleted) in changes.items():
+                for record in query_response.get(entity, []):
+                    if record.get('status') == 'Deleted':
+                        deleted.append(record['Id'])
+                    else:
+                        live.append(record)
+    return changes
+
+
+def upstream_count(realm_id, entity, headers, run=None):
+    """How many entities of the type QuickBooks has, inactive ones included."""
+    query = f"select count(*) from {entity} where Active in (true, false)"
+    response = upstream.get(f'{settings.QUICKBOOKURL}/{realm_id}/query', realm_id=realm_id, headers=headers, params={'query': query})
+    response.raise_for_status()
+    if run is not None:
+        run.page(response)
+    return response.json()['QueryResponse']['totalCount']
+
+
+def upstream_sync_tokens(realm_id, entity, headers, run=None):
+    """
+    {Id: SyncToken} for every entity of the type in QuickBooks, inactive ones included.
+    Raises on any failed page, and when the pages do not add up to QuickBooks' count.
+    """
+    expected = upstream_count(realm_id, entity, headers, run)
+    sync_tokens = {}
+    start = 1
+    while True:
+        # Without a stable order, rows can shift between pages and be skipped
+        query = f"select Id, SyncToken from {entity} where Active in (true, false) orderby Id startposition {start} maxresults {ID_PAGE_SIZE}"
+        response = upstream.get(f'{settings.QUICKBOOKURL}/{realm_id}/query', realm_id=realm_id, headers=headers, params={'query': query})
+        # A partial ID set would tombstone live rows, so any failure aborts the reconciliation
+        response.raise_for_status()
+        if run is not None:
+            run.page(response)
+        page = response.json().get('QueryResponse', {}).get(entity, [])
+        sync_tokens.update((record['Id'], str(record.get('SyncToken'))) for record in page)
+        if len(page) < ID_PAGE_SIZE:
+            break
+        start += ID_PAGE_SIZE
+    if len(sync_tokens) != expected:
+        # An entity deleted while paging shifts the later pages and hides a live one;
+        # an entity created meanwhile only delays the next run
+        raise RuntimeError(f"Paged {len(sync_tokens)} {entity} IDs but QuickBooks counts {expected}; nothing tombstoned")
+    return sync_tokens
+
+
+def auth_headers(realm_id):
+    token = shared_cache.get_token(realm_id)
+    return {
+        'Authorization': f'Bearer {token.access_token}',
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+
+def reconcile_ids(realm_id, entity):
+    """
+    Diff the realm's ID set in QuickBooks against the live mirror rows. IDs only the
+    mirror has are tombstoned; IDs only QuickBooks has are reported as missing.
+    """
+    headers = auth_headers(realm_id)
+    model = TOMBSTONE_MODELS[entity]
+    with sync_run(realm_id, f'{entity} reconcile') as run:
+        # Read the mirror first, so an entity created while the IDs are paged cannot look deleted
+        with run.stage('map'):
+            local = set(model.objects.filter(realm_id=realm_id, deleted_at__isnull=True).values_list('id_ref', flat=True))
+        with run.stage('fetch'):
+            remote = set(upstream_sync_tokens(realm_id, entity, headers, run))
+        with run.stage('map'):
+            gone = sorted(local - remote)
+            missing = sorted(remote - local)
+        with run.stage('write'):
+            run.add(rows_deleted=tombstone(realm_id, entity, gone))
+        run.add(rows_skipped=len(local & remote))
+    logger.info(f"Reconciled {entity} IDs for realm {realm_id}: {len(gone)} tombstoned, {len(missing)} missing from the mirror")
+    return {'tombstoned': len(gone), 'missing': missing}
@@ -0,0 +1,142 @@
+# quickbooks/upstream.py
+"""
+All HTTP calls to QuickBooks go through here so they can be counted, timed,
+bounded by a timeout and guarded by the circuit breakers and bulkheads.
+"""
+import threading
+import time
+from django.conf import settings
+from .instrumentation import record_upstream
+from .resilience import guarded_call
+import logging
+logger = logging.getLogger('quickbooks')
+
+
+def __getattr__(name):
+    # requests.RequestException without importing requests until it is needed
+    if name == 'RequestException':
+        import requests
+        return requests.RequestException
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_adapter = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+
+def _shared_adapter():
+    """One connection pool per process, holding as many connections as the global bulkhead lets through."""
+    global _adapter
+    if _adapter is None:
+        with _adapter_lock:
+            if _adapter is None:
+                import requests
+                _adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=settings.QUICKBOOKS_GLOBAL_CONCURRENCY)
+    return _adapter
+
+
+def session():
+    """
+    The calling thread's requests.Session. Sessions are not thread-safe, so each thread
+    has its own, but they share one connection pool, so connections to QuickBooks are
+    still kept alive and reused. Cookies are never stored: one realm's responses must
+    not put cookies on another realm's requests.
+    """
+    pooled = getattr(_local, 'session', None)
+    if pooled is None:
+        # Imported on first use so workers that never call QuickBooks don't pay for it
+        import requests
+        from http.cookiejar import DefaultCookiePolicy
+        pooled = requests.Session()
+        pooled.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        pooled.mount('https://', _shared_adapter())
+        pooled.mount('http://', _shared_adapter())
+        _local.session = pooled
+    return pooled
+
+
+def request(method, url, realm_id=None, **kwargs):
+    kwargs.setdefault('timeout', settings.QUICKBOOKS_TIMEOUT)
+
+    def send():
+        started = time.perf_counter()
+        try:
+            return session().request(method, url, **kwargs)
+        finally:
+            record_upstream(time.perf_counter() - started)
+
+    return guarded_call(realm_id, send)
+
+
+def get(url, realm_id=None, **kwargs):
+    return request('GET', url, realm_id=realm_id, **kwargs)
+
+
+def post(url, realm_id=None, **kwargs):
+    return request('POST', url, realm_id=realm_id, **kwargs)
+
+
+_UNPARSED = object()
+
+
+class SharedResponse:
+    """
+    A completed response handed to every caller of a coalesced read. The body is
+    parsed once and the same object is returned to all of them, so treat it as read-only.
+    """
+    def __init__(self, response):
+        self._response = response
+        self._json = _UNPARSED
+
+    def json(self):
+        if self._json is _UNPARSED:
+            self._json = self._response.json()
+        return self._json
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def coalesced_get(realm_id, url, **kwargs):
+    """
+    GET that shares one upstream call between concurrent identical reads of a realm.
+
+    The first caller for (realm_id, 'GET', url) makes the request; callers arriving
+    while it is in flight wait for it and get the same SharedResponse (or exception).
+    """
+    key = (realm_id, 'GET', url)
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = _InFlight()
+
+    if not leader:
+        call.done.wait()
+        logger.debug(f"Coalesced upstream GET {url}")
+        if call.error is not None:
+            raise call.error
+        return call.response
+
+    try:
+        call.response = SharedResponse(get(url, realm_id=realm_id, **kwargs))
+        return call.response
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call.done.set()
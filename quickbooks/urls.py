@@ -24,4 +24,15 @@ urlpatterns = [
     path('get-companyinfo/<str:realm_id>/<str:company_info_id>/', GetCompanyInfoView.as_view(), name='GetCompanyifoView'),
     path('update-company-info/<str:realm_id>/', UpdateCompanyifoView.as_view(), name='UpdateCompanyifoView'),
     path('update-sparse-company-info/<str:realm_id>/', UpdateSparseCompanyifoView.as_view(), name='UpdateSparseCompanyifoView'),
+
+    path('account-balances/<str:realm_id>/', AccountBalanceRollupView.as_view(), name='account_balances'),
+    path('customer-balances/<str:realm_id>/', CustomerBalanceRollupView.as_view(), name='customer_balances'),
+    path('account-tree-balances/<str:realm_id>/', AccountTreeRollupView.as_view(), name='account_tree_balances'),
+    path('account-subtree/<str:realm_id>/<str:account_id>/', AccountSubtreeView.as_view(), name='account_subtree'),
+    path('search-customer/<str:realm_id>/', SearchCustomerView.as_view(), name='search_customer'),
+    path('resolve/<str:realm_id>/', ResolveEntitiesView.as_view(), name='resolve_entities'),
+    path('sync-runs/<str:realm_id>/', SyncRunsView.as_view(), name='sync_runs'),
+    path('sync-trends/', SyncTrendsView.as_view(), name='sync_trends'),
+    path('sync-changes/<str:realm_id>/', SyncChangesView.as_view(), name='sync_changes'),
+    path('query/<str:realm_id>/', QueryView.as_view(), name='query'),
 ]
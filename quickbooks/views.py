@@ -5,14 +5,36 @@ from rest_framework.permissions import AllowAny
 from rest_framework.decorators import api_view
 from rest_framework import status
 from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from urllib.parse import urlencode
 from .models import *
+from .rollups import account_snapshots, customer_snapshots, apply_account_deltas, apply_customer_deltas
+from .account_tree import rebuild_account_tree, account_subtree
+from .search import index_customers, search_customers
+from .bulk import bulk_upsert
+from .instrumentation import track_sync
+from .conditional import not_modified_from_mirror, with_etag
+from .projection import parse_fields, project_query_response
+from .mirror import mirror_fallback, mirror_record
+from .resilience import UpstreamUnavailable
+from . import shared_cache
+from .concurrency import post_update
+from .sparse_update import minimal_update, has_changes
+from .token_refresh import token_fields
+from .lookup import RESOLVE_VIEWS, parse_resolve_request, id_queries
+from .sync_runs import sync_run, sync_trends
+from .tombstones import TOMBSTONE_MODELS, tombstone, parse_cdc
+from .query_builder import build_query, field_list
+from . import upstream
 import json
-import requests
-from requests_oauthlib import OAuth2Session
 import logging
 logger = logging.getLogger('quickbooks')
 
 def get_oauth_session():
+    # Only the login flow needs OAuth; keep requests_oauthlib/oauthlib out of worker start-up
+    from requests_oauthlib import OAuth2Session
     return OAuth2Session(client_id=settings.CLIENT_ID, redirect_uri=settings.REDIRECT_URI, scope=settings.SCOPE)
 
 
@@ -35,14 +57,14 @@ class RefreshToken:
         }
 
         try:
-            response = requests.post(token_url, data=payload)
+            response = upstream.post(token_url, data=payload)
             response.raise_for_status()
             token_data = response.json()
 
             # Update stored token information
             StoreToken.store(realm_id, token_data)
             return {"message": "Token refreshed successfully", "token_data": token_data}
-        except requests.exceptions.RequestException as e:
+        except (upstream.RequestException, UpstreamUnavailable) as e:
             return {"error": "Failed to refresh token", "details": str(e)}
 
 
@@ -51,12 +73,7 @@ class StoreToken:
     def store(realm_id, token):
         token_obj, created = QuickBooksToken.objects.update_or_create(
             realm_id=realm_id,
-            defaults={
-                'access_token': token.get('access_token'),
-                'refresh_token': token.get('refresh_token'),
-                'expires_in': token.get('expires_in'),
-                'scope': token.get('scope', 'com.intuit.quickbooks.accounting'),
-            }
+            defaults=token_fields(token)
         )
         return token_obj
 
@@ -99,7 +116,7 @@ class CallbackView(APIView):
         }
 
         try:
-            response = requests.post(token_url, data=payload)
+            response = upstream.post(token_url, data=payload)
             response.raise_for_status()
             token_data = response.json()
             
@@ -107,7 +124,7 @@ class CallbackView(APIView):
             token_data['realmId'] = realm_id
             logger.debug(f"Operation result callback: {token_data}")
             return Response({"message": "Token saved successfully", "token_data": token_data}, status=status.HTTP_200_OK)
-        except requests.exceptions.RequestException as e:
+        except upstream.RequestException as e:
             logger.error(f"An error occurred callback: {e}")
             return Response({"error": "Failed to fetch token", "details": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -117,7 +134,6 @@ class RefreshQuickBooksTokenView(APIView):
     """
     API to refresh the QuickBooks access token using the stored refresh token.
     """
-    permission_classes = [AllowAny]
 
     def get(self, request, realm_id):
         logger.info("GET request received at refreshtokenview")
@@ -161,7 +177,7 @@ class CreateAccountView(APIView):
             return Response({"error": "Name and Account Type is required in the request body."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred create account : realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -178,10 +194,11 @@ class CreateAccountView(APIView):
         }
 
         url = f'{settings.QUICKBOOKURL}/{realm_id}/account'
-        response = requests.post(url, headers=headers, data=payload)
+        response = upstream.post(url, realm_id=realm_id, headers=headers, data=payload)
 
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Account', response.json())
                 logger.debug(f"Operation result create account: {response.json()}")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -195,36 +212,50 @@ class CreateAccountView(APIView):
 
 
 
-def insert_accounts(api_response):
+def account_fields(account_data):
+    return {
+        "name": account_data["Name"],
+        "sub_account": account_data.get("SubAccount", False),
+        "fully_qualified_name": account_data["FullyQualifiedName"],
+        "active": account_data.get("Active", True),
+        "classification": account_data["Classification"],
+        "account_type": account_data["AccountType"],
+        "account_sub_type": account_data["AccountSubType"],
+        "current_balance": account_data["CurrentBalance"],
+        "current_balance_with_sub_accounts": account_data.get("CurrentBalanceWithSubAccounts", 0),
+        "currency_value": account_data.get("CurrencyRef", {}).get("value", ""),
+        "currency_name": account_data.get("CurrencyRef", {}).get("name", ""),
+        "domain": account_data["domain"],
+        "sparse": account_data.get("sparse", False),
+        "sync_token": account_data["SyncToken"],
+        "create_time": account_data.get("MetaData", {}).get("CreateTime"),
+        "last_updated_time": account_data.get("MetaData", {}).get("LastUpdatedTime"),
+        # Anything QuickBooks still returns is alive again
+        "deleted_at": None,
+    }
+
+
+def upsert_accounts(realm_id, accounts):
+    """Mirror account payloads, keeping the balance rollups and the account tree in step."""
+    with track_sync("accounts", realm_id, len(accounts)), transaction.atomic():
+        id_refs = [account_data["Id"] for account_data in accounts]
+        before = account_snapshots(realm_id, id_refs, for_update=True)
+        rows = [Account(realm_id=realm_id, id_ref=account_data["Id"], **account_fields(account_data)) for account_data in accounts]
+        bulk_upsert(Account, rows, account_fields(accounts[0]).keys())
+        after = account_snapshots(realm_id, id_refs)
+        apply_account_deltas(realm_id, before, after)
+        # New accounts or renames can move nodes in the chart of accounts
+        if any(before.get(id_ref, {}).get('fully_qualified_name') != row['fully_qualified_name'] for id_ref, row in after.items()):
+            rebuild_account_tree(realm_id)
+
+
+def insert_accounts(realm_id, accounts):
     try:
-        # Extract accounts from the API response
-        accounts = api_response.get("QueryResponse", {}).get("Account", [])
         if not accounts:
             return {"status": "error", "message": "No accounts found in the response"}
 
-        for account_data in accounts:
-            # Insert or update the Account
-            Account.objects.update_or_create(
-                id_ref=account_data["Id"],  # Unique identifier
-                defaults={
-                    "name": account_data["Name"],
-                    "sub_account": account_data.get("SubAccount", False),
-                    "fully_qualified_name": account_data["FullyQualifiedName"],
-                    "active": account_data.get("Active", True),
-                    "classification": account_data["Classification"],
-                    "account_type": account_data["AccountType"],
-                    "account_sub_type": account_data["AccountSubType"],
-                    "current_balance": account_data["CurrentBalance"],
-                    "current_balance_with_sub_accounts": account_data.get("CurrentBalanceWithSubAccounts", 0),
-                    "currency_value": account_data.get("CurrencyRef", {}).get("value", ""),
-                    "currency_name": account_data.get("CurrencyRef", {}).get("name", ""),
-                    "domain": account_data["domain"],
-                    "sparse": account_data.get("sparse", False),
-                    "sync_token": account_data["SyncToken"],
-                    "create_time": account_data.get("MetaData", {}).get("CreateTime"),
-                    "last_updated_time": account_data.get("MetaData", {}).get("LastUpdatedTime"),
-                }
-            )
+        upsert_accounts(realm_id, accounts)
+        shared_cache.invalidate_entities(realm_id, 'Account')
 
         return {"status": "success", "message": "Accounts inserted successfully"}
     except Exception as e:
@@ -238,42 +269,73 @@ class ListAccountsView(APIView):
         query = request.query_params.get('query')
         if not query:
             return Response({"error": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fields = parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred listaccountview: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
 
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/query?query={query}'
+        url = f'{settings.QUICKBOOKURL}/{realm_id}/query'
         headers = {
             'Authorization': f'Bearer {token.access_token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
 
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                insert_accounts(response.json())
-                logger.debug(f"Operation result listaccountview: {response.json()}")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred listaccountview: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            print(e,'dsdddddddddddd')
-            logger.error(f"An error occurred listaccountview: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
+        with sync_run(realm_id, 'Account') as run:
+            try:
+                with run.stage('fetch'):
+                    response = upstream.get(url, realm_id=realm_id, headers=headers, params={'query': query})
+            except UpstreamUnavailable as e:
+                run.fail(e)
+                fallback = mirror_fallback('Account', realm_id, query=query, fields=fields)
+                if fallback is None:
+                    raise
+                return fallback
+            run.page(response)
+            try:
+                if response.status_code == 200:
+                    with run.stage('parse'):
+                        data = response.json()
+                        accounts = data.get("QueryResponse", {}).get("Account", [])
+                    with run.stage('map'):
+                        changed = run.changed_records(Account, accounts)
+                    if changed:
+                        with run.stage('write'):
+                            result = insert_accounts(realm_id, changed)
+                        if result["status"] == "fail":
+                            run.fail(result["error"])
+                    logger.debug(f"Operation result listaccountview: {data}")
+                    return Response({'success': project_query_response(data, 'Account', fields)}, status=status.HTTP_200_OK)
+                else:
+                    data = response.json()
+                    message = data['Fault']['Error'][0]['Message']
+                    run.fail(message)
+                    logger.error(f"An error occurred listaccountview: {message}")
+                    return Response({'error': message}, status=response.status_code)
+            except Exception as e:
+                run.fail(e)
+                logger.error(f"An error occurred listaccountview: {e}")
+                return Response({'error': str(e)}, status=response.status_code)
 
 
 class GetAccountView(APIView):
     def get(self, request, realm_id, account_id):
         logger.info("GET request received at GetAccountView")
+        not_modified = not_modified_from_mirror(request, Account, realm_id, account_id)
+        if not_modified:
+            return not_modified
+        cache_key = shared_cache.entity_key(realm_id, 'Account', account_id)
+        cached = shared_cache.get_entity(cache_key)
+        if cached is not None:
+            return with_etag(request, Response({'success': cached}, status=status.HTTP_200_OK), cached.get('Account', {}))
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred GetAccountView: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -284,7 +346,13 @@ class GetAccountView(APIView):
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
-        response = requests.get(url, headers=headers)
+        try:
+            response = upstream.coalesced_get(realm_id, url, headers=headers)
+        except UpstreamUnavailable:
+            fallback = mirror_fallback('Account', realm_id, account_id)
+            if fallback is None:
+                raise
+            return fallback
         try:
             if response.status_code == 200:
                 logger.debug(f"Operation result GetAccountView:")
@@ -323,7 +391,9 @@ class GetAccountView(APIView):
                 # )
                 # except Exception as e:
                 #     print(e)
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
+                data = response.json()
+                shared_cache.set_entity(cache_key, data)
+                return with_etag(request, Response({'success': data}, status=status.HTTP_200_OK), data.get('Account', {}))
             else:
                 data = response.json()
                 message = data['Fault']['Error'][0]['Message']
@@ -342,7 +412,7 @@ class UpdateAccountView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred UpdateAccountView: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -370,6 +440,11 @@ class UpdateAccountView(APIView):
                 }
         }
 
+        payload = minimal_update(realm_id, 'Account', payload, sent=request.data)
+        if not has_changes(payload):
+            logger.info(f"Nothing to change at UpdateAccountView, QuickBooks not called")
+            return Response({'success': {'Account': mirror_record(realm_id, 'Account', payload['Id'])}, 'unchanged': True}, status=status.HTTP_200_OK)
+
         url = f'{settings.QUICKBOOKURL}/{realm_id}/account'
         headers = {
             'Authorization': f"Bearer {token.access_token}",
@@ -377,9 +452,10 @@ class UpdateAccountView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_update(realm_id, 'Account', url, headers, payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Account', response.json())
                 logger.debug(f"Operation result UpdateAccountView:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -400,7 +476,7 @@ class CreateCustomerView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred Create Customer: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -440,10 +516,11 @@ class CreateCustomerView(APIView):
         }
 
         url = f'{settings.QUICKBOOKURL}/{realm_id}/customer'
-        response = requests.post(url, headers=headers, data=payload)
+        response = upstream.post(url, realm_id=realm_id, headers=headers, data=payload)
 
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Customer', response.json())
                 logger.debug(f"Operation result Create Customer:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -457,70 +534,63 @@ class CreateCustomerView(APIView):
 
 
 
-def insert_customer_list(customer_data):
+def customer_fields(customer):
+    bill_addr_data = customer.get("BillAddr", {})
+    ship_addr_data = customer.get("ShipAddr", {})
+    currency_data = customer.get("CurrencyRef", {})
+    metadata_data = customer.get("MetaData", {})
+    return {
+        "taxable": customer.get("Taxable", False),
+        "bill_line1": bill_addr_data.get("Line1", ""),
+        "bill_city": bill_addr_data.get("City", ""),
+        "bill_country_sub_division_code": bill_addr_data.get("CountrySubDivisionCode", ""),
+        "bill_postal_code": bill_addr_data.get("PostalCode", ""),
+        "ship_line1": ship_addr_data.get("Line1", ""),
+        "ship_city": ship_addr_data.get("City", ""),
+        "ship_country_sub_division_code": ship_addr_data.get("CountrySubDivisionCode", ""),
+        "ship_postal_code": ship_addr_data.get("PostalCode", ""),
+        "job": customer.get("Job", False),
+        "bill_with_parent": customer.get("BillWithParent", False),
+        "balance": customer.get("Balance", 0.00),
+        "balance_with_jobs": customer.get("BalanceWithJobs", 0.00),
+        "currency_value": currency_data.get("value", ""),
+        "currency_name": currency_data.get("name", ""),
+        "preferred_delivery_method": customer.get("PreferredDeliveryMethod", ""),
+        "domain": customer.get("domain", ""),
+        "sparse": customer.get("sparse", False),
+        "sync_token": customer.get("SyncToken", ""),
+        "create_time": metadata_data.get("CreateTime"),
+        "last_updated_time": metadata_data.get("LastUpdatedTime"),
+        "given_name": customer.get("GivenName", ""),
+        "family_name": customer.get("FamilyName", "predicta"),
+        "fully_qualified_name": customer.get("FullyQualifiedName", ""),
+        "company_name": customer.get("CompanyName", "predicta"),
+        "display_name": customer.get("DisplayName", ""),
+        "print_on_check_name": customer.get("PrintOnCheckName", ""),
+        "active": customer.get("Active", True),
+        "primary_phone": customer.get("PrimaryPhone", {}).get("FreeFormNumber", ""),
+        "primary_email_addr": customer.get("PrimaryEmailAddr", {}).get("Address", ""),
+        "default_tax_code_ref": customer.get("DefaultTaxCodeRef", ""),
+        "deleted_at": None,
+    }
+
+
+def upsert_customers(realm_id, customer_data):
+    """Mirror customer payloads, keeping the balance rollups and the search index in step."""
+    with track_sync("customers", realm_id, len(customer_data)), transaction.atomic():
+        id_refs = [customer.get("Id") for customer in customer_data]
+        before = customer_snapshots(realm_id, id_refs, for_update=True)
+        rows = [CustomerInfo(realm_id=realm_id, id_ref=customer.get("Id"), **customer_fields(customer)) for customer in customer_data]
+        if rows:
+            bulk_upsert(CustomerInfo, rows, customer_fields(customer_data[0]).keys())
+        apply_customer_deltas(realm_id, before, customer_snapshots(realm_id, id_refs))
+        index_customers(realm_id, id_refs)
+
+
+def insert_customer_list(realm_id, customer_data):
     try:
-        for customer in customer_data:
-            # Extract BillAddr details
-            bill_addr_data = customer.get("BillAddr", {})
-            bill_line1 = bill_addr_data.get("Line1", "")
-            bill_city = bill_addr_data.get("City", "")
-            bill_country_sub_division_code = bill_addr_data.get("CountrySubDivisionCode", "")
-            bill_postal_code = bill_addr_data.get("PostalCode", "")
-
-            # Extract ShipAddr details
-            ship_addr_data = customer.get("ShipAddr", {})
-            ship_line1 = ship_addr_data.get("Line1", "")
-            ship_city = ship_addr_data.get("City", "")
-            ship_country_sub_division_code = ship_addr_data.get("CountrySubDivisionCode", "")
-            ship_postal_code = ship_addr_data.get("PostalCode", "")
-
-            # Extract Currency details
-            currency_data = customer.get("CurrencyRef", {})
-            currency_value = currency_data.get("value", "")
-            currency_name = currency_data.get("name", "")
-
-            # Extract Metadata
-            metadata_data = customer.get("MetaData", {})
-            create_time = metadata_data.get("CreateTime")
-            last_updated_time = metadata_data.get("LastUpdatedTime")
-
-            # Create or update CustomerInfo
-            CustomerInfo.objects.update_or_create(
-                id_ref=customer.get("Id"),
-                defaults={
-                    "taxable": customer.get("Taxable", False),
-                    "bill_line1": bill_line1,
-                    "bill_city": bill_city,
-                    "bill_country_sub_division_code": bill_country_sub_division_code,
-                    "bill_postal_code": bill_postal_code,
-                    "ship_line1": ship_line1,
-                    "ship_city": ship_city,
-                    "ship_country_sub_division_code": ship_country_sub_division_code,
-                    "ship_postal_code": ship_postal_code,
-                    "job": customer.get("Job", False),
-                    "bill_with_parent": customer.get("BillWithParent", False),
-                    "balance": customer.get("Balance", 0.00),
-                    "balance_with_jobs": customer.get("BalanceWithJobs", 0.00),
-                    "currency_value": currency_value,
-                    "currency_name": currency_name,
-                    "preferred_delivery_method": customer.get("PreferredDeliveryMethod", ""),
-                    "domain": customer.get("domain", ""),
-                    "sparse": customer.get("sparse", False),
-                    "sync_token": customer.get("SyncToken", ""),
-                    "create_time": create_time,
-                    "last_updated_time": last_updated_time,
-                    "given_name": customer.get("GivenName", ""),
-                    "family_name": customer.get("FamilyName", "predicta"),
-                    "fully_qualified_name": customer.get("FullyQualifiedName", ""),
-                    "company_name": customer.get("CompanyName", "predicta"),
-                    "display_name": customer.get("DisplayName", ""),
-                    "print_on_check_name": customer.get("PrintOnCheckName", ""),
-                    "active": customer.get("Active", True),
-                    "primary_phone": customer.get("PrimaryPhone", {}).get("FreeFormNumber", ""),
-                    "primary_email_addr": customer.get("PrimaryEmailAddr", {}).get("Address", ""),
-                    "default_tax_code_ref": customer.get("DefaultTaxCodeRef", ""),
-                },
-            )
+        upsert_customers(realm_id, customer_data)
+        shared_cache.invalidate_entities(realm_id, 'Customer')
 
         return Response({"message": "Customers successfully inserted or updated."}, status=status.HTTP_201_CREATED)
     except Exception as e:
@@ -536,43 +606,74 @@ class ListCustomerView(APIView):
         query = request.query_params.get('query')
         if not query:
             return Response({"error": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fields = parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred list customer view: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
 
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/query?query={query}'
+        url = f'{settings.QUICKBOOKURL}/{realm_id}/query'
         headers = {
             'Authorization': f'Bearer {token.access_token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
 
-        response = requests.get(url, headers=headers)
-        try:
-            if response.status_code == 200:
-                customer_data = response.json().get("QueryResponse", {}).get("Customer", [])
-                insert_customer_list(customer_data)
-                logger.debug(f"Operation result list customer: { response.json()}")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
-            else:
-                data = response.json()
-                message = data['Fault']['Error'][0]['Message']
-                logger.error(f"An error occurred list customer: {message}")
-                return Response({'error': message}, status=response.status_code)
-        except Exception as e:
-            logger.error(f"An error occurred list customer: {e}")
-            return Response({'error': str(e)}, status=response.status_code)
+        with sync_run(realm_id, 'Customer') as run:
+            try:
+                with run.stage('fetch'):
+                    response = upstream.get(url, realm_id=realm_id, headers=headers, params={'query': query})
+            except UpstreamUnavailable as e:
+                run.fail(e)
+                fallback = mirror_fallback('Customer', realm_id, query=query, fields=fields)
+                if fallback is None:
+                    raise
+                return fallback
+            run.page(response)
+            try:
+                if response.status_code == 200:
+                    with run.stage('parse'):
+                        data = response.json()
+                        customer_data = data.get("QueryResponse", {}).get("Customer", [])
+                    with run.stage('map'):
+                        changed = run.changed_records(CustomerInfo, customer_data)
+                    if changed:
+                        with run.stage('write'):
+                            result = insert_customer_list(realm_id, changed)
+                        if result.status_code >= 400:
+                            run.fail(result.data["error"])
+                    logger.debug(f"Operation result list customer: {data}")
+                    return Response({'success': project_query_response(data, 'Customer', fields)}, status=status.HTTP_200_OK)
+                else:
+                    data = response.json()
+                    message = data['Fault']['Error'][0]['Message']
+                    run.fail(message)
+                    logger.error(f"An error occurred list customer: {message}")
+                    return Response({'error': message}, status=response.status_code)
+            except Exception as e:
+                run.fail(e)
+                logger.error(f"An error occurred list customer: {e}")
+                return Response({'error': str(e)}, status=response.status_code)
 
 
 
 class GetCustomerView(APIView):
     def get(self, request, realm_id, customer_id):
         logger.info("GET request received at GetCustomerView")
+        not_modified = not_modified_from_mirror(request, CustomerInfo, realm_id, customer_id)
+        if not_modified:
+            return not_modified
+        cache_key = shared_cache.entity_key(realm_id, 'Customer', customer_id)
+        cached = shared_cache.get_entity(cache_key)
+        if cached is not None:
+            return with_etag(request, Response({'success': cached}, status=status.HTTP_200_OK), cached.get('Customer', {}))
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred GetCustomerView: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -583,7 +684,13 @@ class GetCustomerView(APIView):
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
-        response = requests.get(url, headers=headers)
+        try:
+            response = upstream.coalesced_get(realm_id, url, headers=headers)
+        except UpstreamUnavailable:
+            fallback = mirror_fallback('Customer', realm_id, customer_id)
+            if fallback is None:
+                raise
+            return fallback
         try:
             if response.status_code == 200:
                 # customer_data = response.json().get('Customer', {})
@@ -652,7 +759,9 @@ class GetCustomerView(APIView):
                 #     }
                 # )
                 # logger.debug(f"Operation result GetCustomerView:")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
+                data = response.json()
+                shared_cache.set_entity(cache_key, data)
+                return with_etag(request, Response({'success': data}, status=status.HTTP_200_OK), data.get('Customer', {}))
             else:
                 data = response.json()
                 message = data['Fault']['Error'][0]['Message']
@@ -671,7 +780,7 @@ class UpdateCustomerView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred update customer: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -719,6 +828,11 @@ class UpdateCustomerView(APIView):
             }
         }
 
+        payload = minimal_update(realm_id, 'Customer', payload, sent=request.data)
+        if not has_changes(payload):
+            logger.info(f"Nothing to change at update customer, QuickBooks not called")
+            return Response({'success': {'Customer': mirror_record(realm_id, 'Customer', payload['Id'])}, 'unchanged': True}, status=status.HTTP_200_OK)
+
         url = f'{settings.QUICKBOOKURL}/{realm_id}/customer'
         headers = {
             'Authorization': f"Bearer {token.access_token}",
@@ -726,9 +840,10 @@ class UpdateCustomerView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_update(realm_id, 'Customer', url, headers, payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Customer', response.json())
                 logger.debug(f"Operation result update customer:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -751,7 +866,7 @@ class UpdateSparseCustomerView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred update Sparse customer: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -763,6 +878,11 @@ class UpdateSparseCustomerView(APIView):
             "sparse": request.data.get('sparse')
         }
 
+        payload = minimal_update(realm_id, 'Customer', payload, sent=request.data)
+        if not has_changes(payload):
+            logger.info(f"Nothing to change at update Sparse customer, QuickBooks not called")
+            return Response({'success': {'Customer': mirror_record(realm_id, 'Customer', payload['Id'])}, 'unchanged': True}, status=status.HTTP_200_OK)
+
         url = f'{settings.QUICKBOOKURL}/{realm_id}/customer'
         headers = {
             'Authorization': f"Bearer {token.access_token}",
@@ -770,9 +890,10 @@ class UpdateSparseCustomerView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_update(realm_id, 'Customer', url, headers, payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Customer', response.json())
                 logger.debug(f"Operation result update Sparse customer:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -794,7 +915,7 @@ class CreateEmployeeView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred create employee: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -824,10 +945,11 @@ class CreateEmployeeView(APIView):
         }
 
         url = f'{settings.QUICKBOOKURL}/{realm_id}/employee'
-        response = requests.post(url, headers=headers, data=payload)
+        response = upstream.post(url, realm_id=realm_id, headers=headers, data=payload)
 
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Employee', response.json())
                 logger.debug(f"Operation result create employee:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -844,8 +966,15 @@ class CreateEmployeeView(APIView):
 class GetEmployeeView(APIView):
     def get(self, request, realm_id, employee_id):
         logger.info("GET request received at Get employee")
+        not_modified = not_modified_from_mirror(request, Employee, realm_id, employee_id)
+        if not_modified:
+            return not_modified
+        cache_key = shared_cache.entity_key(realm_id, 'Employee', employee_id)
+        cached = shared_cache.get_entity(cache_key)
+        if cached is not None:
+            return with_etag(request, Response({'success': cached}, status=status.HTTP_200_OK), cached.get('Employee', {}))
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred Get employee: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -857,7 +986,13 @@ class GetEmployeeView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.get(url, headers=headers)
+        try:
+            response = upstream.coalesced_get(realm_id, url, headers=headers)
+        except UpstreamUnavailable:
+            fallback = mirror_fallback('Employee', realm_id, employee_id)
+            if fallback is None:
+                raise
+            return fallback
         try:
             if response.status_code == 200:
                 # employee_data = response.json().get('Employee', {})
@@ -884,7 +1019,9 @@ class GetEmployeeView(APIView):
                 #     }
                 # )
                 logger.debug(f"Operation result Get employee:")
-                return Response({'success': response.json()}, status=status.HTTP_200_OK)
+                data = response.json()
+                shared_cache.set_entity(cache_key, data)
+                return with_etag(request, Response({'success': data}, status=status.HTTP_200_OK), data.get('Employee', {}))
             else:
                 data = response.json()
                 message = data['Fault']['Error'][0]['Message']
@@ -904,7 +1041,7 @@ class UpdateEmployeeView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred Update employee: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -938,6 +1075,11 @@ class UpdateEmployeeView(APIView):
             }
         }
 
+        payload = minimal_update(realm_id, 'Employee', payload, sent=request.data)
+        if not has_changes(payload):
+            logger.info(f"Nothing to change at Update employee, QuickBooks not called")
+            return Response({'success': {'Employee': mirror_record(realm_id, 'Employee', payload['Id'])}, 'unchanged': True}, status=status.HTTP_200_OK)
+
         url = f'{settings.QUICKBOOKURL}/{realm_id}/employee'
         headers = {
             'Authorization': f"Bearer {token.access_token}",
@@ -945,9 +1087,10 @@ class UpdateEmployeeView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_update(realm_id, 'Employee', url, headers, payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'Employee', response.json())
                 logger.debug(f"Operation result  Update employee:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -962,78 +1105,182 @@ class UpdateEmployeeView(APIView):
 
 
 
+def employee_fields(emp):
+    return {
+        "billable_time": emp.get("BillableTime", False),
+        "domain": emp.get("domain", ""),
+        "sparse": emp.get("sparse", False),
+        "sync_token": emp.get("SyncToken", ""),
+        "create_time": emp.get("MetaData", {}).get("CreateTime"),
+        "last_updated_time": emp.get("MetaData", {}).get("LastUpdatedTime"),
+        "given_name": emp.get("GivenName", ""),
+        "family_name": emp.get("FamilyName", ""),
+        "display_name": emp.get("DisplayName", ""),
+        "print_on_check_name": emp.get("PrintOnCheckName", ""),
+        "active": emp.get("Active", True),
+        "deleted_at": None,
+    }
+
+
+def upsert_employees(realm_id, employees):
+    with track_sync("employees", realm_id, len(employees)), transaction.atomic():
+        rows = [Employee(realm_id=realm_id, id_ref=emp.get("Id"), **employee_fields(emp)) for emp in employees]
+        bulk_upsert(Employee, rows, employee_fields(employees[0]).keys())
+
+
+def insert_employees(realm_id, employees):
+    upsert_employees(realm_id, employees)
+    shared_cache.invalidate_entities(realm_id, 'Employee')
+
+
+
 class ListEmployesView(APIView):
     def get(self, request, realm_id):
         logger.info("GET request received at ListEmployeesView")
         query = request.query_params.get('query')
         if not query:
             return Response({"error": "Query parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fields = parse_fields(request.query_params.get('fields'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         # Fetch the QuickBooks token for the provided realm_id
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"realm_id {realm_id} does not exist in QuickBooksToken")
             return Response({"error": "Invalid realm_id"}, status=status.HTTP_400_BAD_REQUEST)
 
-        url = f'{settings.QUICKBOOKURL}/{realm_id}/query?query={query}'
+        url = f'{settings.QUICKBOOKURL}/{realm_id}/query'
         headers = {
             'Authorization': f'Bearer {token.access_token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
 
-        # Perform the request to QuickBooks API
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            logger.error(f"Error making request to QuickBooks API: {e}")
-            return Response({"error": "Error connecting to QuickBooks API"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # Process the response
-        try:
-            response_data = response.json()
-            employees = response_data.get("QueryResponse", {}).get("Employee", [])
-
-            if not employees:
-                logger.info("No employees found in the response")
-                return Response({"message": "No employees found"}, status=status.HTTP_200_OK)
-
-            with transaction.atomic():
-                for emp in employees:
-                    # Update or create Employee records directly
-                    Employee.objects.update_or_create(
-                        id_ref=emp.get("Id"),
-                        defaults={
-                            "billable_time": emp.get("BillableTime", False),
-                            "domain": emp.get("domain", ""),
-                            "sparse": emp.get("sparse", False),
-                            "sync_token": emp.get("SyncToken", ""),
-                            "create_time": emp.get("MetaData", {}).get("CreateTime"),
-                            "last_updated_time": emp.get("MetaData", {}).get("LastUpdatedTime"),
-                            "given_name": emp.get("GivenName", ""),
-                            "family_name": emp.get("FamilyName", ""),
-                            "display_name": emp.get("DisplayName", ""),
-                            "print_on_check_name": emp.get("PrintOnCheckName", ""),
-                            "active": emp.get("Active", True),
-                        },
-                    )
-
-            logger.info("Employee data saved successfully")
-            return Response({"message": "Employees saved successfully"}, status=status.HTTP_200_OK)
-
-        except KeyError as e:
-            logger.error(f"Missing key in API response: {e}")
-            return Response({"error": f"Missing data key: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        except Exception as e:
-            logger.error(f"Unexpected error in ListEmployeesView: {e}")
-            return Response({"error": "An unexpected error occurred"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-
-
-
+        with sync_run(realm_id, 'Employee') as run:
+            # Perform the request to QuickBooks API
+            try:
+                with run.stage('fetch'):
+                    response = upstream.get(url, realm_id=realm_id, headers=headers, params={'query': query})
+                run.page(response)
+                response.raise_for_status()
+            except UpstreamUnavailable as e:
+                run.fail(e)
+                fallback = mirror_fallback('Employee', realm_id, query=query, fields=fields)
+                if fallback is None:
+                    raise
+                return fallback
+            except upstream.RequestException as e:
+                run.fail(e)
+                logger.error(f"Error making request to QuickBooks API: {e}")
+                return Response({"error": "Error connecting to QuickBooks API"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            # Process the response
+            try:
+                with run.stage('parse'):
+                    response_data = response.json()
+                    employees = response_data.get("QueryResponse", {}).get("Employee", [])
+
+                if not employees:
+                    logger.info("No employees found in the response")
+                    return Response({"message": "No employees found", "sync": run.counts()}, status=status.HTTP_200_OK)
+
+                with run.stage('map'):
+                    changed = run.changed_records(Employee, employees)
+                if changed:
+                    with run.stage('write'):
+                        insert_employees(realm_id, changed)
+
+                logger.info("Employee data saved successfully")
+                return Response({"message": "Employees saved successfully", "sync": run.counts()}, status=status.HTTP_200_OK)
+
+            except KeyError as e:
+                run.fail(e)
+                logger.error(f"Missing key in API response: {e}")
+                return Response({"error": f"Missing data key: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except Exception as e:
+                run.fail(e)
+                logger.error(f"Unexpected error in ListEmployeesView: {e}")
+                return Response({"error": "An unexpected error occurred"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+
+
+
+
+def company_info_fields(company_info):
+    return {
+        'company_name': company_info.get('CompanyName'),
+        'legal_name': company_info.get('LegalName'),
+        'company_line1': company_info.get('CompanyAddr', {}).get('Line1'),
+        'company_city': company_info.get('CompanyAddr', {}).get('City'),
+        'company_country_sub_division_code': company_info.get('CompanyAddr', {}).get('CountrySubDivisionCode'),
+        'company_postal_code': company_info.get('CompanyAddr', {}).get('PostalCode'),
+        'customer_communication_line1': company_info.get('CustomerCommunicationAddr', {}).get('Line1'),
+        'customer_communication_city': company_info.get('CustomerCommunicationAddr', {}).get('City'),
+        'customer_communication_country_sub_division_code': company_info.get('CustomerCommunicationAddr', {}).get('CountrySubDivisionCode'),
+        'customer_communication_postal_code': company_info.get('CustomerCommunicationAddr', {}).get('PostalCode'),
+        'customer_communication_email_addr': company_info.get('CustomerCommunicationEmailAddr', {}).get('Address'),
+        'legal_line1': company_info.get('LegalAddr', {}).get('Line1'),
+        'legal_city': company_info.get('LegalAddr', {}).get('City'),
+        'legal_country_sub_division_code': company_info.get('LegalAddr', {}).get('CountrySubDivisionCode'),
+        'legal_postal_code': company_info.get('LegalAddr', {}).get('PostalCode'),
+        'primary_phone': company_info.get('PrimaryPhone', {}).get('FreeFormNumber'),
+        'company_start_date': company_info.get('CompanyStartDate'),
+        'fiscal_year_start_month': company_info.get('FiscalYearStartMonth'),
+        'country': company_info.get('Country'),
+        'email': company_info.get('Email', {}).get('Address'),
+        'web_addr': company_info.get('WebAddr'),
+        'supported_languages': company_info.get('SupportedLanguages'),
+        'domain': company_info.get('domain'),
+        'sparse': company_info.get('sparse'),
+        'sync_token': company_info.get('SyncToken'),
+        'create_time': company_info.get('MetaData', {}).get('CreateTime'),
+        'last_updated_time': company_info.get('MetaData', {}).get('LastUpdatedTime'),
+    }
+
+
+def upsert_company_infos(realm_id, company_infos):
+    rows = [CompanyInfo(realm_id=realm_id, id_ref=company_info["Id"], **company_info_fields(company_info)) for company_info in company_infos]
+    bulk_upsert(CompanyInfo, rows, company_info_fields(company_infos[0]).keys())
+
+
+# Entity name in QuickBooks responses -> mirror writer
+MIRROR_WRITERS = {
+    'Account': upsert_accounts,
+    'Customer': upsert_customers,
+    'Employee': upsert_employees,
+    'CompanyInfo': upsert_company_infos,
+}
+
+
+def write_through(realm_id, entity, response_data):
+    """
+    Mirror the entity returned by a create/update call (with its new SyncToken) and
+    cache the response, so the next read needs neither a sync nor a GET upstream.
+    """
+    record = response_data.get(entity, {})
+    if not record.get('Id'):
+        return
+    if settings.QUICKBOOKS_WRITE_BEHIND:
+        # Imported here: the journal needs fcntl, which Windows development setups lack
+        from . import write_behind
+        # Batched into the mirror by the background flush; the cache has the new version meanwhile
+        write_behind.buffer(MIRROR_WRITERS).add(realm_id, entity, record)
+        shared_cache.set_entity(shared_cache.entity_key(realm_id, entity, record['Id']), response_data)
+        return
+    try:
+        MIRROR_WRITERS[entity](realm_id, [record])
+    except Exception as e:
+        # The write succeeded upstream; the next sync repairs the mirror
+        logger.error(f"Write-through of {entity} {record['Id']} failed: {e}")
+        shared_cache.invalidate_entity(realm_id, entity, record['Id'])
+        return
+    shared_cache.set_entity(shared_cache.entity_key(realm_id, entity, record['Id']), response_data)
+    shared_cache.bump_mirror_version(realm_id)
 
 
 class CreateCompanyifoView(APIView):
@@ -1043,7 +1290,7 @@ class CreateCompanyifoView(APIView):
         if not data:
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred create-company-info: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -1116,9 +1363,10 @@ class CreateCompanyifoView(APIView):
         }
 
         url = f'{settings.QUICKBOOKURL}/{realm_id}/companyinfo'
-        response = requests.post(url, headers=headers, data=payload)
+        response = upstream.post(url, realm_id=realm_id, headers=headers, data=payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'CompanyInfo', response.json())
                 logger.debug(f"Operation result create-company-info:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -1135,9 +1383,16 @@ class CreateCompanyifoView(APIView):
 class GetCompanyInfoView(APIView):
     def get(self, request, realm_id, company_info_id):
         logger.info("GET request received at get-company-info")
+        not_modified = not_modified_from_mirror(request, CompanyInfo, realm_id, company_info_id)
+        if not_modified:
+            return not_modified
+        cache_key = shared_cache.entity_key(realm_id, 'CompanyInfo', company_info_id)
+        cached = shared_cache.get_entity(cache_key)
+        if cached is not None:
+            return with_etag(request, Response({'success': 'Company Info updated successfully'}, status=status.HTTP_200_OK), cached.get('CompanyInfo', {}))
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error("Realm ID does not exist")
             return Response({"error": "Realm ID does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -1149,43 +1404,20 @@ class GetCompanyInfoView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.get(url, headers=headers)
+        try:
+            response = upstream.coalesced_get(realm_id, url, headers=headers)
+        except UpstreamUnavailable:
+            fallback = mirror_fallback('CompanyInfo', realm_id, company_info_id)
+            if fallback is None:
+                raise
+            return fallback
         if response.status_code == 200:
             try:
-                company_info = response.json().get('CompanyInfo', {})
-                company_info_instance, created = CompanyInfo.objects.update_or_create(
-                    id_ref=company_info['Id'],
-                    defaults={
-                        'company_name': company_info.get('CompanyName'),
-                        'legal_name': company_info.get('LegalName'),
-                        'company_line1': company_info.get('CompanyAddr', {}).get('Line1'),
-                        'company_city': company_info.get('CompanyAddr', {}).get('City'),
-                        'company_country_sub_division_code': company_info.get('CompanyAddr', {}).get('CountrySubDivisionCode'),
-                        'company_postal_code': company_info.get('CompanyAddr', {}).get('PostalCode'),
-                        'customer_communication_line1': company_info.get('CustomerCommunicationAddr', {}).get('Line1'),
-                        'customer_communication_city': company_info.get('CustomerCommunicationAddr', {}).get('City'),
-                        'customer_communication_country_sub_division_code': company_info.get('CustomerCommunicationAddr', {}).get('CountrySubDivisionCode'),
-                        'customer_communication_postal_code': company_info.get('CustomerCommunicationAddr', {}).get('PostalCode'),
-                        'customer_communication_email_addr': company_info.get('CustomerCommunicationEmailAddr', {}).get('Address'),
-                        'legal_line1': company_info.get('LegalAddr', {}).get('Line1'),
-                        'legal_city': company_info.get('LegalAddr', {}).get('City'),
-                        'legal_country_sub_division_code': company_info.get('LegalAddr', {}).get('CountrySubDivisionCode'),
-                        'legal_postal_code': company_info.get('LegalAddr', {}).get('PostalCode'),
-                        'primary_phone': company_info.get('PrimaryPhone', {}).get('FreeFormNumber'),
-                        'company_start_date': company_info.get('CompanyStartDate'),
-                        'fiscal_year_start_month': company_info.get('FiscalYearStartMonth'),
-                        'country': company_info.get('Country'),
-                        'email': company_info.get('Email', {}).get('Address'),
-                        'web_addr': company_info.get('WebAddr'),
-                        'supported_languages': company_info.get('SupportedLanguages'),
-                        'domain': company_info.get('domain'),
-                        'sparse': company_info.get('sparse'),
-                        'sync_token': company_info.get('SyncToken'),
-                        'create_time': company_info.get('MetaData', {}).get('CreateTime'),
-                        'last_updated_time': company_info.get('MetaData', {}).get('LastUpdatedTime')
-                    }
-                )
-                return Response({'success': 'Company Info updated successfully'}, status=status.HTTP_200_OK)
+                data = response.json()
+                company_info = data.get('CompanyInfo', {})
+                upsert_company_infos(realm_id, [company_info])
+                shared_cache.set_entity(cache_key, data)
+                return with_etag(request, Response({'success': 'Company Info updated successfully'}, status=status.HTTP_200_OK), company_info)
             except Exception as e:
                 logger.error(f"Error processing company info: {e}")
                 return Response({'error': 'Internal server error'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1205,7 +1437,7 @@ class UpdateCompanyifoView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred update-company-info: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -1269,6 +1501,11 @@ class UpdateCompanyifoView(APIView):
             }
         }
 
+        payload = minimal_update(realm_id, 'CompanyInfo', payload, sent=request.data)
+        if not has_changes(payload):
+            logger.info(f"Nothing to change at update-company-info, QuickBooks not called")
+            return Response({'success': {'CompanyInfo': mirror_record(realm_id, 'CompanyInfo', payload['Id'])}, 'unchanged': True}, status=status.HTTP_200_OK)
+
         url = f'{settings.QUICKBOOKURL}/{realm_id}/companyinfo'
         headers = {
             'Authorization': f"Bearer {token.access_token}",
@@ -1276,9 +1513,10 @@ class UpdateCompanyifoView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_update(realm_id, 'CompanyInfo', url, headers, payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'CompanyInfo', response.json())
                 logger.debug(f"Operation result update-company-info:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -1300,7 +1538,7 @@ class UpdateSparseCompanyifoView(APIView):
             return Response({"error": "Request body is missing."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            token = QuickBooksToken.objects.get(realm_id=realm_id)
+            token = shared_cache.get_token(realm_id)
         except QuickBooksToken.DoesNotExist:
             logger.error(f"An error occurred update-sparse-company-info: realm_id does not exist")
             return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
@@ -1322,6 +1560,11 @@ class UpdateSparseCompanyifoView(APIView):
             "Id": request.data.get('Id'), 
         }
 
+        payload = minimal_update(realm_id, 'CompanyInfo', payload, sent=request.data)
+        if not has_changes(payload):
+            logger.info(f"Nothing to change at update-sparse-company-info, QuickBooks not called")
+            return Response({'success': {'CompanyInfo': mirror_record(realm_id, 'CompanyInfo', payload['Id'])}, 'unchanged': True}, status=status.HTTP_200_OK)
+
         url = f'{settings.QUICKBOOKURL}/{realm_id}/companyinfo'
         headers = {
             'Authorization': f"Bearer {token.access_token}",
@@ -1329,9 +1572,10 @@ class UpdateSparseCompanyifoView(APIView):
             'Accept': 'application/json'
         }
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        response = post_update(realm_id, 'CompanyInfo', url, headers, payload)
         try:
             if response.status_code == 200:
+                write_through(realm_id, 'CompanyInfo', response.json())
                 logger.debug(f"Operation result update-sparse-company-info:")
                 return Response({'success': response.json()}, status=status.HTTP_200_OK)
             else:
@@ -1342,3 +1586,279 @@ class UpdateSparseCompanyifoView(APIView):
         except Exception as e:
             logger.error(f"An error occurred update-sparse-company-info: {e}")
             return Response({'error': str(e)}, status=response.status_code)
+
+
+
+class AccountBalanceRollupView(APIView):
+    def get(self, request, realm_id):
+        logger.info("GET request received at account balance rollup")
+        group_by = request.query_params.get('group_by')
+        if group_by not in (None, 'classification', 'account_type'):
+            return Response({"error": "group_by must be classification or account_type."}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = AccountBalanceRollup.objects.filter(realm_id=realm_id).values('classification', 'account_type', 'total_balance', 'account_count')
+        if group_by:
+            grouped = {}
+            for row in rows:
+                entry = grouped.setdefault(row[group_by], {group_by: row[group_by], 'total_balance': 0, 'account_count': 0})
+                entry['total_balance'] += row['total_balance']
+                entry['account_count'] += row['account_count']
+            rows = list(grouped.values())
+        return Response({'success': list(rows)}, status=status.HTTP_200_OK)
+
+
+
+class CustomerBalanceRollupView(APIView):
+    def get(self, request, realm_id):
+        logger.info("GET request received at customer balance rollup")
+        rows = CustomerBalanceRollup.objects.filter(realm_id=realm_id).values('city', 'total_balance', 'customer_count')
+        return Response({'success': list(rows)}, status=status.HTTP_200_OK)
+
+
+
+class AccountTreeRollupView(APIView):
+    def get(self, request, realm_id):
+        logger.info("GET request received at account tree rollup")
+        rows = AccountTreeRollup.objects.filter(realm_id=realm_id)
+        max_depth = request.query_params.get('max_depth')
+        if max_depth is not None:
+            try:
+                rows = rows.filter(depth__lte=int(max_depth))
+            except ValueError:
+                return Response({"error": "max_depth must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        rows = rows.order_by('path').values('path', 'depth', 'total_balance', 'account_count')
+        return Response({'success': list(rows)}, status=status.HTTP_200_OK)
+
+
+
+class AccountSubtreeView(APIView):
+    def get(self, request, realm_id, account_id):
+        logger.info("GET request received at account subtree")
+        root = Account.objects.filter(realm_id=realm_id, id_ref=account_id).values('path').first()
+        if not root or not root['path']:
+            return Response({"error": "Account not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        accounts = list(account_subtree(realm_id, root['path']))
+        for account in accounts:
+            account['parent_id'] = account.pop('parent__id_ref')
+        return Response({'success': accounts}, status=status.HTTP_200_OK)
+
+
+
+class SearchCustomerView(APIView):
+    def get(self, request, realm_id):
+        logger.info("GET request received at search customer")
+        query = request.query_params.get('q')
+        if not query:
+            return Response({"error": "q parameter is required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        customers = search_customers(realm_id, query, limit).values(
+            'id_ref', 'display_name', 'company_name', 'given_name', 'family_name', 'primary_email_addr', 'primary_phone',
+        )
+        return Response({'success': list(customers)}, status=status.HTTP_200_OK)
+
+
+class ResolveEntitiesView(APIView):
+    """
+    Resolve lists of Account/Customer/Employee IDs in one call, e.g.
+    {"Customer": ["1", "7"], "Account": ["33"]} -> {"Customer": {"1": {...}, "7": {...}}, ...}.
+    IDs found nowhere map to null. ?view=names answers accounts and customers from the
+    in-memory snapshot with {name, type/company, balance} entries.
+    """
+    def post(self, request, realm_id):
+        logger.info("POST request received at resolve entities")
+        try:
+            requested = parse_resolve_request(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        view = request.query_params.get('view', 'full')
+        if view not in RESOLVE_VIEWS:
+            return Response({"error": f"view must be one of {', '.join(RESOLVE_VIEWS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        covered, lookup = RESOLVE_VIEWS[view]
+        if any(entity not in covered for entity in requested):
+            return Response({"error": f"view={view} resolves {', '.join(covered)} only."}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = lookup(realm_id, requested)
+        missing = {entity: [id_ref for id_ref in id_refs if id_ref not in found[entity]] for entity, id_refs in requested.items()}
+        missing = {entity: id_refs for entity, id_refs in missing.items() if id_refs}
+        source = 'mirror'
+        if missing:
+            try:
+                token = shared_cache.get_token(realm_id)
+            except QuickBooksToken.DoesNotExist:
+                logger.error(f"An error occurred resolve entities: realm_id does not exist")
+                return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+            url = f'{settings.QUICKBOOKURL}/{realm_id}/query'
+            headers = {
+                'Authorization': f'Bearer {token.access_token}',
+                'Content-Type': 'application/json',
+                'Accept': 'application/json'
+            }
+            try:
+                fetched = {}
+                for entity, id_refs in missing.items():
+                    records = []
+                    for query in id_queries(entity, id_refs):
+                        response = upstream.get(url, realm_id=realm_id, headers=headers, params={'query': query})
+                        if response.status_code != 200:
+                            message = response.json()['Fault']['Error'][0]['Message']
+                            logger.error(f"An error occurred resolve entities: {message}")
+                            return Response({'error': message}, status=response.status_code)
+                        records.extend(response.json().get('QueryResponse', {}).get(entity, []))
+                    if records:
+                        MIRROR_WRITERS[entity](realm_id, records)
+                        fetched[entity] = [record['Id'] for record in records]
+                if fetched:
+                    shared_cache.bump_mirror_version(realm_id)
+                    for entity, entries in lookup(realm_id, fetched).items():
+                        found[entity].update(entries)
+                source = 'quickbooks'
+            except UpstreamUnavailable:
+                logger.info(f"QuickBooks unavailable, resolving realm {realm_id} from the mirror only")
+
+        # Tombstoned rows count as found, so they are not refetched, but resolve to null
+        resolved = {entity: {id_ref: found[entity].get(id_ref) for id_ref in id_refs} for entity, id_refs in requested.items()}
+        response = Response({'success': resolved}, status=status.HTTP_200_OK)
+        response['X-Data-Source'] = source
+        return response
+
+
+class SyncRunsView(APIView):
+    """Most recent sync runs of a realm, newest first; ?entity= narrows to one entity type."""
+    def get(self, request, realm_id):
+        logger.info("GET request received at sync runs")
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 500)
+        except ValueError:
+            return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        runs = SyncRun.objects.filter(realm_id=realm_id)
+        if request.query_params.get('entity'):
+            runs = runs.filter(entity=request.query_params['entity'])
+        runs = runs.order_by('-started_at').values()[:limit]
+        return Response({'success': list(runs)}, status=status.HTTP_200_OK)
+
+
+class SyncTrendsView(APIView):
+    """
+    Average sync time per realm and entity over the last ?days= (default 7) against the
+    period before, with the realms whose syncs slowed down the most first.
+    """
+    def get(self, request):
+        logger.info("GET request received at sync trends")
+        try:
+            days = int(request.query_params.get('days', 7))
+            min_runs = int(request.query_params.get('min_runs', 3))
+        except ValueError:
+            return Response({"error": "days and min_runs must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if days < 1:
+            return Response({"error": "days must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+        trends = sync_trends(days=days, entity=request.query_params.get('entity'), min_runs=min_runs)
+        return Response({'success': trends}, status=status.HTTP_200_OK)
+
+
+# QuickBooks keeps change data capture for 30 days
+CDC_MAX_DAYS = 30
+
+
+class SyncChangesView(APIView):
+    """
+    Apply QuickBooks change data capture for accounts, customers and employees since
+    ?since= (ISO 8601; by default the last successful run, at most 30 days back).
+    Changed entities are upserted, deleted ones tombstoned.
+    """
+    def get(self, request, realm_id):
+        logger.info("GET request received at sync changes")
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                return Response({"error": "since must be an ISO 8601 datetime."}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        else:
+            since = (SyncRun.objects.filter(realm_id=realm_id, entity='CDC', status='success')
+                     .order_by('-started_at').values_list('started_at', flat=True).first())
+        oldest = timezone.now() - timedelta(days=CDC_MAX_DAYS)
+        since = max(since or oldest, oldest)
+
+        try:
+            token = shared_cache.get_token(realm_id)
+        except QuickBooksToken.DoesNotExist:
+            logger.error(f"An error occurred sync changes: realm_id does not exist")
+            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+        url = f'{settings.QUICKBOOKURL}/{realm_id}/cdc'
+        headers = {
+            'Authorization': f'Bearer {token.access_token}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+        with sync_run(realm_id, 'CDC') as run:
+            with run.stage('fetch'):
+                response = upstream.get(url, realm_id=realm_id, headers=headers,
+                                        params={'entities': ','.join(TOMBSTONE_MODELS), 'changedSince': since.isoformat()})
+            run.page(response)
+            if response.status_code != 200:
+                message = response.json()['Fault']['Error'][0]['Message']
+                run.fail(message)
+                logger.error(f"An error occurred sync changes: {message}")
+                return Response({'error': message}, status=response.status_code)
+
+            with run.stage('parse'):
+                changes = parse_cdc(response.json())
+            for entity, (records, deleted) in changes.items():
+                with run.stage('map'):
+                    changed = run.changed_records(TOMBSTONE_MODELS[entity], records)
+                with run.stage('write'):
+                    if changed:
+                        MIRROR_WRITERS[entity](realm_id, changed)
+                        shared_cache.invalidate_entities(realm_id, entity)
+                    run.add(rows_deleted=tombstone(realm_id, entity, deleted))
+        return Response({'success': run.counts(), 'since': since}, status=status.HTTP_200_OK)
+
+
+class QueryView(APIView):
+    """
+    Structured QuickBooks query (see quickbooks.query_builder), e.g.
+    {"entity": "Customer", "filters": [{"field": "Balance", "op": ">", "value": 0}], "limit": 50}.
+    "fields" projects the result like ?fields= on the list endpoints. Results of
+    identical queries are cached for QUICKBOOKS_QUERY_CACHE_TTL seconds.
+    """
+    def post(self, request, realm_id):
+        logger.info("POST request received at query")
+        try:
+            entity, query = build_query(request.data)
+            fields = parse_fields(field_list(request.data.get('fields')))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = shared_cache.query_key(realm_id, entity, query)
+        data = shared_cache.get_query(cache_key)
+        if data is not None:
+            return Response({'success': project_query_response(data, entity, fields), 'query': query, 'cached': True}, status=status.HTTP_200_OK)
+
+        try:
+            token = shared_cache.get_token(realm_id)
+        except QuickBooksToken.DoesNotExist:
+            logger.error(f"An error occurred query: realm_id does not exist")
+            return Response({"error": "realm_id does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+        url = f'{settings.QUICKBOOKURL}/{realm_id}/query'
+        headers = {
+            'Authorization': f'Bearer {token.access_token}',
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+        response = upstream.coalesced_get(realm_id, f'{url}?{urlencode({"query": query})}', headers=headers)
+        if response.status_code != 200:
+            message = response.json()['Fault']['Error'][0]['Message']
+            logger.error(f"An error occurred query: {message}")
+            return Response({'error': message}, status=response.status_code)
+        data = response.json()
+        shared_cache.set_query(cache_key, data)
+        return Response({'success': project_query_response(data, entity, fields), 'query': query, 'cached': False}, status=status.HTTP_200_OK)
@@ -0,0 +1,251 @@
+# quickbooks/write_behind.py
+"""
+Optional write-behind buffer for the create/update write-through.
+
+With QUICKBOOKS_WRITE_BEHIND on, write_through() hands each entity to the buffer
+instead of writing it to the mirror itself. The buffer keeps the latest version of
+each entity per (realm, entity type) and a background thread flushes everything
+every QUICKBOOKS_WRITE_BEHIND_INTERVAL_MS, or sooner once
+QUICKBOOKS_WRITE_BEHIND_MAX_ROWS are waiting, with one bulk upsert per group.
+
+Durability: every entity is appended to a journal segment before it is buffered,
+and a segment is deleted only after everything in it has been flushed. The buffer
+is flushed at interpreter exit. Segments left behind by a process that died are
+replayed by the next buffer to start (or by `manage.py replay_write_behind`);
+segments still locked by a live process are left alone. Appends are flushed to the
+OS but not fsynced, so the journal survives a worker crash but not an OS crash or
+power loss; entities lost that way are repaired by the next sync, as QuickBooks
+holds the data. Neither a flush nor a replay overwrites a newer SyncToken already
+in the mirror, e.g. one written meanwhile by a list sync or another worker.
+
+The journal uses POSIX file locks (fcntl), so write-behind is not available on
+Windows; views only import this module when QUICKBOOKS_WRITE_BEHIND is on.
+
+Until a flush, readers of the mirror may see the previous version of an entity;
+the entity cache is still updated immediately by write_through().
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+from .concurrency import ENTITY_MODELS
+from . import shared_cache
+import logging
+logger = logging.getLogger('quickbooks')
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _newer_than_mirror(realm_id, entity, records):
+    """Drop records whose SyncToken the mirror already has or has passed."""
+    model = ENTITY_MODELS[entity]
+    current = dict(model.objects.filter(realm_id=realm_id, id_ref__in=list(records)).values_list('id_ref', 'sync_token'))
+    newer = {}
+    for id_ref, record in records.items():
+        mirrored, incoming = current.get(id_ref), str(record.get('SyncToken', ''))
+        if mirrored and mirrored.isdigit() and incoming.isdigit() and int(mirrored) >= int(incoming):
+            continue
+        newer[id_ref] = record
+    return newer
+
+
+class Journal:
+    """Append-only JSON-lines segments, one open segment per process, locked while it is in use."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.sequence = 0
+        self.closed = []
+        self.file = None
+        self._open_segment()
+
+    def _open_segment(self):
+        self.sequence += 1
+        path = os.path.join(self.directory, f'{os.getpid()}-{int(time.time() * 1000)}-{self.sequence}.jsonl')
+        self.file = open(path, 'a', encoding='utf-8')
+        fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def append(self, entry):
+        self.file.write(json.dumps(entry, default=str) + '\n')
+        # Out of the process, so a crashed worker's writes survive for replay (not fsynced, see above)
+        self.file.flush()
+
+    def rotate(self):
+        """Start a new segment; the previous one is kept until release()."""
+        self.closed.append(self.file)
+        self._open_segment()
+
+    def release(self):
+        """Delete the rotated segments, whose entries have all been flushed."""
+        for segment in self.closed:
+            os.remove(segment.name)
+            segment.close()
+        self.closed = []
+
+    def close(self):
+        self.release()
+        os.remove(self.file.name)
+        self.file.close()
+
+
+def _segment_order(path):
+    # <pid>-<created ms>-<sequence>.jsonl
+    _, created, sequence = os.path.basename(path)[:-len('.jsonl')].split('-')
+    return int(created), int(sequence)
+
+
+def orphaned_segments(directory):
+    """Segments no live process holds, oldest first, as (path, locked file) pairs."""
+    segments = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.jsonl')), key=_segment_order):
+        segment = open(path, 'r', encoding='utf-8')
+        try:
+            fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            segment.close()
+            continue
+        segments.append((path, segment))
+    return segments
+
+
+def replay(writers, directory=None):
+    """Write the entities of orphaned journal segments to the mirror; returns how many were written."""
+    directory = directory or settings.QUICKBOOKS_WRITE_BEHIND_JOURNAL
+    if not os.path.isdir(directory):
+        return 0
+    pending = {}
+    segments = orphaned_segments(directory)
+    for path, segment in segments:
+        for line in segment:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn last line from the crash; everything before it is intact
+                continue
+            pending.setdefault((entry['realm_id'], entry['entity']), {})[entry['record']['Id']] = entry['record']
+
+    written = 0
+    for (realm_id, entity), records in pending.items():
+        records = _newer_than_mirror(realm_id, entity, records)
+        if records:
+            writers[entity](realm_id, list(records.values()))
+            shared_cache.bump_mirror_version(realm_id)
+            written += len(records)
+    for path, segment in segments:
+        os.remove(path)
+        segment.close()
+    if segments:
+        logger.info(f"Replayed {written} entities from {len(segments)} write-behind journal segments")
+    return written
+
+
+class WriteBehindBuffer:
+    def __init__(self, writers, interval_ms, max_rows, journal_dir):
+        self.writers = writers
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self.journal = Journal(journal_dir)
+        self.pending = {}
+        self.rows = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='quickbooks-write-behind', daemon=True)
+        self.thread.start()
+
+    def add(self, realm_id, entity, record):
+        with self.condition:
+            self.journal.append({'realm_id': realm_id, 'entity': entity, 'record': record})
+            group = self.pending.setdefault((realm_id, entity), {})
+            if record['Id'] not in group:
+                self.rows += 1
+            group[record['Id']] = record
+            if self.rows >= self.max_rows:
+                self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.stopped and self.rows < self.max_rows:
+                    self.condition.wait(self.interval)
+                stopped = self.stopped
+            self.flush()
+            if stopped:
+                return
+
+    def flush(self):
+        """Write everything buffered so far, one bulk upsert per realm and entity type."""
+        with self.condition:
+            if not self.pending:
+                return
+            batch, self.pending, self.rows = self.pending, {}, 0
+            self.journal.rotate()
+
+        close_old_connections()
+        failed = {}
+        started = time.perf_counter()
+        for (realm_id, entity), records in batch.items():
+            try:
+                records = _newer_than_mirror(realm_id, entity, records)
+                if not records:
+                    continue
+                self.writers[entity](realm_id, list(records.values()))
+                shared_cache.bump_mirror_version(realm_id)
+            except Exception as e:
+                logger.error(f"Write-behind flush of {len(records)} {entity} rows for realm {realm_id} failed: {e}")
+                failed[(realm_id, entity)] = records
+        logger.debug(f"Write-behind flushed {sum(len(records) for records in batch.values())} rows "
+                     f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+        with self.condition:
+            if not failed:
+                self.journal.release()
+                return
+            # Retry on the next tick; entities updated again meanwhile keep their newer version
+            for key, records in failed.items():
+                group = self.pending.setdefault(key, {})
+                for id_ref, record in records.items():
+                    if id_ref not in group:
+                        group[id_ref] = record
+                        self.rows += 1
+
+    def close(self):
+        with self.condition:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+        if not self.pending:
+            self.journal.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def buffer(writers):
+    """The process's buffer, started (after replaying orphaned journal segments) on first use."""
+    global _buffer
+    if _buffer is None:
+        if fcntl is None:
+            raise ImproperlyConfigured("QUICKBOOKS_WRITE_BEHIND needs POSIX file locking (fcntl), which this platform lacks")
+        with _buffer_lock:
+            if _buffer is None:
+                replay(writers)
+                _buffer = WriteBehindBuffer(
+                    writers,
+                    settings.QUICKBOOKS_WRITE_BEHIND_INTERVAL_MS,
+                    settings.QUICKBOOKS_WRITE_BEHIND_MAX_ROWS,
+                    settings.QUICKBOOKS_WRITE_BEHIND_JOURNAL,
+                )
+                atexit.register(_buffer.close)
+    return _buffer